@@ -0,0 +1,190 @@
+"""
+Quality and speed of section matching on synthetic PDFs whose repeating sections (header, footer, logo) are known.
+For every matcher it reports the pairwise precision and recall of the section groups against the ground truth,
+the agreement with the current matcher and the wall time of matching all pages.
+
+A matcher is a function that gets an opened PdfFile and matches all its pages again, it must leave the groups
+in PdfFile.sections_groups. The built-in ones are in MATCHERS, others are given as module:function, e.g.
+
+    python benchmarks/bench_matching.py --pages 20 100 --matcher my_matchers:match_by_hash
+"""
+import argparse
+import importlib
+import re
+import sys
+import time
+import types
+from collections import Counter
+from difflib import SequenceMatcher
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import common
+from bench_pipeline import rematch_all_pages
+from synthetic_pdf import SyntheticPdfSpec, get_or_generate_pdf, load_labels
+
+from pdf2reader.pdf_file import PdfFile, Section
+
+BENCHMARK = "matching"
+
+
+def match_current(pdf_file: PdfFile):
+    """ PdfFile._match_page_sections as used when opening a file """
+    rematch_all_pages(pdf_file)
+
+
+def _masked_text(section: Section) -> str:
+    return re.sub(r"\d+", "#", section.get_text())
+
+
+def _similarity_with_location_and_text(pdf_file: PdfFile, section1: Section, section2: Section) -> float:
+    if section1.location is not None and section2.location is not None:  # Not known for some sections
+        location_x_diff = abs(section1.location[0] - section2.location[0])
+        location_y_diff = abs(section1.location[1] - section2.location[1])
+        if (location_x_diff > pdf_file.max_absolute_location_diff
+                or location_y_diff > pdf_file.max_absolute_location_diff):
+            return 0
+    similarity = PdfFile._get_section_similarity(pdf_file, section1, section2)
+    if similarity and section1.typ == Section.SectionType.TEXT:
+        similarity *= SequenceMatcher(None, _masked_text(section1), _masked_text(section2)).ratio()
+    return similarity
+
+
+def match_location_and_text(pdf_file: PdfFile):
+    """
+    The current matcher with the location of the whole sections checked (the current one compares the first
+    section's location with itself) and with the texts compared, numbers (page numbers) are ignored
+    """
+    pdf_file._get_section_similarity = types.MethodType(_similarity_with_location_and_text, pdf_file)
+    try:
+        rematch_all_pages(pdf_file)
+    finally:
+        del pdf_file._get_section_similarity
+
+
+MATCHERS: Dict[str, Callable[[PdfFile], None]] = {
+    "current": match_current,
+    "location_and_text": match_location_and_text,
+}
+
+
+def load_matcher(name: str) -> Callable[[PdfFile], None]:
+    if name in MATCHERS:
+        return MATCHERS[name]
+    module_name, _, function_name = name.partition(":")
+    if not function_name:
+        raise ValueError(f"Unknown matcher {name}, use one of {list(MATCHERS)} or module:function")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def get_section_labels(pdf_file: PdfFile, labels: List[List[str]]) -> Dict[int, str]:
+    """ Ground truth label of every matched (text and object) section, by id of the section """
+    section_labels = {}
+    for page_number, page_labels in enumerate(labels):
+        sections = [section for section in pdf_file.get_page(page_number).sections
+                    if section.typ != Section.SectionType.OTHER]
+        if len(sections) != len(page_labels):
+            raise ValueError(f"Page {page_number} has {len(sections)} sections, but {len(page_labels)} drawn items")
+        for section, label in zip(sections, page_labels):
+            section_labels[id(section)] = label
+    return section_labels
+
+
+def _pairs(n: int) -> int:
+    return n * (n - 1) // 2
+
+
+def pairwise_scores(groups: List[list], true_groups: List[list]) -> Dict[str, float]:
+    """
+    Precision and recall of the pairs of sections put into the same group.
+    Both groupings are lists of groups of the same items, e.g. section labels or ids.
+    """
+    true_group_of = {item: i for i, group in enumerate(true_groups) for item in group}
+    predicted_pairs = sum(_pairs(len(group)) for group in groups)
+    true_pairs = sum(_pairs(len(group)) for group in true_groups)
+    correct_pairs = sum(_pairs(count) for group in groups
+                        for count in Counter(true_group_of.get(item) for item in group).values())
+    return {
+        "precision": correct_pairs / predicted_pairs if predicted_pairs else 1.,
+        "recall": correct_pairs / true_pairs if true_pairs else 1.,
+    }
+
+
+def get_groups(pdf_file: PdfFile) -> List[List[int]]:
+    """ Section groups as lists of section ids """
+    return [[id(section) for section in group.sections] for group in pdf_file.sections_groups]
+
+
+def run_matcher(pdf_file: PdfFile, matcher: Callable[[PdfFile], None], repeat: int) -> dict:
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        matcher(pdf_file)
+        seconds.append(time.perf_counter() - start)
+    return {"seconds": min(seconds), "groups": get_groups(pdf_file)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[20, 100, 400])
+    parser.add_argument("--matcher", nargs="+", default=list(MATCHERS),
+                        help="Matchers to compare, names from MATCHERS or module:function")
+    parser.add_argument("--text-sections", type=int, default=SyntheticPdfSpec.text_sections)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of every matcher, the fastest is reported")
+    parser.add_argument("--data-dir", type=Path, default=common.DEFAULT_DATA_DIR)
+    parser.add_argument("--output", type=Path, help="Write the report (JSON) to this file")
+    parser.add_argument("--baseline", type=Path, default=common.default_baseline_path(BENCHMARK))
+    parser.add_argument("--save-baseline", action="store_true", help="Write the report as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Relative slowdown reported as a regression")
+    parser.add_argument("--quality-tolerance", type=float, default=0.,
+                        help="Relative drop of precision or recall reported as a regression")
+    parser.add_argument("--log-level", default="ERROR")
+    args = parser.parse_args()
+    common.setup_logging(args.log_level)
+    matchers = {name: load_matcher(name) for name in args.matcher}
+
+    seconds, quality = {}, {}  # {metric: {pages: value}}, metric is "<matcher>/<measurement>"
+    for pages in args.pages:
+        spec = SyntheticPdfSpec(pages=pages, text_sections=args.text_sections, logo=True)
+        path = get_or_generate_pdf(args.data_dir, spec)
+        print(f"{pages} pages", file=sys.stderr)
+
+        pdf_file = PdfFile.open(str(path))
+        section_labels = get_section_labels(pdf_file, load_labels(path))
+        sections_by_label = {}
+        for section_id, label in section_labels.items():
+            sections_by_label.setdefault(label, []).append(section_id)
+        true_groups = list(sections_by_label.values())
+
+        current_groups = None
+        for name, matcher in matchers.items():
+            result = run_matcher(pdf_file, matcher, args.repeat)
+            if name == "current":
+                current_groups = result["groups"]
+            scores = pairwise_scores(result["groups"], true_groups)
+            if current_groups is not None and name != "current":
+                agreement = pairwise_scores(result["groups"], current_groups)
+                scores.update({f"agreement_{key}": value for key, value in agreement.items()})
+            seconds.setdefault(f"{name}/seconds", {})[str(pages)] = round(result["seconds"], 6)
+            for key, value in scores.items():
+                quality.setdefault(f"{name}/{key}", {})[str(pages)] = round(value, 4)
+        del pdf_file
+
+    common.print_table(seconds, common.scaling_curves(seconds), "s")
+    common.print_table(quality, {}, "")
+
+    report = common.new_report(BENCHMARK, pages=args.pages, text_sections=args.text_sections, repeat=args.repeat,
+                               seconds=seconds, scaling=common.scaling_curves(seconds), quality=quality)
+    regressions = common.check_baseline(report, "seconds", args.baseline, args.tolerance)
+    if args.baseline.exists():
+        regressions += common.check_baseline(report, "quality", args.baseline, args.quality_tolerance,
+                                             higher_is_better=True)
+    if args.output:
+        common.write_report(report, args.output)
+    if args.save_baseline:
+        common.write_report(report, args.baseline)
+    sys.exit(1 if regressions and not args.save_baseline else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Memory used by PdfFile for synthetic PDFs of increasing page and image counts. Every document is processed in its
+own subprocess, which records after open, after optimize_images and after save:
+- peak RSS so far and current RSS
+- tracemalloc current and peak (since the previous phase) and the top allocating lines
+- Python memory of the parsed pages (pages, sections, their content stores and instructions), after open
+
+Metrics that grow faster than linearly with the page count are flagged, as are regressions against the baseline.
+
+    python benchmarks/bench_memory.py --pages 20 80 320 --images-per-page 0 2
+"""
+import argparse
+import gc
+import json
+import resource
+import subprocess
+import sys
+import tracemalloc
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import common
+from synthetic_pdf import SyntheticPdfSpec, get_or_generate_pdf
+
+BENCHMARK = "memory"
+PHASES = ("open", "optimize_images", "save")
+# Allocations of PdfPage, Section and PageContentStore, and of the content stream instructions they keep
+PAGES_MEMORY_FILES = ("*pdf2reader/pdf_file.py", "*pikepdf/models/_content_stream.py")
+
+
+def _peak_rss() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Bytes on macOS, KiB on Linux
+
+
+def _current_rss() -> int or None:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return None
+
+
+def _measure(snapshot_top: int) -> dict:
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot()
+    top = [{"location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", "bytes": stat.size,
+            "count": stat.count} for stat in snapshot.statistics("lineno")[:snapshot_top]]
+    pages_memory = sum(stat.size for stat in snapshot.filter_traces(
+        [tracemalloc.Filter(True, pattern) for pattern in PAGES_MEMORY_FILES]).statistics("filename"))
+    if hasattr(tracemalloc, "reset_peak"):  # Python 3.9+, otherwise peaks are since the start
+        tracemalloc.reset_peak()
+    return {"peak_rss": _peak_rss(), "rss": _current_rss(), "traced": current, "traced_peak": peak,
+            "pages_memory": pages_memory, "top_allocations": top}
+
+
+def run_worker(path: str, images_quality: int, snapshot_top: int) -> dict:
+    """ Runs in the subprocess, the measurements of all phases """
+    from pdf2reader.pdf_file import PdfFile
+
+    tracemalloc.start()
+    phases = {}
+    pdf_file = PdfFile.open(path)
+    phases["open"] = _measure(snapshot_top)
+    phases["open"]["sections"] = sum(len(page.sections) for page in pdf_file.pages_parsed)
+
+    pdf_file.optimize_images(images_quality)
+    phases["optimize_images"] = _measure(snapshot_top)
+
+    with TemporaryDirectory() as temp_dir:
+        pdf_file.save(str(Path(temp_dir) / "output.pdf"))
+    phases["save"] = _measure(snapshot_top)
+    return phases
+
+
+def measure_in_subprocess(path: Path, images_quality: int, snapshot_top: int, log_level: str) -> dict:
+    process = subprocess.run([sys.executable, __file__, "--worker", str(path), "--images-quality", str(images_quality),
+                              "--snapshot-top", str(snapshot_top), "--log-level", log_level],
+                             stdout=subprocess.PIPE, check=True)
+    return json.loads(process.stdout.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[20, 80, 320])
+    parser.add_argument("--images-per-page", type=int, nargs="+", default=[0, 2],
+                        help="Each value is a separate series, half of the images are JPEGs and half PNGs")
+    parser.add_argument("--text-sections", type=int, default=SyntheticPdfSpec.text_sections)
+    parser.add_argument("--images-quality", type=int, default=30)
+    parser.add_argument("--snapshot-top", type=int, default=10, help="Top allocating lines kept for each phase")
+    parser.add_argument("--superlinear-exponent", type=float, default=1.15,
+                        help="Scaling exponent over which a metric is flagged as super-linear")
+    parser.add_argument("--data-dir", type=Path, default=common.DEFAULT_DATA_DIR)
+    parser.add_argument("--output", type=Path, help="Write the report (JSON) to this file")
+    parser.add_argument("--baseline", type=Path, default=common.default_baseline_path(BENCHMARK))
+    parser.add_argument("--save-baseline", action="store_true", help="Write the report as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative growth reported as a regression")
+    parser.add_argument("--log-level", default="ERROR")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    common.setup_logging(args.log_level)
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.images_quality, args.snapshot_top)))
+        return
+
+    results = {}  # {metric: {pages: bytes}}, metric is "<series>/<phase>/<measurement>"
+    details = {}
+    for images in args.images_per_page:
+        series = f"images{images}"
+        for pages in args.pages:
+            spec = SyntheticPdfSpec(pages=pages, text_sections=args.text_sections,
+                                    jpeg_images=(images + 1) // 2, png_images=images // 2)
+            path = get_or_generate_pdf(args.data_dir, spec)
+            print(f"{series}: {pages} pages ({path.stat().st_size / 2 ** 20:.1f} MB)", file=sys.stderr)
+
+            phases = measure_in_subprocess(path, args.images_quality, args.snapshot_top, args.log_level)
+            details.setdefault(series, {})[str(pages)] = phases
+            for phase in PHASES:
+                for measurement in ("peak_rss", "rss", "traced_peak"):
+                    results.setdefault(f"{series}/{phase}/{measurement}", {})[str(pages)] = phases[phase][measurement]
+            results.setdefault(f"{series}/pages_memory", {})[str(pages)] = phases["open"]["pages_memory"]
+
+    curves = common.scaling_curves(results)
+    mib_results = {metric: {pages: value / 2 ** 20 if value is not None else None for pages, value in by_pages.items()}
+                   for metric, by_pages in results.items()}
+    common.print_table(mib_results, curves, "MiB")
+
+    # Fixed costs (interpreter, libraries) hide the growth of RSS at small page counts, the pages memory has none
+    superlinear = sorted(metric for metric, exponent in curves.items()
+                         if exponent is not None and exponent > args.superlinear_exponent)
+    for metric in superlinear:
+        print(f"SUPER-LINEAR {metric}: grows as pages^{curves[metric]}")
+    for series, by_pages in details.items():
+        largest = max(by_pages, key=int)
+        print(f"{series}, {largest} pages: {by_pages[largest]['open']['sections']} sections, "
+              f"{by_pages[largest]['open']['pages_memory'] / max(1, by_pages[largest]['open']['sections']):.0f} "
+              f"bytes per section; top allocations after open:")
+        for allocation in by_pages[largest]["open"]["top_allocations"][:5]:
+            print(f"    {allocation['bytes'] / 2 ** 20:8.2f} MiB {allocation['count']:>8} {allocation['location']}")
+
+    report = common.new_report(BENCHMARK, pages=args.pages, images_per_page=args.images_per_page,
+                               text_sections=args.text_sections, images_quality=args.images_quality,
+                               bytes=results, scaling=curves, superlinear=superlinear, phases=details)
+    regressions = common.check_baseline(report, "bytes", args.baseline, args.tolerance)
+    if args.output:
+        common.write_report(report, args.output)
+    if args.save_baseline:
+        common.write_report(report, args.baseline)
+    sys.exit(1 if (regressions or superlinear) and not args.save_baseline else 0)
+
+
+if __name__ == "__main__":
+    main()
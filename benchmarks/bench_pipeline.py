@@ -0,0 +1,109 @@
+"""
+Times the PdfFile pipeline on synthetic PDFs of several page counts:
+open (parse, match and image extraction), matching alone (_match_page_sections of all pages), rendering of all
+pages, optimize_images and save. Prints the times with their scaling exponents and compares them to a JSON baseline.
+
+    python benchmarks/bench_pipeline.py --pages 10 50 200
+    python benchmarks/bench_pipeline.py --pages 10 50 200 --save-baseline  # After a change that is accepted
+"""
+import argparse
+import gc
+import sys
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import common
+from synthetic_pdf import SyntheticPdfSpec, get_or_generate_pdf
+
+from pdf2reader.pdf_file import PdfFile
+
+BENCHMARK = "pipeline"
+STAGES = ("open", "match", "render", "optimize_images", "save")
+
+
+def _timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def rematch_all_pages(pdf_file: PdfFile):
+    """ Forgets the section groups and matches all pages again, as the loading does """
+    for page in pdf_file.pages_parsed:
+        for section in page.sections:
+            section.section_group = None
+    pdf_file.sections_groups = []
+    for page_index in range(pdf_file.page_count):
+        pdf_file._match_page_sections(page_index)
+
+
+def run_once(path: Path, render_scale: float, images_quality: int) -> dict:
+    """ Seconds of every stage on a freshly opened file, and the stage timings recorded by PdfFile.stats """
+    times = {}
+    start = time.perf_counter()
+    pdf_file = PdfFile.open(str(path))
+    times["open"] = time.perf_counter() - start
+    open_stats = pdf_file.stats.as_dict()
+
+    times["match"] = _timed(lambda: rematch_all_pages(pdf_file))
+    times["render"] = _timed(lambda: [pdf_file.get_page(i).get_original_rendered_image(render_scale)
+                                      for i in range(pdf_file.page_count)])
+    times["optimize_images"] = _timed(lambda: pdf_file.optimize_images(images_quality))
+    with TemporaryDirectory() as temp_dir:
+        times["save"] = _timed(lambda: pdf_file.save(str(Path(temp_dir) / "output.pdf")))
+
+    del pdf_file
+    gc.collect()
+    return {"seconds": times, "open_stages": open_stats["stages"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 50, 200], help="Page counts to benchmark")
+    parser.add_argument("--text-sections", type=int, default=SyntheticPdfSpec.text_sections)
+    parser.add_argument("--jpeg-images", type=int, default=SyntheticPdfSpec.jpeg_images)
+    parser.add_argument("--png-images", type=int, default=SyntheticPdfSpec.png_images)
+    parser.add_argument("--nesting-depth", type=int, default=SyntheticPdfSpec.nesting_depth)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per page count, the fastest is reported")
+    parser.add_argument("--render-scale", type=float, default=1.)
+    parser.add_argument("--images-quality", type=int, default=30)
+    parser.add_argument("--data-dir", type=Path, default=common.DEFAULT_DATA_DIR)
+    parser.add_argument("--output", type=Path, help="Write the report (JSON) to this file")
+    parser.add_argument("--baseline", type=Path, default=common.default_baseline_path(BENCHMARK))
+    parser.add_argument("--save-baseline", action="store_true", help="Write the report as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Relative slowdown reported as a regression")
+    parser.add_argument("--log-level", default="ERROR")
+    args = parser.parse_args()
+    common.setup_logging(args.log_level)
+
+    base_spec = SyntheticPdfSpec(text_sections=args.text_sections, jpeg_images=args.jpeg_images,
+                                 png_images=args.png_images, nesting_depth=args.nesting_depth)
+    results = {stage: {} for stage in STAGES}
+    open_stages = {}
+    for pages in args.pages:
+        spec = SyntheticPdfSpec(**{**base_spec.as_dict(), "pages": pages})
+        path = get_or_generate_pdf(args.data_dir, spec)
+        print(f"{pages} pages ({path.stat().st_size / 2 ** 20:.1f} MB)", file=sys.stderr)
+
+        runs = [run_once(path, args.render_scale, args.images_quality) for _ in range(args.repeat)]
+        for stage in STAGES:
+            results[stage][str(pages)] = round(min(run["seconds"][stage] for run in runs), 6)
+        open_stages[str(pages)] = min(runs, key=lambda run: run["seconds"]["open"])["open_stages"]
+
+    curves = common.scaling_curves(results)
+    report = common.new_report(BENCHMARK, spec=base_spec.as_dict(), repeat=args.repeat,
+                               render_scale=args.render_scale, images_quality=args.images_quality,
+                               seconds=results, scaling=curves, open_stages=open_stages)
+    common.print_table(results, curves, "s")
+
+    regressions = common.check_baseline(report, "seconds", args.baseline, args.tolerance)
+    if args.output:
+        common.write_report(report, args.output)
+    if args.save_baseline:
+        common.write_report(report, args.baseline)
+    sys.exit(1 if regressions and not args.save_baseline else 0)
+
+
+if __name__ == "__main__":
+    main()
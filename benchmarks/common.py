@@ -0,0 +1,131 @@
+"""
+Shared parts of the benchmarks: results and baseline files, scaling curves and the import of pdf2reader from the
+source tree (the benchmarks also run without installing the package).
+"""
+import json
+import logging
+import math
+import os
+import platform
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+BASELINES_DIR = BENCHMARKS_DIR / "baselines"
+DEFAULT_DATA_DIR = BENCHMARKS_DIR / ".data"  # Generated PDFs, reused between runs
+
+sys.path.insert(0, str(BENCHMARKS_DIR.parent / "src"))
+
+
+def setup_logging(level: str = "ERROR"):
+    # Matching and optimization log a lot on DEBUG, which would be measured too
+    logging.basicConfig(stream=sys.stderr, level=level)
+
+
+def machine_info() -> dict:
+    import fitz
+    import pikepdf
+
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "pikepdf": pikepdf.__version__,
+        "pymupdf": fitz.VersionBind,
+    }
+
+
+def scaling_exponent(sizes: List[float], values: List[float]) -> float or None:
+    """
+    Slope of log(value) over log(size) (least squares), the k of value ~ size^k.
+    About 1 is linear scaling, clearly more than 1 is super-linear.
+    """
+    points = [(math.log(s), math.log(v)) for s, v in zip(sizes, values) if s > 0 and v and v > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if var_x == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+
+
+def scaling_curves(results: Dict[str, Dict[str, float]]) -> Dict[str, float or None]:
+    """ Scaling exponent of every metric in {metric: {scale: value}} """
+    curves = {}
+    for metric, by_scale in results.items():
+        scales = sorted(by_scale, key=int)
+        exponent = scaling_exponent([int(s) for s in scales], [by_scale[s] for s in scales])
+        curves[metric] = round(exponent, 3) if exponent is not None else None
+    return curves
+
+
+def new_report(benchmark: str, **fields) -> dict:
+    return {"benchmark": benchmark, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "machine": machine_info(), **fields}
+
+
+def write_report(report: dict, path: str or Path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, indent=2, sort_keys=True) + "\n")
+    print(f"Wrote {path}")
+
+
+def load_report(path: str or Path) -> dict or None:
+    path = Path(path)
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())
+
+
+def default_baseline_path(benchmark: str) -> Path:
+    return BASELINES_DIR / f"{benchmark}.json"
+
+
+def compare_to_baseline(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+                        tolerance: float, higher_is_better: bool = False) -> List[str]:
+    """
+    Compares {metric: {scale: value}} to the same from a baseline, returns descriptions of the values that
+    got worse by more than `tolerance` (relative). Metrics or scales missing in either are skipped.
+    """
+    regressions = []
+    for metric, by_scale in results.items():
+        for scale, value in by_scale.items():
+            base = baseline.get(metric, {}).get(scale)
+            if not base or value is None:
+                continue
+            change = (value - base) / base
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{metric} at {scale}: {value:.4g} (baseline {base:.4g}, {change:+.0%})")
+    return regressions
+
+
+def print_table(results: Dict[str, Dict[str, float]], curves: Dict[str, float or None], unit: str):
+    scales = sorted({scale for by_scale in results.values() for scale in by_scale}, key=int)
+    suffix = f" [{unit}]" if unit else ""
+    width = max(len(metric + suffix) for metric in results) + 2
+    print(f"{'':<{width}}" + "".join(f"{scale:>12}" for scale in scales) + f"{'exponent':>12}")
+    for metric, by_scale in results.items():
+        values = "".join(f"{by_scale[s]:>12.4g}" if by_scale.get(s) is not None else f"{'-':>12}" for s in scales)
+        exponent = curves.get(metric)
+        print(f"{metric + suffix:<{width}}{values}{exponent if exponent is not None else '-':>12}")
+
+
+def check_baseline(report: dict, key: str, baseline_path: str or Path, tolerance: float,
+                   higher_is_better: bool = False) -> List[str]:
+    """ Prints and returns the regressions of report[key] against the same key in the baseline file """
+    baseline = load_report(baseline_path)
+    if baseline is None:
+        print(f"No baseline at {baseline_path}, write one with --save-baseline")
+        return []
+    if baseline.get("machine") != report.get("machine"):
+        print("Baseline was measured on a different machine or library versions, compare with care")
+    regressions = compare_to_baseline(report[key], baseline.get(key, {}), tolerance, higher_is_better)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print(f"No regressions against {baseline_path} (tolerance {tolerance:.0%})")
+    return regressions
@@ -0,0 +1,188 @@
+"""
+Generator of synthetic PDFs for the benchmarks, built with pikepdf so it does not need any other PDF tools.
+Pages look like a typical book or paper page: running header and footer with the page number, body text sections
+and images, drawn inside nested q / cm graphic states. The generator also returns which drawn items repeat
+between pages, the ground truth of section matching.
+"""
+import io
+import json
+import zlib
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+import pikepdf
+from PIL import Image
+
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792
+
+
+@dataclass
+class SyntheticPdfSpec:
+    pages: int = 10
+    text_sections: int = 8  # Body text sections per page
+    lines_per_section: int = 3
+    header: bool = True  # Running header with the page number in it
+    logo: bool = False  # The same small image drawn next to the header on every page
+    footer: bool = True  # Page number at the bottom
+    jpeg_images: int = 1  # Images per page, every page has its own images
+    png_images: int = 1
+    image_size: int = 256  # Pixels of the longer image side
+    nesting_depth: int = 3  # Nested q / cm levels around the sections
+    seed: int = 0
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+    @property
+    def name(self) -> str:
+        return (f"p{self.pages}-t{self.text_sections}-j{self.jpeg_images}-n{self.png_images}"
+                f"-s{self.image_size}-d{self.nesting_depth}" + ("-logo" if self.logo else "")
+                + ("" if self.header else "-nh") + ("" if self.footer else "-nf"))
+
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore "
+         "magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo "
+         "consequat duis aute irure in reprehenderit voluptate velit esse cillum eu fugiat nulla pariatur").split()
+
+
+def _make_image_stream(pdf: pikepdf.Pdf, rng: np.random.Generator, size: int, jpeg: bool) -> pikepdf.Stream:
+    width, height = size, size * 3 // 4
+    # Smooth gradient with some noise, compresses like a photo / figure rather than like random data
+    y, x = np.mgrid[0:height, 0:width]
+    base = rng.integers(0, 256, 3)
+    pixels = np.stack([(x * (c + 1) + y * (3 - c) + base[c]) % 256 for c in range(3)], axis=-1)
+    pixels = np.clip(pixels + rng.normal(0, 8, pixels.shape), 0, 255).astype(np.uint8)
+
+    if jpeg:
+        data = io.BytesIO()
+        Image.fromarray(pixels).save(data, "JPEG", quality=90)
+        return pdf.make_stream(data.getvalue(), Type=pikepdf.Name.XObject, Subtype=pikepdf.Name.Image,
+                               Width=width, Height=height, ColorSpace=pikepdf.Name.DeviceRGB, BitsPerComponent=8,
+                               Filter=pikepdf.Name.DCTDecode)
+    return pdf.make_stream(zlib.compress(pixels.tobytes()), Type=pikepdf.Name.XObject, Subtype=pikepdf.Name.Image,
+                           Width=width, Height=height, ColorSpace=pikepdf.Name.DeviceRGB, BitsPerComponent=8,
+                           Filter=pikepdf.Name.FlateDecode)
+
+
+def _nested(content: str, depth: int, rng: np.random.Generator) -> str:
+    """ Wraps content into `depth` q / cm levels, that together only move it by a few points """
+    for _ in range(depth):
+        dx, dy = rng.uniform(-2, 2, 2)
+        content = f"q 1 0 0 1 {dx:.2f} {dy:.2f} cm\n{content}\nQ"
+    return content
+
+
+def _text_section(rng: np.random.Generator, x: float, y: float, lines: int, font_size: float) -> str:
+    text_lines = []
+    for i in range(lines):
+        words = " ".join(rng.choice(WORDS, 10))
+        text_lines.append(f"({words}) Tj" if i == 0 else f"0 {-font_size * 1.2:.1f} Td ({words}) Tj")
+    return f"BT /F1 {font_size} Tf {x:.1f} {y:.1f} Td\n" + "\n".join(text_lines) + "\nET"
+
+
+def _page_items(spec: SyntheticPdfSpec, page_number: int, rng: np.random.Generator) -> List[Tuple[str, str]]:
+    """
+    Drawn items of the page in content stream order, as (label, content). Items with the same label on different
+    pages are the same repeating element (header, footer, logo), other labels are unique.
+    """
+    items = []
+    if spec.header:
+        chapter = page_number // 20 + 1
+        items.append(("header", f"BT /F2 9 Tf 1 0 0 1 72 760 Tm (Synthetic document - chapter {chapter}) Tj "
+                                f"1 0 0 1 500 760 Tm (page {page_number + 1}) Tj ET"))
+    if spec.logo:
+        items.append(("logo", _nested("q 40 0 0 30 20 752 cm /Logo Do Q", spec.nesting_depth, rng)))
+
+    images = [f"/Im{i}" for i in range(spec.jpeg_images + spec.png_images)]
+    top, bottom = 730, 72
+    slot_height = (top - bottom) / max(1, spec.text_sections + len(images))
+    for i in range(spec.text_sections + len(images)):
+        y = top - i * slot_height
+        if i % 3 == 2 and images:  # Images between text sections
+            name = images.pop()
+            height = slot_height * 0.9
+            items.append((f"image{page_number}-{name}",
+                          _nested(f"q {height * 4 / 3:.1f} 0 0 {height:.1f} 72 {y - height:.1f} cm {name} Do Q",
+                                  spec.nesting_depth, rng)))
+        else:
+            items.append((f"text{page_number}-{i}",
+                          _nested(_text_section(rng, 72, y - 12, spec.lines_per_section, 11), spec.nesting_depth, rng)))
+    for name in images:
+        items.append((f"image{page_number}-{name}",
+                      _nested(f"q 120 0 0 90 420 {bottom + 20} cm {name} Do Q", spec.nesting_depth, rng)))
+
+    if spec.footer:
+        items.append(("footer", f"BT /F2 9 Tf 1 0 0 1 300 36 Tm ({page_number + 1}) Tj ET"))
+    return items
+
+
+def generate_pdf(path: str or Path, spec: SyntheticPdfSpec) -> List[List[str]]:
+    """
+    Writes a PDF made by `spec` to `path`, the same spec always gives the same file.
+    Returns the labels of the items drawn on each page (see _page_items), the ground truth for matching.
+    """
+    rng = np.random.default_rng(spec.seed)
+    pdf = pikepdf.Pdf.new()
+    body_font = pdf.make_indirect(pikepdf.Dictionary(Type=pikepdf.Name.Font, Subtype=pikepdf.Name.Type1,
+                                                     BaseFont=pikepdf.Name.Times_Roman))
+    header_font = pdf.make_indirect(pikepdf.Dictionary(Type=pikepdf.Name.Font, Subtype=pikepdf.Name.Type1,
+                                                       BaseFont=pikepdf.Name.Helvetica))
+
+    logo = _make_image_stream(pdf, rng, 64, jpeg=False) if spec.logo else None
+    labels = []
+    for page_number in range(spec.pages):
+        xobjects = {"/Logo": logo} if logo is not None else {}
+        for i in range(spec.jpeg_images + spec.png_images):
+            xobjects[f"/Im{i}"] = _make_image_stream(pdf, rng, spec.image_size, jpeg=i < spec.jpeg_images)
+
+        items = _page_items(spec, page_number, rng)
+        labels.append([label for label, _ in items])
+        page = pikepdf.Dictionary(
+            Type=pikepdf.Name.Page,
+            MediaBox=[0, 0, PAGE_WIDTH, PAGE_HEIGHT],
+            Resources=pikepdf.Dictionary(Font=pikepdf.Dictionary(F1=body_font, F2=header_font),
+                                         XObject=pikepdf.Dictionary(xobjects)),
+            Contents=pdf.make_stream(("\n".join(content for _, content in items) + "\n").encode()),
+        )
+        pdf.pages.append(pikepdf.Page(page))
+    pdf.save(path)
+    return labels
+
+
+def get_or_generate_pdf(directory: str or Path, spec: SyntheticPdfSpec) -> Path:
+    """ Generated PDF for `spec` in `directory`, generated only once. Its labels are next to it (load_labels). """
+    path = Path(directory) / f"synthetic-{spec.name}-seed{spec.seed}.pdf"
+    if not path.exists() or not _labels_path(path).exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix(".tmp")
+        labels = generate_pdf(temp_path, spec)
+        _labels_path(path).write_text(json.dumps(labels))
+        temp_path.replace(path)
+    return path
+
+
+def _labels_path(pdf_path: Path) -> Path:
+    return pdf_path.with_suffix(".labels.json")
+
+
+def load_labels(pdf_path: str or Path) -> List[List[str]]:
+    """ Labels of the items drawn on each page of a PDF from get_or_generate_pdf """
+    return json.loads(_labels_path(Path(pdf_path)).read_text())
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic PDF for benchmarks")
+    parser.add_argument("output")
+    for name, value in SyntheticPdfSpec().as_dict().items():
+        if isinstance(value, bool):
+            flag = f"--{name.replace('_', '-')}" if not value else f"--no-{name.replace('_', '-')}"
+            parser.add_argument(flag, dest=name, action="store_false" if value else "store_true")
+        else:
+            parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    args = vars(parser.parse_args())
+    output = args.pop("output")
+    generate_pdf(output, SyntheticPdfSpec(**args))
@@ -1,12 +1,58 @@
+import argparse
 import importlib.resources
 import logging
-import tkinter as tk
-from pdf2reader.gui.main_gui import MainGUI
+import os
 import sys
 
+from pdf2reader.profiling import PROFILE_DIR_ENV, PROFILE_MEMORY_ENV
+from pdf2reader.stats import STATS_PATH_ENV
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="pdf2reader", description="Convert PDFs to be more readable on ebook readers.")
+    parser.add_argument("--recipe", help="Edit recipe (JSON), convert INPUT to OUTPUT with it without the GUI")
+    parser.add_argument("--password", help="Password of the input PDF")
+    parser.add_argument("--stats", metavar="FILE",
+                        help=f"Append timings and counters of the processing stages to FILE as JSON lines "
+                             f"(also set by the {STATS_PATH_ENV} environment variable)")
+    parser.add_argument("--profile", metavar="DIR",
+                        help=f"Profile the processing stages and write .pstats and collapsed stack files to DIR "
+                             f"(also set by the {PROFILE_DIR_ENV} environment variable)")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="With --profile, also write tracemalloc snapshots of the stages")
+    parser.add_argument("--log-level", default="DEBUG", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    parser.add_argument("input", nargs="?", help="Input PDF, only with --recipe")
+    parser.add_argument("output", nargs="?", help="Output PDF, only with --recipe")
+    args = parser.parse_args()
+    if args.recipe and (not args.input or not args.output):
+        parser.error("--recipe needs INPUT and OUTPUT")
+    return args
+
+
+def convert(args: argparse.Namespace):
+    from pdf2reader.conversion import EditRecipe, convert_pdf_streaming
+
+    convert_pdf_streaming(args.input, args.output, EditRecipe.load(args.recipe), password=args.password,
+                          progress_callback=lambda done, total: logger.debug(f"Converted page {done}/{total}"))
+
 
 def main():
-    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    args = parse_args()
+    logging.basicConfig(stream=sys.stdout, level=args.log_level)
+    if args.stats:
+        os.environ[STATS_PATH_ENV] = args.stats  # For every PdfFile opened from now on
+    if args.profile:
+        os.environ[PROFILE_DIR_ENV] = args.profile
+        if args.profile_memory:
+            os.environ[PROFILE_MEMORY_ENV] = "1"
+    if args.recipe:
+        convert(args)
+        return
+
+    import tkinter as tk
+    from pdf2reader.gui.main_gui import MainGUI
 
     root_window = tk.Tk()
     root_window.title("PDF2Reader")
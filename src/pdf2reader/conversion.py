@@ -0,0 +1,163 @@
+import json
+import logging
+import re
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Callable, Dict, List
+
+import pikepdf
+
+from pdf2reader.images_optimization import OptimizationOptions, extract_pdf_images, optimize_pdf_images
+from pdf2reader.pdf_file import PdfFile, PdfPage, Section, add_image_visible_boxes, trim_images_to_visible_boxes
+from pdf2reader.profiling import profile_stage
+from pdf2reader.stats import PipelineStats
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SectionRemovalRule:
+    """ Sections that match all the set conditions are removed """
+    typ: str or None = None  # Section type, "text" or "object"
+    text_pattern: str or None = None  # Regular expression searched for in the section text
+    font: str or None = None  # Font resource name, e.g. "/F1"
+    area: List[float] or None = None  # [x0, y0, x1, y1], the section location (in PDF points) must be inside
+    pages: List[int] or None = None  # Page numbers (from 0)
+    xref: int or None = None  # Drawn object
+
+    def matches(self, section: Section) -> bool:
+        if section.typ == Section.SectionType.OTHER:
+            return False
+        if self.typ is not None and section.typ.value != self.typ:
+            return False
+        if self.pages is not None and section.page_number not in self.pages:
+            return False
+        if self.font is not None and section.get_additional("font") != self.font:
+            return False
+        if self.xref is not None and section.get_additional("xref") != self.xref:
+            return False
+        if self.area is not None:
+            x0, y0, x1, y1 = self.area
+            if not (min(x0, x1) <= section.location[0] <= max(x0, x1)
+                    and min(y0, y1) <= section.location[1] <= max(y0, y1)):
+                return False
+        if self.text_pattern is not None and re.search(self.text_pattern, section.get_text()) is None:
+            return False
+        return True
+
+
+@dataclass
+class EditRecipe:
+    """
+    Edits to apply to a PDF without opening it in the GUI, see convert_pdf_streaming.
+    Can be saved as JSON, or made from the edits of an opened PdfFile (from_pdf_file).
+    """
+    crop_area: List[float] or None = None  # [x0, y0, x1, y1] for all pages
+    page_crop_areas: Dict[int, List[float]] = field(default_factory=dict)  # Overrides crop_area for some pages
+    removal_rules: List[SectionRemovalRule] = field(default_factory=list)
+    removed_sections: Dict[int, List[int]] = field(default_factory=dict)  # Indexes of removed page sections by page
+
+    trim_images: bool = True
+    prune_invisible: bool = True
+
+    images_quality: int or None = None  # Images are optimized only if set
+    resize_images: bool = True
+    remove_images: bool = False
+
+    def apply(self, page: PdfPage, page_number: int):
+        crop_area = self.page_crop_areas.get(page_number, self.crop_area)
+        if crop_area:
+            page.crop_area = list(crop_area)
+
+        removed_sections = set(self.removed_sections.get(page_number, ()))
+        for i, section in enumerate(page.sections):
+            if i in removed_sections or any(rule.matches(section) for rule in self.removal_rules):
+                section.keep_in_output = False
+
+    @staticmethod
+    def from_pdf_file(pdf_file: PdfFile) -> "EditRecipe":
+        """ Recipe that produces the same output as saving `pdf_file` with its current edits """
+        pdf_file.wait_until_loaded()
+        recipe = EditRecipe()
+        for page_number, page in enumerate(pdf_file.pages_parsed):
+            if page.crop_area:
+                recipe.page_crop_areas[page_number] = list(page.crop_area)
+            removed = [i for i, section in enumerate(page.sections) if not section.keep_in_output]
+            if removed:
+                recipe.removed_sections[page_number] = removed
+        return recipe
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), indent=2)
+
+    @staticmethod
+    def from_json(text: str) -> "EditRecipe":
+        data = json.loads(text)
+        data["page_crop_areas"] = {int(k): v for k, v in data.get("page_crop_areas", {}).items()}
+        data["removed_sections"] = {int(k): v for k, v in data.get("removed_sections", {}).items()}
+        data["removal_rules"] = [SectionRemovalRule(**rule) for rule in data.get("removal_rules", [])]
+        return EditRecipe(**data)
+
+    def save(self, path: str or Path):
+        Path(path).write_text(self.to_json())
+
+    @staticmethod
+    def load(path: str or Path) -> "EditRecipe":
+        return EditRecipe.from_json(Path(path).read_text())
+
+
+def convert_pdf_streaming(input_path: str, output_path: str, recipe: EditRecipe, password: str = None,
+                          progress_callback: Callable[[int, int], None] = None, stats: PipelineStats = None):
+    """
+    Applies the recipe to the PDF one page at a time, with the same output as PdfFile.save with the same edits.
+    Pages are not rendered and each page is parsed only while it is edited, so the memory used does not grow
+    with the page count (apart from what qpdf keeps for the document itself).
+
+    :param progress_callback: Called with (pages done, page count) after each page is written
+    :param stats: Timings of the stages are recorded to it, by default as set by PDF2READER_STATS
+    """
+    stats = stats if stats is not None else PipelineStats.from_env()
+    with profile_stage("convert"):
+        _convert_pdf_streaming(input_path, output_path, recipe, password, progress_callback, stats)
+    stats.write_summary()
+    logger.info(f"Converted {input_path} to {output_path}")
+
+
+def _convert_pdf_streaming(input_path: str, output_path: str, recipe: EditRecipe, password: str or None,
+                           progress_callback: Callable[[int, int], None] or None, stats: PipelineStats):
+    with pikepdf.open(input_path, password=password or "", access_mode=pikepdf.AccessMode.mmap) as pdf, \
+            TemporaryDirectory() as temp_dir:
+        page_count = len(pdf.pages)
+
+        if recipe.images_quality is not None:
+            options = OptimizationOptions(jpg_quality=recipe.images_quality, png_quality=recipe.images_quality,
+                                          should_resize=recipe.resize_images,
+                                          should_remove_images=recipe.remove_images)
+            with stats.stage("extract_images"):
+                images = extract_pdf_images(pdf, temp_dir)
+            optimize_pdf_images(pdf, images, temp_dir, options, stats=stats)
+
+        # Trimming depends on the crops of all pages, so it needs its own pass over them
+        image_placements = {}
+        if recipe.trim_images:
+            visible_boxes = {}
+            with stats.stage("trim_images"):
+                for page_number in range(page_count):
+                    page = PdfPage(pdf.pages[page_number], page_number, stats=stats)
+                    recipe.apply(page, page_number)
+                    add_image_visible_boxes(visible_boxes, page)
+                image_placements, _ = trim_images_to_visible_boxes(pdf, visible_boxes)
+
+        with stats.stage("edit_pages", pages=page_count):
+            for page_number in range(page_count):
+                page = PdfPage(pdf.pages[page_number], page_number, stats=stats)
+                recipe.apply(page, page_number)
+                page.get_edited_pike_page(image_placements, recipe.prune_invisible)
+                del page  # Sections of the page are not needed anymore, only its new content stream
+                if progress_callback:
+                    progress_callback(page_number + 1, page_count)
+
+        with stats.stage("write", path=output_path):
+            pdf.remove_unreferenced_resources()
+            pdf.save(output_path)
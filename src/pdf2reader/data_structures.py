@@ -1,5 +1,6 @@
+from collections import defaultdict
 from dataclasses import dataclass
-from typing import Callable
+from typing import Any, Callable, Dict, List, Tuple
 
 
 @dataclass
@@ -10,3 +11,51 @@ class Box:
     y1: float
     color: str
     on_click: Callable[[list[float, float]], None]
+    section: Any = None  # Section the box marks, if any
+
+
+class BoxIndex:
+    """
+    Uniform grid over boxes, to find the boxes at a point or touching an area without checking all of them.
+    Queries return indexes into `boxes`, in their order.
+    """
+
+    def __init__(self, boxes: List[Box], cell_size: float = 32):
+        self.boxes = boxes
+        self.cell_size = cell_size
+        self._cells: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        for i, box in enumerate(boxes):
+            for cell in self._get_cells(*self._normalized(box)):
+                self._cells[cell].append(i)
+
+    @staticmethod
+    def _normalized(box: Box) -> Tuple[float, float, float, float]:
+        return min(box.x0, box.x1), min(box.y0, box.y1), max(box.x0, box.x1), max(box.y0, box.y1)
+
+    def _get_cells(self, x0: float, y0: float, x1: float, y1: float):
+        for cx in range(int(x0 // self.cell_size), int(x1 // self.cell_size) + 1):
+            for cy in range(int(y0 // self.cell_size), int(y1 // self.cell_size) + 1):
+                yield cx, cy
+
+    def query_point(self, x: float, y: float) -> List[int]:
+        """ Boxes that contain the point strictly inside """
+        result = []
+        for i in self._cells.get((int(x // self.cell_size), int(y // self.cell_size)), []):
+            x0, y0, x1, y1 = self._normalized(self.boxes[i])
+            if x0 < x < x1 and y0 < y < y1:
+                result.append(i)
+        return result
+
+    def query_area(self, x0: float, y0: float, x1: float, y1: float) -> List[int]:
+        """ Boxes that intersect the area """
+        x0, x1 = min(x0, x1), max(x0, x1)
+        y0, y1 = min(y0, y1), max(y0, y1)
+        candidates = set()
+        for cell in self._get_cells(x0, y0, x1, y1):
+            candidates.update(self._cells.get(cell, []))
+        result = []
+        for i in sorted(candidates):
+            bx0, by0, bx1, by1 = self._normalized(self.boxes[i])
+            if bx0 <= x1 and bx1 >= x0 and by0 <= y1 and by1 >= y0:
+                result.append(i)
+        return result
@@ -31,17 +31,22 @@ class CropSelector:
                                                                         self.crop_selected_area[2].get(),
                                                                         self.crop_selected_area[3].get()])
 
+    def _event_location(self, event) -> tuple[int, int]:
+        """ Event location in canvas coordinates, they differ from the window ones when the canvas is scrolled """
+        return int(round(self.canvas.canvasx(event.x))), int(round(self.canvas.canvasy(event.y)))
+
     def _drag_start(self, event):
         if not self.crop_enabled:
             return
+        x, y = self._event_location(event)
 
         if not self.crop_created:
             if self.crop_indicator:
                 self.crop_indicator.destroy()
             self.crop_indicator = self.CroppingSelection(self.canvas)
 
-            self.crop_selected_area[0].set(event.x)
-            self.crop_selected_area[1].set(event.y)
+            self.crop_selected_area[0].set(x)
+            self.crop_selected_area[1].set(y)
 
             self.crop_created = True
             self.drag_start_offset = [0, 0]
@@ -55,23 +60,23 @@ class CropSelector:
             left, top, right, bottom = (self.crop_selected_area[0].get(), self.crop_selected_area[1].get(),
                                         self.crop_selected_area[2].get(), self.crop_selected_area[3].get())
 
-            if right - 20 < event.x < right + 5:
+            if right - 20 < x < right + 5:
                 self.dragging_coordinates[0] = self.crop_selected_area[2]
-            elif left - 5 < event.x < left + 20:
+            elif left - 5 < x < left + 20:
                 self.dragging_coordinates[0] = self.crop_selected_area[0]
 
-            if bottom - 20 < event.y < bottom + 5:
+            if bottom - 20 < y < bottom + 5:
                 self.dragging_coordinates[1] = self.crop_selected_area[3]
-            elif top - 5 < event.y < top + 20:
+            elif top - 5 < y < top + 20:
                 self.dragging_coordinates[1] = self.crop_selected_area[1]
 
             self.drag_start_offset = [
-                (event.x - self.dragging_coordinates[0].get()) if self.dragging_coordinates[0] else 0,
-                (event.y - self.dragging_coordinates[1].get()) if self.dragging_coordinates[1] else 0]
+                (x - self.dragging_coordinates[0].get()) if self.dragging_coordinates[0] else 0,
+                (y - self.dragging_coordinates[1].get()) if self.dragging_coordinates[1] else 0]
 
             if self.dragging_coordinates[0] is None and self.dragging_coordinates[1] is None:
-                if left < event.x < right and top < event.y < bottom:
-                    self.drag_position = event.x, event.y
+                if left < x < right and top < y < bottom:
+                    self.drag_position = x, y
                     self.dragging = True
             else:
                 self.dragging = True
@@ -91,19 +96,20 @@ class CropSelector:
     def _drag(self, event):
         if not self.crop_enabled:
             return
+        x, y = self._event_location(event)
 
         if self.dragging:
             if self.dragging_coordinates[0] is None and self.dragging_coordinates[1] is None:
-                self.crop_selected_area[0].set(self.crop_selected_area[0].get() + (event.x - self.drag_position[0]))
-                self.crop_selected_area[1].set(self.crop_selected_area[1].get() + (event.y - self.drag_position[1]))
-                self.crop_selected_area[2].set(self.crop_selected_area[2].get() + (event.x - self.drag_position[0]))
-                self.crop_selected_area[3].set(self.crop_selected_area[3].get() + (event.y - self.drag_position[1]))
+                self.crop_selected_area[0].set(self.crop_selected_area[0].get() + (x - self.drag_position[0]))
+                self.crop_selected_area[1].set(self.crop_selected_area[1].get() + (y - self.drag_position[1]))
+                self.crop_selected_area[2].set(self.crop_selected_area[2].get() + (x - self.drag_position[0]))
+                self.crop_selected_area[3].set(self.crop_selected_area[3].get() + (y - self.drag_position[1]))
 
-                self.drag_position = event.x, event.y
+                self.drag_position = x, y
 
             else:
-                new_x = (event.x - self.drag_start_offset[0]) if self.dragging_coordinates[0] else None
-                new_y = (event.y - self.drag_start_offset[1]) if self.dragging_coordinates[1] else None
+                new_x = (x - self.drag_start_offset[0]) if self.dragging_coordinates[0] else None
+                new_y = (y - self.drag_start_offset[1]) if self.dragging_coordinates[1] else None
                 self.dragging_coordinates[0].set(new_x) if new_x else None
                 self.dragging_coordinates[1].set(new_y) if new_y else None
 
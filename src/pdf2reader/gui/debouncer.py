@@ -2,15 +2,22 @@ from threading import Timer
 
 
 class Debouncer(object):
-    def __init__(self, callback, debounce_interval=0.2):
+    def __init__(self, callback, debounce_interval=0.2, widget=None):
+        """
+        :param widget: Tk widget whose event loop runs the callback (using `after`),
+                       otherwise the callback runs in a timer thread
+        """
         self.key_released_timer = None
 
         self.debounce_interval = debounce_interval
         self.callback = callback
+        self.widget = widget
 
 
     def _key_released_timer_cb(self, event):
-        if self.key_released_timer:
+        if self.widget:
+            self.key_released_timer = None
+        elif self.key_released_timer:
             self.key_released_timer.cancel()
             self.key_released_timer = None
 
@@ -21,6 +28,13 @@ class Debouncer(object):
         """ Callback for a key being released. """
         # Set a timer. If it is allowed to expire (not reset by another down
         # event), then we know the key has been released for good.
+        if self.widget:
+            if self.key_released_timer:
+                self.widget.after_cancel(self.key_released_timer)
+            self.key_released_timer = self.widget.after(int(self.debounce_interval * 1000),
+                                                        self._key_released_timer_cb, event)
+            return
+
         if self.key_released_timer:
             self.key_released_timer.cancel()
             self.key_released_timer = None
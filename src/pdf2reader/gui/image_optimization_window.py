@@ -1,11 +1,19 @@
+import logging
 import tkinter as tk
+from threading import Thread
 from tkinter import ttk
 from typing import Callable
 
+from pdf2reader.images_optimization import ImageOptimizationEstimate
+
+logger = logging.getLogger(__name__)
+
 
 class ImageOptimizationWindow:
-    def __init__(self, optimize_callback: Callable[[int, bool, bool], None]):
+    def __init__(self, optimize_callback: Callable[[int, bool, bool], None],
+                 estimate_callback: Callable[[int, bool, bool], ImageOptimizationEstimate] = None):
         self._optimize_callback = optimize_callback
+        self._estimate_callback = estimate_callback
 
         self.window = tk.Toplevel()
         try:
@@ -13,7 +21,7 @@ class ImageOptimizationWindow:
         except:
             pass
         self.window.title("Optimize images")
-        self.window.geometry("400x220")
+        self.window.geometry("400x260" if estimate_callback else "400x220")
 
         self._setup_variables()
         self._setup_layout()
@@ -28,6 +36,9 @@ class ImageOptimizationWindow:
         self.should_remove_images = tk.BooleanVar()
         self.should_remove_images.set(False)
 
+        self.estimate_text = tk.StringVar()
+        self.estimate_text.set("")
+
     def _setup_layout(self):
         self.quality_frame = tk.Frame(self.window, padx=10, pady=10)
         self.quality_frame.pack(fill=tk.X, side=tk.TOP, expand=False)
@@ -47,13 +58,46 @@ class ImageOptimizationWindow:
                                                             variable=self.should_remove_images)
         self.should_remove_images_checkbox.pack(side=tk.TOP, pady=10)
 
+        if self._estimate_callback:
+            self.estimate_label = tk.Label(self.window, textvariable=self.estimate_text)
+            self.estimate_label.pack(side=tk.TOP)
+
         self.buttons_frame = tk.Frame(self.window)
         self.buttons_frame.pack(fill=tk.NONE, side=tk.TOP, expand=False)
+        if self._estimate_callback:
+            self.estimate_button = tk.Button(self.buttons_frame, text="Estimate size", command=self._estimate_button)
+            self.estimate_button.pack(pady=10, padx=10, side=tk.LEFT, expand=False)
         self.optimize_button = tk.Button(self.buttons_frame, text="Optimize", command=self._optimize_button)
         self.optimize_button.pack(pady=10, padx=10, side=tk.LEFT, expand=False)
         self.cancel_button = tk.Button(self.buttons_frame, text="Cancel", command=self.close)
         self.cancel_button.pack(pady=10, padx=10, side=tk.LEFT, expand=False)
 
+    def _estimate_button(self):
+        # Optimizing changes the images the estimate reads, so it waits until the estimate is done
+        self.estimate_button.configure(state=tk.DISABLED)
+        self.optimize_button.configure(state=tk.DISABLED)
+        self.estimate_text.set("Estimating...")
+        Thread(target=self._estimate, args=(self.image_quality.get(), self.should_resize_images.get(),
+                                            self.should_remove_images.get())).start()
+
+    def _estimate(self, image_quality: int, should_resize_images: bool, should_remove_images: bool):
+        try:
+            estimate = self._estimate_callback(image_quality, should_resize_images, should_remove_images)
+            text = (f"Images {estimate.size_before / 1e6:.1f} MB -> ~{estimate.size_after / 1e6:.1f} MB, "
+                    f"takes ~{estimate.seconds:.0f} s")
+        except Exception as e:
+            logger.exception("Failed to estimate images optimization")
+            text = "Failed to estimate: " + str(e)
+        try:
+            self.window.after(0, lambda: self._show_estimate(text))
+        except (RuntimeError, tk.TclError):  # Window was closed meanwhile
+            pass
+
+    def _show_estimate(self, text: str):
+        self.estimate_text.set(text)
+        self.estimate_button.configure(state=tk.NORMAL)
+        self.optimize_button.configure(state=tk.NORMAL)
+
     def _optimize_button(self):
         self._optimize_callback(self.image_quality.get(), self.should_resize_images.get(),
                                 self.should_remove_images.get())
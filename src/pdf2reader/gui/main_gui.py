@@ -10,6 +10,7 @@ from pdf2reader.gui.image_optimization_window import ImageOptimizationWindow
 from pdf2reader.gui.page_edit_window import PageEditWindow
 from pdf2reader.gui.pdf_page_grid_display import PdfPageGridDisplay
 from pdf2reader.pdf_file import PdfFile, PdfPage
+from pdf2reader.thumbnail_cache import DiskThumbnailCache
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +21,7 @@ class MainGUI(tk.Frame):
 
         # Working variables
         self.pdf_file: PdfFile or None = None
+        self._disk_thumbnail_cache: DiskThumbnailCache or None = None
         self._setup_variables()
 
         # GUI stuff
@@ -62,7 +64,8 @@ class MainGUI(tk.Frame):
     def _open_page_edit_window(self, page: PdfPage, page_number: int):
         PageEditWindow(self.pdf_file, page_number,
                        close_callback=lambda: self.pdf_grid_display.reload_single_page_change_marks(page_number),
-                       reload_all_pages_callback=lambda: self.pdf_grid_display.reload_all_pages_change_marks())
+                       reload_all_pages_callback=lambda: self.pdf_grid_display.reload_all_pages_change_marks(),
+                       reload_section_group_callback=self.pdf_grid_display.reload_section_group_change_marks)
 
     def _open_file_button(self):
         path = filedialog.askopenfilename(title="Open PDF file",
@@ -71,6 +74,15 @@ class MainGUI(tk.Frame):
             return
         Thread(target=self._open_file, args=(path,)).start()
 
+    def _get_disk_thumbnail_cache(self) -> DiskThumbnailCache or None:
+        if self._disk_thumbnail_cache is None:
+            try:
+                self._disk_thumbnail_cache = DiskThumbnailCache()
+            except OSError:
+                logger.warning("Failed to create thumbnail cache directory, thumbnails are not cached on disk",
+                               exc_info=True)
+        return self._disk_thumbnail_cache
+
     def _open_file(self, path: str):
         logger.info(f"Opening pdf file: {path}")
 
@@ -81,7 +93,9 @@ class MainGUI(tk.Frame):
 
             self.current_page.set(0)
 
-            self.pdf_file = PdfFile.open(path, progressbar=True, ask_password=True)
+            # Pages are parsed and matched in background, so the first pages can be shown and edited right away
+            self.pdf_file = PdfFile.open(path, ask_password=True, disk_thumbnail_cache=self._get_disk_thumbnail_cache(),
+                                         load_in_background=True)
             self.page_count.set(self.pdf_file.page_count)
             self.is_pdf_opened.set(True)
             self.opened_pdf_name.set(Path(path).name)
@@ -137,7 +151,7 @@ class MainGUI(tk.Frame):
                                                                                                 should_resize_images,
                                                                                                 should_remove_images)).start()
 
-        ImageOptimizationWindow(opt_fn)
+        ImageOptimizationWindow(opt_fn, estimate_callback=self.pdf_file.estimate_images_optimization)
 
     def _optimize_images(self, image_quality: int = 30, should_resize_images: bool = True, should_remove_images: bool = False):
         logger.info(f"Optimizing images in pdf file")
@@ -1,22 +1,32 @@
 import logging
 import tkinter as tk
+from collections import OrderedDict
 from typing import Callable, List
 
+from PIL import Image
+
 from pdf2reader.data_structures import Box
+from pdf2reader.gui.debouncer import Debouncer
 from pdf2reader.gui.page_renderer import PageRenderer
+from pdf2reader.gui.render_queue import RenderQueue
 from pdf2reader.gui.select_pages_to_action_window import SelectPagesToActionWindow
-from pdf2reader.pdf_file import PdfFile, Section
+from pdf2reader.gui.zoomable_page_view import ZoomablePageWindow
+from pdf2reader.pdf_file import PdfFile, PdfPage, Section, SectionGroup
 
 logger = logging.getLogger(__name__)
 
 
 class PageEditWindow:
+    PREVIEW_CACHE_SIZE = 8  # Edited page renders kept, for switching between recent edit states
+
     def __init__(self, pdf_file: PdfFile, page_number: int, close_callback: Callable = None,
-                 reload_all_pages_callback: Callable = None):
+                 reload_all_pages_callback: Callable = None,
+                 reload_section_group_callback: Callable[[SectionGroup], None] = None):
         self.pdf_file = pdf_file
         self.page = self.pdf_file.pages_parsed[page_number]
         self.close_callback = close_callback
         self.reload_all_pages_callback = reload_all_pages_callback
+        self.reload_section_group_callback = reload_section_group_callback
 
         self.window = tk.Toplevel()
         try:
@@ -25,6 +35,12 @@ class PageEditWindow:
             pass
         self.window.title("Edit Page")
 
+        # Edited page preview is rendered in background, shortly after the last edit
+        self._preview_queue = RenderQueue(self.window, workers=1)
+        self._preview_cache: "OrderedDict[tuple, Image]" = OrderedDict()  # Edit state -> rendered edited page
+        self._preview_debouncer = Debouncer(lambda event: self._update_preview(), debounce_interval=0.3,
+                                            widget=self.window)
+
         self._setup_variables(is_pdf_opened=True, current_page=page_number, page_count=self.pdf_file.page_count)
         self._setup_layout()
         self._setup_variable_listeners()
@@ -32,8 +48,14 @@ class PageEditWindow:
         self.update_page()
 
         self.window.geometry(
-            f"{self.page_renderer.rendered_page.width() + 20}x{self.page_renderer.rendered_page.height() + 65}")
+            f"{self.page_renderer.image_width + 20}x{self.page_renderer.image_height + 65}")
         self.window.protocol("WM_DELETE_WINDOW", self._close_callback)
+        # The window is also destroyed directly, e.g. by the crop controls when pages to crop are selected
+        self.window.bind("<Destroy>", self._window_destroyed, add="+")
+
+    def _window_destroyed(self, event):
+        if event.widget is self.window:
+            self._preview_queue.close()
 
     def _close_callback(self):
         self.close()
@@ -41,12 +63,17 @@ class PageEditWindow:
             self.close_callback()
 
     def _setup_layout(self):
-        self.page_renderer = PageRenderer(self.window, max_width=-1, max_height=-1)
+        # Render with the display density so the page stays sharp on HiDPI screens
+        render_scale = max(1., self.window.winfo_fpixels('1i') / 96)
+        self.page_renderer = PageRenderer(self.window, max_width=-1, max_height=-1, render_scale=render_scale,
+                                          highlight_boxes_on_hover=True,
+                                          area_select_callback=self._boxes_selected_callback)
 
         self.page_edit_controls = PageEditControls(self.window, self.page_renderer.image_canvas,
                                                    self.current_page.get(),
                                                    self.pdf_file, self.page_renderer, padx=5, pady=2,
-                                                   reload_all_pages_callback=self.reload_all_pages_callback)
+                                                   reload_all_pages_callback=self.reload_all_pages_callback,
+                                                   show_edited_preview=self.show_edited_preview)
 
         # self.navigation_bar = NavigationBar(self.window, self.is_pdf_opened, self.current_page, self.page_count, height=30)
 
@@ -58,6 +85,7 @@ class PageEditWindow:
         self.is_pdf_opened = tk.BooleanVar()
         self.current_page = tk.IntVar()
         self.page_count = tk.IntVar()
+        self.show_edited_preview = tk.BooleanVar()
 
         self.is_pdf_opened.set(is_pdf_opened)
         self.current_page.set(current_page)
@@ -66,12 +94,58 @@ class PageEditWindow:
     def _setup_variable_listeners(self):
         self.current_page.trace("w", lambda *args: self.update_page())
         self.is_pdf_opened.trace("w", lambda *args: self.update_page())
+        self.show_edited_preview.trace("w", lambda *args: self._update_preview())
 
     def update_page(self):
         logger.debug(f"Updating page to page number: {self.current_page.get()}")
         if self.pdf_file:
             self.page_renderer.set_page(self.pdf_file.get_page(self.current_page.get()), self.current_page.get())
             self._update_boxes()
+            if self.show_edited_preview.get():
+                self._update_preview()
+
+    def _update_preview(self):
+        if not self.show_edited_preview.get():
+            self._preview_queue.cancel("preview")
+            self.page_renderer.show_original_page_image()
+            return
+
+        page = self.page_renderer.page
+        state = page.get_edit_state()
+        img = self._preview_cache.get(state)
+        if img is not None:
+            self._preview_cache.move_to_end(state)
+            self._show_preview(img)
+            return
+
+        scale = self.page_renderer.scale
+        self._preview_queue.submit("preview", 0, lambda: self._render_preview(page, state, scale),
+                                   lambda img: self._preview_rendered(page, state, img))
+
+    @staticmethod
+    def _render_preview(page: PdfPage, state: tuple, scale: float) -> Image or None:
+        img = page.get_edited_rendered_image(scale)
+        # Sections are edited on the Tk thread meanwhile, a render of a mixed state is not cached
+        return img if page.get_edit_state() == state else None
+
+    def _preview_rendered(self, page: PdfPage, state: tuple, img: Image or None):
+        if img is None:
+            return
+        self._preview_cache[state] = img
+        while len(self._preview_cache) > self.PREVIEW_CACHE_SIZE:
+            self._preview_cache.popitem(last=False)
+        if self.show_edited_preview.get() and page is self.page_renderer.page and page.get_edit_state() == state:
+            self._show_preview(img)
+
+    def _show_preview(self, img: Image):
+        """ Edited page is cropped, it is shown at the location of the crop area """
+        page = self.page_renderer.page
+        scale = self.page_renderer.scale
+        x, y = 0, 0
+        if page.crop_area:
+            x = min(page.crop_area[0], page.crop_area[2]) * scale
+            y = (page.original_height - max(page.crop_area[1], page.crop_area[3])) * scale
+        self.page_renderer.show_page_image(img, x, y)
 
     def _update_boxes(self):
         boxes = []
@@ -102,35 +176,59 @@ class PageEditWindow:
 
         popup.tk_popup(click_loc[0], click_loc[1])
 
+    def _boxes_selected_callback(self, boxes: List[Box], click_loc):
+        sections = [box.section for box in boxes if box.section is not None]
+        logger.debug(f"Boxes selected for {len(sections)} sections")
+        if not sections:
+            return
+
+        popup = tk.Menu(self.page_renderer, tearoff=0)
+        popup.add_command(label=f"Keep {len(sections)} sections",
+                          command=lambda: self._edit_sections_keep(sections, keep=True))
+        popup.add_command(label=f"Remove {len(sections)} sections",
+                          command=lambda: self._edit_sections_keep(sections, keep=False))
+
+        popup.tk_popup(click_loc[0], click_loc[1])
+
+    def _edit_sections_keep(self, sections: List[Section], keep: bool):
+        for section in sections:
+            section.keep_in_output = keep
+        self.page_renderer.recolor_boxes(sections)
+        self._preview_debouncer.process_event(None)
+
     def _edit_section_keep(self, section: Section, keep: bool):
         section.keep_in_output = keep
-        self._update_boxes()
+        self.page_renderer.recolor_boxes([section])
+        self._preview_debouncer.process_event(None)
 
     def _edit_section_on_pages(self, section: Section):
         logger.debug("Edit section on pages button clicked")
         pages_to_keep = [s.page_number for s in section.section_group.sections if s.keep_in_output]
         SelectPagesToActionWindow("Select pages where to keep the section", self.pdf_file,
                                   save_callback=lambda selected: self._edit_section_on_pages_callback(selected,
-                                                                                                      section.section_group.sections),
+                                                                                                      section.section_group),
                                   checkbox_text="Keep section", preselected_pages=pages_to_keep,
                                   enabled_pages=[s.page_number for s in section.section_group.sections],
                                   show_crop=False, show_sections=True,
                                   show_sections_only_from_group=section.section_group)
         self.close()
 
-    def _edit_section_on_pages_callback(self, selected_pages: List[int], sections: List[Section]):
-        logger.debug(f"Edit section on pages callback: {selected_pages}, out of sections: {sections}")
+    def _edit_section_on_pages_callback(self, selected_pages: List[int], section_group: SectionGroup):
+        logger.debug(f"Edit section on pages callback: {selected_pages}, out of sections: {section_group.sections}")
 
-        for section in sections:
+        for section in section_group.sections:
             section.keep_in_output = section.page_number in selected_pages
 
-        if self.reload_all_pages_callback:
+        if self.reload_section_group_callback:
+            self.reload_section_group_callback(section_group)
+        elif self.reload_all_pages_callback:
             self.reload_all_pages_callback()
 
     def __del__(self):
         self.close()
 
     def close(self):
+        self._preview_queue.close()
         try:
             self.window.grab_release()
         except:
@@ -140,7 +238,8 @@ class PageEditWindow:
 
 class PageEditControls(tk.Frame):
     def __init__(self, parent, canvas: tk.Canvas, page_number: int, pdf_file: PdfFile, page_renderer: PageRenderer,
-                 reload_all_pages_callback: Callable = None, *args, **kwargs):
+                 reload_all_pages_callback: Callable = None, show_edited_preview: tk.BooleanVar = None,
+                 *args, **kwargs):
         super().__init__(parent, *args, **kwargs)
         self.canvas = canvas
         self.pdf_file = pdf_file
@@ -151,11 +250,26 @@ class PageEditControls(tk.Frame):
 
         self.crop_already_exists = self.page.crop_area is not None
 
+        self.zoom_button = tk.Button(self, text="Zoom", command=self._zoom_button_callback)
         self.crop_button = tk.Button(self, text="Crop", command=self._crop_button_callback)
         self.cropping_label = tk.Label(self, text="Cropping...")
         self.crop_done_button = tk.Button(self, text="Apply crop", command=self._crop_done_button_callback)
 
         self.crop_button.pack(side=tk.RIGHT, expand=False)
+        self.zoom_button.pack(side=tk.LEFT, expand=False)
+        if show_edited_preview is not None:
+            self.preview_checkbox = tk.Checkbutton(self, text="Preview edits", variable=show_edited_preview)
+            self.preview_checkbox.pack(side=tk.LEFT, expand=False)
+
+    def _zoom_button_callback(self):
+        crop_renderer = self.page_renderer.crop_renderer
+        crop_area = self._get_selected_crop() if crop_renderer and crop_renderer.crop_created else None
+        ZoomablePageWindow(self.pdf_file, self.page_number, grab_return_window=self.winfo_toplevel(),
+                           crop_area=crop_area, crop_callback=self._zoomed_crop_callback)
+
+    def _zoomed_crop_callback(self, selected_crop: List[float]):
+        """ Crop selected in the zoomed page, continues the same as a crop selected in this window """
+        self._select_pages_to_crop(selected_crop)
 
     def _crop_button_callback(self):
         self.crop_button.pack_forget()
@@ -177,24 +291,33 @@ class PageEditControls(tk.Frame):
             self.page_renderer.set_boxes(self.pdf_file.get_boxes(self.page_number))
             return
 
+        self._select_pages_to_crop(self._get_selected_crop())
+
+    def _select_pages_to_crop(self, selected_crop: List[float]):
+        self._selected_crop = selected_crop
         # Opening select pages action window is non blocking!
         SelectPagesToActionWindow("Select pages to crop", self.pdf_file, save_callback=self._save_callback,
                                   checkbox_text="Crop", preselected_pages=[self.page_number],
-                                  show_crop=True, custom_crop=[
-                        self.page_renderer.crop_selected_area[0].get(), self.page_renderer.crop_selected_area[1].get(),
-                        self.page_renderer.crop_selected_area[2].get(), self.page_renderer.crop_selected_area[3].get()
-                    ],
+                                  show_crop=True, custom_crop=self._get_crop_area(self.page, selected_crop),
                                   show_sections=False, show_sections_only_from_group=None)
 
         self.master.destroy()
 
-    def _save_callback(self, selected_pages: List[int]):
-        x1, y1, x2, y2 = self.page_renderer.crop_selected_area[0].get(), self.page_renderer.crop_selected_area[1].get(), \
-            self.page_renderer.crop_selected_area[2].get(), self.page_renderer.crop_selected_area[3].get()
+    def _get_selected_crop(self) -> List[float]:
+        """ Crop area selected in the page renderer, in PDF points from the top left page corner """
+        scale = self.page_renderer.scale
+        return [v.get() / scale for v in self.page_renderer.crop_selected_area]
+
+    @staticmethod
+    def _get_crop_area(page: PdfPage, selected_crop: List[float]) -> List[float]:
+        """ Selected crop area (from the top left page corner) converted to the PDF coordinates of `page` """
+        x1, y1, x2, y2 = selected_crop
+        return [x1, page.original_height - y1, x2, page.original_height - y2]
 
+    def _save_callback(self, selected_pages: List[int]):
         for page_number in selected_pages:
             page = self.pdf_file.get_page(page_number)
-            page.crop_area = [x1, page.original_height - y1, x2, page.original_height - y2]
+            page.crop_area = self._get_crop_area(page, self._selected_crop)
 
         if self.page_number in selected_pages:
             self.crop_already_exists = True
@@ -1,23 +1,82 @@
 import logging
 import tkinter as tk
-from typing import List, Callable
+from typing import Collection, List, Callable
 
 from PIL import ImageTk
 from PIL import Image
 
-from pdf2reader.data_structures import Box
+from pdf2reader.data_structures import Box, BoxIndex
 from pdf2reader.gui.crop_selector import CropSelector
-from pdf2reader.pdf_file import PdfPage
+from pdf2reader.gui.render_queue import RenderQueue
+from pdf2reader.pdf_file import PdfPage, Section
+from pdf2reader.thumbnail_cache import ThumbnailCache
 
 logger = logging.getLogger(__name__)
 
 
+def get_page_image_size(page: PdfPage, max_width: int = 256, max_height: int = 256,
+                        render_scale: float = 1.) -> tuple[int, int, float]:
+    """ Width and height of the page image and its scale to the original rendered page """
+    original_width, original_height = page.get_original_rendered_size()
+
+    new_width, new_height = original_width * render_scale, original_height * render_scale
+    if max_height > -1 and original_height / max_height > original_width / max_width:
+        new_height = max_height
+        new_width = original_width / original_height * max_height
+    elif max_width > -1:
+        new_height = original_height / original_width * max_width
+        new_width = max_width
+
+    return int(new_width), int(new_height), new_width / original_width
+
+
+def get_page_as_image(page: PdfPage, page_number: int, width: int, height: int, scale: float, disabled: bool = False,
+                      thumbnail_cache: ThumbnailCache = None) -> Image:
+    key = ThumbnailCache.get_key(page_number, width, height, disabled)
+    disk_path = None
+    if thumbnail_cache is not None:
+        img = thumbnail_cache.get(key)
+        if img is not None:
+            return img
+        if thumbnail_cache.disk_cache is not None:
+            disk_path = thumbnail_cache.disk_cache.get_path(page.get_content_hash(), width, height, disabled)
+            img = thumbnail_cache.disk_cache.get(disk_path)
+            if img is not None:
+                thumbnail_cache.put(key, img)
+                return img
+
+    # Render directly at the target resolution, resize only fixes the rounding of the rendered size
+    img = page.get_original_rendered_image(scale)
+    if img.size != (width, height):
+        img = img.resize((width, height))
+
+    if disabled:
+        overlay = Image.new('RGBA', img.size, (0, 0, 0, 128))
+        img = Image.alpha_composite(img.convert("RGBA"), overlay)
+
+    if thumbnail_cache is not None:
+        thumbnail_cache.put(key, img)
+        if disk_path is not None:
+            thumbnail_cache.disk_cache.put(disk_path, img)
+    return img
+
+
 class PageRenderer(tk.Frame):
     def __init__(self, parent: tk.Frame or tk.Toplevel or tk.Tk,
                  create_page_additional_info: Callable[[tk.Widget, PdfPage, int], tk.Widget] = None,
                  default_click_callback: Callable = None, max_height: int = 256, max_width: int = 256,
                  show_crop: bool = True, custom_crop: List[int] = None, disabled: bool = False,
-                 *args, **kwargs):
+                 render_scale: float = 1., render_queue: RenderQueue = None,
+                 thumbnail_cache: ThumbnailCache = None, highlight_boxes_on_hover: bool = False,
+                 area_select_callback: Callable[[List[Box], List[int]], None] = None, *args, **kwargs):
+        """
+        :param render_scale: Pixels per PDF point when neither max_width nor max_height is set (e.g. for HiDPI)
+        :param render_queue: Renders the page in background if given, a placeholder is shown until it is done
+        :param thumbnail_cache: Rendered page images are reused from and stored to it
+        :param highlight_boxes_on_hover: Draws the boxes under the mouse cursor thicker
+        :param area_select_callback: Called with the boxes touching the area selected by dragging with Shift held
+                                     and the screen location where the drag ended
+        """
         tk.Frame.__init__(self, parent, *args, **kwargs)
         self.create_page_additional_info = create_page_additional_info
         self._show_crop = show_crop
@@ -30,6 +89,11 @@ class PageRenderer(tk.Frame):
 
         self.max_height = max_height
         self.max_width = max_width
+        self.render_scale = render_scale
+        self.render_queue = render_queue
+        self.thumbnail_cache = thumbnail_cache
+        self.image_width = -1
+        self.image_height = -1
 
         self.padx = kwargs.get("padx", 0)
         self.pady = kwargs.get("pady", 0)
@@ -40,12 +104,17 @@ class PageRenderer(tk.Frame):
         self.rendered_page = None
         self.additional_info = None
         self.boxes = []
+        self._box_index = BoxIndex([])
         self._rendered_boxes = []
+        self._highlighted_boxes = []
+        self._area_selection = None  # Start of the selection and its canvas item while selecting
         self.default_click_callback = default_click_callback
+        self.area_select_callback = area_select_callback
 
         self.crop_selected_area = [tk.IntVar(), tk.IntVar(), tk.IntVar(), tk.IntVar()]
         self.crop_renderer = None
 
+        self._highlight_boxes_on_hover = highlight_boxes_on_hover
         self._create_image_canvas()
 
         if self.default_click_callback:
@@ -55,30 +124,40 @@ class PageRenderer(tk.Frame):
         self.image_canvas = tk.Canvas(self, background="gray", height=300, width=300)
         self.image_canvas.bind("<Button-1>", self._clicked_canvas)
         self.image_canvas.pack(side=tk.TOP, expand=False)
-
-    def _get_page_as_image(self, page: PdfPage, disabled: bool = False) -> tuple[tk.PhotoImage, float]:
-        img: Image = page.get_original_rendered_image()
-
-        new_width, new_height = img.width, img.height
-        if self.max_height > -1 and img.height / self.max_height > img.width / self.max_width:
-            new_height = self.max_height
-            new_width = img.width / img.height * self.max_height
-        elif self.max_width > -1:
-            new_height = img.height / img.width * self.max_width
-            new_width = self.max_width
-
-        scale = new_width / img.width
-        img = img.resize((int(new_width), int(new_height)))
-
-        if disabled:
-            overlay = Image.new('RGBA', img.size, (0, 0, 0, 128))
-            img = Image.alpha_composite(img.convert("RGBA"), overlay)
-
-        photo_img = ImageTk.PhotoImage(img)
-
-        return photo_img, scale
-
-    def set_page(self, page: PdfPage, page_number: int):
+        if self._highlight_boxes_on_hover:
+            self.image_canvas.bind("<Motion>", self._mouse_moved)
+            self.image_canvas.bind("<Leave>", lambda event: self._highlight_boxes([]))
+        if self.area_select_callback:
+            self.image_canvas.bind("<Shift-Button-1>", self._area_selection_start)
+            self.image_canvas.bind("<Shift-B1-Motion>", self._area_selection_move)
+            self.image_canvas.bind("<Shift-ButtonRelease-1>", self._area_selection_end)
+
+    def show_page_image(self, img: Image, x: int = 0, y: int = 0):
+        """ Shows img instead of the page image, with its top left corner at canvas location x, y """
+        self.rendered_page = ImageTk.PhotoImage(img)
+        self.image_canvas.delete("page_image")
+        self.image_canvas.create_image(x, y, anchor='nw', image=self.rendered_page, tags="page_image")
+        self.image_canvas.tag_lower("page_image")  # Under the boxes and crop area drawn before it was rendered
+        self.image_canvas.image = self.rendered_page
+
+    def show_original_page_image(self):
+        if self.page:
+            self.show_page_image(get_page_as_image(self.page, self.page_number, self.image_width, self.image_height,
+                                                   self.scale, self._disabled, self.thumbnail_cache))
+
+    def set_render_priority(self, priority: int):
+        if self.render_queue:
+            self.render_queue.set_priority(self, priority)
+
+    def set_page(self, page: PdfPage, page_number: int, disabled: bool = None, render_priority: int = 0):
+        """
+        :param disabled: Changes whether the page is rendered as disabled, keeps the current state if None
+        :param render_priority: Priority in the render queue, lower is rendered first
+        """
+        if disabled is not None:
+            self._disabled = disabled
+        if self.render_queue:
+            self.render_queue.cancel(self)
         if not page:
             self.rendered_page = None
             self.image_canvas.delete(tk.ALL)
@@ -89,15 +168,26 @@ class PageRenderer(tk.Frame):
         try:
             self.page = page
             self.page_number = page_number
-            self.rendered_page, self.scale = self._get_page_as_image(page, disabled=self._disabled)
+            self.image_width, self.image_height, self.scale = get_page_image_size(page, self.max_width,
+                                                                                 self.max_height, self.render_scale)
 
+            self.rendered_page = None
             self.image_canvas.delete(tk.ALL)
-            self.image_canvas.config(height=self.rendered_page.height() - 2, width=self.rendered_page.width() - 2)
-            self.height = self.rendered_page.height() + 2 * self.padx
-            self.width = self.rendered_page.width() + 2 * self.pady
-
-            self.image_canvas.create_image(0, 0, anchor='nw', image=self.rendered_page)
-            self.image_canvas.image = self.rendered_page
+            self.set_boxes([])
+            self.image_canvas.config(height=self.image_height - 2, width=self.image_width - 2)
+            self.height = self.image_height + 2 * self.padx
+            self.width = self.image_width + 2 * self.pady
+
+            image_args = (page, page_number, self.image_width, self.image_height, self.scale, self._disabled,
+                          self.thumbnail_cache)
+            cache_key = ThumbnailCache.get_key(page_number, self.image_width, self.image_height, self._disabled)
+            if self.render_queue and not (self.thumbnail_cache is not None and cache_key in self.thumbnail_cache):
+                self.image_canvas.create_rectangle(0, 0, self.image_width, self.image_height, fill="white", outline="",
+                                                   tags="page_image")
+                self.render_queue.submit(self, render_priority, lambda: get_page_as_image(*image_args),
+                                         self.show_page_image)
+            else:
+                self.show_page_image(get_page_as_image(*image_args))
 
             # Crop renderer
             if self.crop_renderer:
@@ -117,11 +207,12 @@ class PageRenderer(tk.Frame):
             if self._show_crop:
                 self.crop_renderer = CropSelector(self.image_canvas, self.crop_selected_area,
                                                   crop_already_exists=bool(page.crop_area) or bool(self._custom_crop),
-                                                  max_x=page.original_crop_area[2] - page.original_crop_area[0],
-                                                  max_y=page.original_crop_area[3] - page.original_crop_area[1])
+                                                  max_x=(page.original_crop_area[2] - page.original_crop_area[0]) * self.scale,
+                                                  max_y=(page.original_crop_area[3] - page.original_crop_area[1]) * self.scale)
 
             if self.additional_info:
-                self.additional_info.pack_forget()
+                self.additional_info.destroy()
+                self.additional_info = None
             if self.create_page_additional_info:
                 if not self._disabled:
                     self.additional_info = self.create_page_additional_info(self, self.page, self.page_number)
@@ -133,8 +224,54 @@ class PageRenderer(tk.Frame):
 
     def set_boxes(self, boxes: List[Box]):
         self.boxes = boxes
+        self._box_index = BoxIndex(boxes)
+        self._highlighted_boxes = []
         self._render_boxes()
 
+    def get_boxes_at(self, x: float, y: float) -> List[int]:
+        """ Indexes of the boxes at canvas location """
+        return self._box_index.query_point(x / self.scale, y / self.scale)
+
+    def _highlight_boxes(self, box_indexes: List[int]):
+        if box_indexes == self._highlighted_boxes:
+            return
+        for i in self._highlighted_boxes:
+            self.image_canvas.itemconfigure(self._rendered_boxes[i], width=2)
+        for i in box_indexes:
+            self.image_canvas.itemconfigure(self._rendered_boxes[i], width=4)
+        self._highlighted_boxes = box_indexes
+
+    def _mouse_moved(self, event):
+        if not self._disabled and self._area_selection is None:
+            self._highlight_boxes(self.get_boxes_at(event.x, event.y))
+
+    def _area_selection_start(self, event):
+        if self._disabled or not self.boxes:
+            return
+        rectangle = self.image_canvas.create_rectangle(event.x, event.y, event.x, event.y, outline="blue", dash=(4, 2))
+        self._area_selection = (event.x, event.y, rectangle)
+
+    def _area_selection_move(self, event):
+        if self._area_selection is None:
+            return
+        x, y, rectangle = self._area_selection
+        self.image_canvas.coords(rectangle, x, y, event.x, event.y)
+        self._highlight_boxes(self._box_index.query_area(x / self.scale, y / self.scale,
+                                                         event.x / self.scale, event.y / self.scale))
+
+    def _area_selection_end(self, event):
+        if self._area_selection is None:
+            return
+        x, y, rectangle = self._area_selection
+        self._area_selection = None
+        self.image_canvas.delete(rectangle)
+        box_indexes = self._box_index.query_area(x / self.scale, y / self.scale,
+                                                 event.x / self.scale, event.y / self.scale)
+        self._highlight_boxes([])
+        if box_indexes:
+            self.area_select_callback([self.boxes[i] for i in box_indexes],
+                                      [event.x + self.winfo_rootx(), event.y + self.winfo_rooty()])
+
     def _render_boxes(self):
         for rendered_box in self._rendered_boxes:
             self.image_canvas.delete(rendered_box)
@@ -144,9 +281,18 @@ class PageRenderer(tk.Frame):
                                                                            box.x1 * self.scale, box.y1 * self.scale,
                                                                            outline=box.color, width=2))
 
+    def recolor_boxes(self, sections: Collection[Section] = None):
+        """ Updates colors of the boxes already drawn for sections (all if None), without drawing them again """
+        for box, rendered_box in zip(self.boxes, self._rendered_boxes):
+            if box.section is not None and (sections is None or box.section in sections):
+                color = box.section.get_mark_color()
+                if color != box.color:
+                    box.color = color
+                    self.image_canvas.itemconfigure(rendered_box, outline=color)
+
     def reload_change_marks(self):
         if self.page:
-            self.set_boxes(self.page.get_boxes())
+            self.recolor_boxes()
             if self.page.crop_area and self.crop_renderer:
                 self.crop_renderer.set_crop_area(self.page.crop_area[0] * self.scale,
                                                  (self.page.original_height - self.page.crop_area[1]) * self.scale,
@@ -156,12 +302,10 @@ class PageRenderer(tk.Frame):
     def _clicked_canvas(self, event):
         logger.debug(f"Clicked canvas at: {event.x}, {event.y}, disabled: {self._disabled}")
         if not self._disabled:
-            if self.rendered_page:
-                for box in self.boxes:
-                    if (box.x0 < event.x < box.x1 or box.x0 > event.x > box.x1) and \
-                            (box.y0 < event.y < box.y1 or box.y0 > event.y > box.y1):
-                        box.on_click([event.x + self.winfo_rootx(), event.y + self.winfo_rooty()])
-                        break
+            if self.page:
+                box_indexes = self.get_boxes_at(event.x, event.y)
+                if box_indexes:
+                    self.boxes[box_indexes[0]].on_click([event.x + self.winfo_rootx(), event.y + self.winfo_rooty()])
                 else:
                     if self.default_click_callback:
                         self.default_click_callback(event)
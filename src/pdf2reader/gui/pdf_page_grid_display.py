@@ -1,23 +1,31 @@
 import logging
 import tkinter as tk
-from typing import Callable, List
+from typing import Callable, Dict, List
 
 from pdf2reader.gui.debouncer import Debouncer
-from pdf2reader.gui.page_renderer import PageRenderer
-from pdf2reader.gui.progress_bar_window import ProgressBarWindow
+from pdf2reader.gui.page_renderer import PageRenderer, get_page_image_size, get_page_as_image
+from pdf2reader.gui.render_queue import RenderQueue
 from pdf2reader.gui.vertical_scrolled_frame import VerticalScrolledFrame
 from pdf2reader.pdf_file import PdfPage, PdfFile, SectionGroup
+from pdf2reader.thumbnail_cache import ThumbnailCache
 
 logger = logging.getLogger(__name__)
 
 
 class PdfPageGridDisplay(tk.Frame):
+    """
+    Grid of page thumbnails. Only pages in the visible rows (plus `overscan_rows` around them) have a PageRenderer,
+    renderers of pages scrolled out of view are reused for the newly visible ones.
+    Pages are rendered in background, visible pages first, then the overscan rows and then the rest of the pages
+    into the thumbnail cache of the PdfFile, as long as it has room for them.
+    """
+
     def __init__(self, parent: tk.Frame or tk.Tk or tk.Toplevel, is_pdf_opened: tk.BooleanVar, pdf_file: PdfFile = None,
                  create_page_additional_info: Callable[[tk.Widget, PdfPage, int], tk.Widget] = None,
                  page_click_callback: Callable[[PdfPage, int], None] = None, show_crop: bool = True,
                  custom_crop: List[int] = None, show_sections: bool = False,
                  show_sections_only_from_group: SectionGroup = None, enabled_pages: List[int] = None,
-                 *args, **kwargs):
+                 overscan_rows: int = 2, *args, **kwargs):
         tk.Frame.__init__(self, parent, *args, **kwargs)
 
         self._create_page_additional_info = create_page_additional_info
@@ -26,8 +34,10 @@ class PdfPageGridDisplay(tk.Frame):
         self._show_sections_only_from_group = show_sections_only_from_group
         self._show_sections = show_sections
         self._enabled_pages = enabled_pages
+        self._overscan_rows = overscan_rows
+        self._render_queue = RenderQueue(self)
 
-        self.verticalscroll = VerticalScrolledFrame(self)
+        self.verticalscroll = VerticalScrolledFrame(self, scroll_callback=self._update_visible_pages)
         self.verticalscroll.pack(fill=tk.BOTH, side=tk.TOP, expand=True)
 
         self.scrollframe = tk.Frame(self.verticalscroll.interior)  # This is our GRID frame
@@ -37,81 +47,152 @@ class PdfPageGridDisplay(tk.Frame):
         self.page_click_callback = page_click_callback
 
         self.is_pdf_opened = is_pdf_opened
-        self._page_renderers = []
+        self._page_renderers: Dict[int, PageRenderer] = {}  # Page number -> renderer currently showing it
+        self._free_page_renderers: List[PageRenderer] = []
+        self._cell_width = 1
+        self._cell_height = 1
+        self._columns = None  # Set by the first layout
+        self._page_positions: Dict[int, tuple[int, int]] = {}  # Page number -> (row, column) it is placed at
         self._setup_variables()
-        self._prepare_pages()
-        self._pack_pages_to_grid()
         self._pdf_opened_change()
 
-        self._resize_debouncer = Debouncer(lambda event: self._pack_pages_to_grid())
+        self._resize_debouncer = Debouncer(lambda event: self._pack_pages_to_grid(), widget=self)
         self.bind("<Configure>", self._resize_debouncer.process_event)
 
     def _setup_variables(self):
         self.is_pdf_opened.trace("w", lambda *args: self._pdf_opened_change())
 
+    def _create_page_renderer(self) -> PageRenderer:
+        if self._free_page_renderers:
+            return self._free_page_renderers.pop()
+        return PageRenderer(self.scrollframe, padx=5, pady=5,
+                            create_page_additional_info=self._create_page_additional_info,
+                            default_click_callback=self._page_clicked if self.page_click_callback else None,
+                            show_crop=self._show_crop, custom_crop=self._custom_crop,
+                            render_queue=self._render_queue, thumbnail_cache=self.pdf_file.thumbnail_cache)
+
+    def _page_clicked(self, event):
+        page_renderer = event.widget.master
+        self.page_click_callback(page_renderer.page, page_renderer.page_number)
+
+    def _show_page(self, page_renderer: PageRenderer, page_number: int, render_priority: int = 0):
+        page = self.pdf_file.get_page(page_number)
+        page_renderer.set_page(page, page_number, disabled=self._get_page_disabled(page_number),
+                               render_priority=render_priority)
+
+        if self._show_sections:
+            if self._show_sections_only_from_group:
+                boxes = []
+                for section in page.sections:
+                    if section.section_group == self._show_sections_only_from_group:
+                        box = section.get_bounding_box(page_height=float(page.original_crop_area[3]),
+                                                       cap_area=page.original_crop_area)
+                        if box:
+                            boxes.append(box)
+                page_renderer.set_boxes(boxes)
+            else:
+                page_renderer.set_boxes(self.pdf_file.get_boxes(page_number))
+
     def _prepare_pages(self):
-        for page_renderer in self._page_renderers:
-            page_renderer.grid_forget()
+        self._render_queue.clear()
+        for page_renderer in list(self._page_renderers.values()) + self._free_page_renderers:
             page_renderer.destroy()
-        self._page_renderers = []
-        if self.pdf_file:
-            progress_bar = ProgressBarWindow("Rendering PDF", "Rendering PDF...", 0, self.pdf_file.page_count)
-            for page_number in range(self.pdf_file.page_count):
-                page_number = page_number
-                page = self.pdf_file.get_page(page_number)
-
-                page_renderer = PageRenderer(self.scrollframe, padx=5, pady=5,
-                                             create_page_additional_info=self._create_page_additional_info,
-                                             default_click_callback=(lambda e, page=page, page_number=page_number:
-                                                                     self.page_click_callback(page, int(page_number)))
-                                             if self.page_click_callback else None,
-                                             show_crop=self._show_crop, custom_crop=self._custom_crop,
-                                             disabled=page_number not in self._enabled_pages if self._enabled_pages is not None else False)
-                page_renderer.set_page(self.pdf_file.get_page(page_number), page_number)
-
-                if self._show_sections:
-                    if self._show_sections_only_from_group:
-                        boxes = []
-                        for section in self.pdf_file.get_page(page_number).sections:
-                            if section.section_group == self._show_sections_only_from_group:
-                                box = section.get_bounding_box(page_height=float(page.original_crop_area[3]),
-                                                               cap_area=page.original_crop_area)
-                                if box:
-                                    boxes.append(box)
-                        page_renderer.set_boxes(boxes)
-                    else:
-                        page_renderer.set_boxes(self.pdf_file.get_boxes(page_number))
-
-                self._page_renderers.append(page_renderer)
-                progress_bar.update_progress(page_number)
-                progress_bar.update_message(f"Rendering PDF pages... page {page_number + 1}/{self.pdf_file.page_count}")
-            progress_bar.close()
+        self._page_renderers = {}
+        self._free_page_renderers = []
+        self._page_positions = {}
+        self._columns = None
+        if self.pdf_file and self.pdf_file.page_count:
+            # All cells have the size of the largest possible thumbnail, measured on the first page
+            page_renderer = self._create_page_renderer()
+            self._show_page(page_renderer, 0)
+            page_renderer.update_idletasks()
+            self._cell_width = page_renderer.winfo_reqwidth() - page_renderer.image_width + page_renderer.max_width
+            self._cell_height = page_renderer.winfo_reqheight() - page_renderer.image_height + page_renderer.max_height
+            self._page_renderers[0] = page_renderer
+            self._prefetch_pages()
+
+    def _get_page_disabled(self, page_number: int) -> bool:
+        return page_number not in self._enabled_pages if self._enabled_pages is not None else False
+
+    def _prefetch_pages(self):
+        """ Queues the pages that are not in the thumbnail cache yet, e.g. rendered by another grid of the file """
+        thumbnail_cache = self.pdf_file.thumbnail_cache
+        pages = self.pdf_file.pages_parsed
+        for page_number in range(self.pdf_file.page_count):
+            # Pages not parsed or measured yet are not touched on the Tk thread, _prefetch_page checks them
+            if pages.is_parsed(page_number):
+                page = pages[page_number]
+                if page.is_original_rendered_size_known() \
+                        and self._get_thumbnail_key(page, page_number) in thumbnail_cache:
+                    continue
+            self._render_queue.submit(("prefetch", page_number), 2,
+                                      lambda page_number=page_number: self._prefetch_page(thumbnail_cache, page_number),
+                                      lambda img: None)
+
+    def _get_thumbnail_key(self, page: PdfPage, page_number: int) -> tuple:
+        width, height, _ = get_page_image_size(page)
+        return ThumbnailCache.get_key(page_number, width, height, self._get_page_disabled(page_number))
+
+    def _prefetch_page(self, thumbnail_cache: ThumbnailCache, page_number: int):
+        page = self.pdf_file.get_page(page_number)
+        if self._get_thumbnail_key(page, page_number) in thumbnail_cache:
+            return
+        width, height, scale = get_page_image_size(page)
+        # Prefetching must not evict thumbnails of the pages in view
+        if thumbnail_cache.has_room(width * height * 4):
+            get_page_as_image(page, page_number, width, height, scale, self._get_page_disabled(page_number),
+                              thumbnail_cache)
 
     def _pack_pages_to_grid(self):
-        column = 0
-        max_columns = 1
-        cur_width = 0
-        for page_renderer in self._page_renderers:
-            cur_width += page_renderer.width
-            if cur_width > self.winfo_width() - 30:
-                column = 0
-            else:
-                column += 1
-                max_columns = max(max_columns, column)
+        columns = max(1, (self.winfo_width() - 30) // self._cell_width)
+        if columns == self._columns:
+            return  # Resizing within the same number of columns does not move any page
+        self._columns = columns
+        rows = -(-self.pdf_file.page_count // self._columns) if self.pdf_file else 0
+        self.scrollframe.config(width=self._columns * self._cell_width, height=rows * self._cell_height)
 
-        row = 0
-        column = 0
-        for page_renderer in self._page_renderers:
-            if column + 1 > max_columns:
-                row += 1
-                column = 0
-
-            page_renderer.grid_forget()
-            page_renderer.grid(row=row, column=column)
-            column += 1
+        for page_number, page_renderer in self._page_renderers.items():
+            self._place_page_renderer(page_renderer, page_number)
+        self._update_visible_pages()
 
         logger.debug("Created new grid layout")
 
+    def _place_page_renderer(self, page_renderer: PageRenderer, page_number: int):
+        position = divmod(page_number, self._columns)
+        if self._page_positions.get(page_number) != position:
+            row, column = position
+            page_renderer.place(x=column * self._cell_width, y=row * self._cell_height)
+            self._page_positions[page_number] = position
+
+    def _get_visible_page_range(self, overscan_rows: int = 0) -> range:
+        canvas = self.verticalscroll.canvas
+        top = canvas.canvasy(0)
+        first_row = max(0, int(top // self._cell_height) - overscan_rows)
+        last_row = int((top + canvas.winfo_height()) // self._cell_height) + overscan_rows
+        return range(first_row * self._columns, min(self.pdf_file.page_count, (last_row + 1) * self._columns))
+
+    def _update_visible_pages(self):
+        if not self.pdf_file or self._columns is None:
+            return
+        visible_pages = self._get_visible_page_range()
+        nearby_pages = self._get_visible_page_range(self._overscan_rows)
+
+        for page_number in [p for p in self._page_renderers if p not in nearby_pages]:
+            page_renderer = self._page_renderers.pop(page_number)
+            page_renderer.place_forget()
+            del self._page_positions[page_number]
+            self._free_page_renderers.append(page_renderer)
+
+        for page_number in nearby_pages:
+            render_priority = 0 if page_number in visible_pages else 1
+            if page_number in self._page_renderers:
+                self._page_renderers[page_number].set_render_priority(render_priority)
+            else:
+                page_renderer = self._create_page_renderer()
+                self._show_page(page_renderer, page_number, render_priority)
+                self._place_page_renderer(page_renderer, page_number)
+                self._page_renderers[page_number] = page_renderer
+
     def _pdf_opened_change(self):
         logger.debug("Rendering new PDF grid display")
         if self.pdf_file:
@@ -122,9 +203,22 @@ class PdfPageGridDisplay(tk.Frame):
         self.pdf_file = pdf_file
         self._pdf_opened_change()
 
+    def destroy(self):
+        self._render_queue.close()
+        super().destroy()
+
     def reload_single_page_change_marks(self, page_number: int):
-        self._page_renderers[page_number].reload_change_marks()
+        # Pages out of view get their marks when they are shown again
+        if page_number in self._page_renderers:
+            self._page_renderers[page_number].reload_change_marks()
+
+    def reload_section_group_change_marks(self, section_group: SectionGroup):
+        """ Updates the marks of the group sections, only on the pages in view that have some """
+        sections = set(section_group.sections)
+        for page_number in {section.page_number for section in section_group.sections}:
+            if page_number in self._page_renderers:
+                self._page_renderers[page_number].recolor_boxes(sections)
 
     def reload_all_pages_change_marks(self):
-        for page_renderer in self._page_renderers:
+        for page_renderer in self._page_renderers.values():
             page_renderer.reload_change_marks()
@@ -0,0 +1,144 @@
+import heapq
+import itertools
+import logging
+import queue
+import threading
+import tkinter as tk
+from typing import Any, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class _RenderRequest:
+    __slots__ = ("priority", "order", "key", "render_fn", "callback", "started")
+
+    def __init__(self, priority: int, order: int, key: Hashable, render_fn: Callable[[], Any],
+                 callback: Callable[[Any], None]):
+        self.priority = priority
+        self.order = order
+        self.key = key
+        self.render_fn = render_fn
+        self.callback = callback  # None when the request was cancelled
+        self.started = False
+
+    def __lt__(self, other: "_RenderRequest") -> bool:
+        return (self.priority, self.order) < (other.priority, other.order)
+
+
+class RenderQueue:
+    """
+    Runs render functions on background worker threads, lowest priority value first.
+    Workers put the results into a queue, the Tk thread polls it with `after()` while there are requests
+    and passes the results to the callbacks. Workers never call Tk themselves.
+
+    There is at most one request per key, submitting a new one for the same key cancels the previous one.
+    """
+
+    POLL_INTERVAL_MS = 15
+
+    def __init__(self, widget: tk.Misc, workers: int = 2):
+        self._widget = widget
+        self._heap = []
+        self._requests = {}  # key -> latest request, until its result is delivered
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._results = queue.Queue()  # (request, result) rendered by the workers, delivered on the Tk thread
+        self._polling = False
+
+        for _ in range(workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, key: Hashable, priority: int, render_fn: Callable[[], Any], callback: Callable[[Any], None]):
+        with self._condition:
+            self._cancel(key)
+            request = _RenderRequest(priority, next(self._order), key, render_fn, callback)
+            self._requests[key] = request
+            heapq.heappush(self._heap, request)
+            self._condition.notify()
+        self._start_polling()
+
+    def set_priority(self, key: Hashable, priority: int):
+        """ Changes the priority of a request that is still waiting """
+        with self._condition:
+            request = self._requests.get(key)
+            if request and not request.started and request.priority != priority:
+                self.submit(key, priority, request.render_fn, request.callback)
+
+    def cancel(self, key: Hashable):
+        with self._condition:
+            self._cancel(key)
+
+    def _cancel(self, key: Hashable):
+        request = self._requests.pop(key, None)
+        if request:
+            request.callback = None
+
+    def clear(self):
+        with self._condition:
+            for key in list(self._requests):
+                self._cancel(key)
+            self._heap = []
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self.clear()
+            self._condition.notify_all()
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while not self._closed and not self._heap:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                request = heapq.heappop(self._heap)
+                if request.callback is None:
+                    continue
+                request.started = True
+
+            try:
+                result = request.render_fn()
+            except Exception:
+                logger.exception("Failed to render in background")
+                with self._condition:
+                    if self._requests.get(request.key) is request:
+                        del self._requests[request.key]
+                continue
+
+            self._results.put((request, result))
+
+    def _start_polling(self):
+        if not self._polling:
+            self._polling = True
+            self._schedule_poll()
+
+    def _schedule_poll(self):
+        try:
+            self._widget.after(self.POLL_INTERVAL_MS, self._poll)
+        except (RuntimeError, tk.TclError):  # The widget was destroyed
+            self._polling = False
+
+    def _poll(self):
+        while True:
+            try:
+                request, result = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._deliver(request, result)
+
+        with self._condition:
+            waiting = bool(self._requests) and not self._closed
+        if waiting:
+            self._schedule_poll()
+        else:
+            self._polling = False
+
+    def _deliver(self, request: _RenderRequest, result: Any):
+        with self._condition:
+            callback = request.callback
+            if self._requests.get(request.key) is request:
+                del self._requests[request.key]
+        if callback:
+            callback(result)
@@ -33,19 +33,22 @@ class SelectPagesToActionWindow:
         self.window.geometry("900x600")
         self.window.protocol("WM_DELETE_WINDOW", self._close_callback)
 
-        self.page_checkboxes = {}
-
         self._setup_variables()
         self._setup_layout()
 
-        for page_number in self._preselected_pages:
-            self.page_checkboxes[page_number].select()
-
     def _setup_variables(self):
         self.is_pdf_opened = tk.BooleanVar()
 
         self.is_pdf_opened.set(True)
 
+        # Checkboxes exist only for the pages in view, so the selection is kept in variables of the enabled pages
+        self.page_selected_vars = {page_number: tk.BooleanVar()
+                                   for page_number in range(self.pdf_file.page_count)
+                                   if self._enabled_pages is None or page_number in self._enabled_pages}
+        for page_number in self._preselected_pages:
+            if page_number in self.page_selected_vars:
+                self.page_selected_vars[page_number].set(True)
+
     def _setup_layout(self):
         self.controls = ControlsMenu(self.window, self.pdf_file, select_callback=self._select_callback_1_indexed,
                                      unselect_callback=self._unselect_callback_1_indexed,
@@ -62,9 +65,8 @@ class SelectPagesToActionWindow:
 
     def _save_callback(self):
         selected_pages = []
-        for page_number, checkbox in self.page_checkboxes.items():
-            checked_status = int(checkbox.getvar(checkbox.cget('variable')))
-            if checked_status:
+        for page_number, selected_var in self.page_selected_vars.items():
+            if selected_var.get():
                 selected_pages.append(page_number)
         self.save_callback(selected_pages)
         self.close()
@@ -72,9 +74,9 @@ class SelectPagesToActionWindow:
     def _select_callback_1_indexed(self, page_numbers: List[int]):
         invalid_page_indexes = []
         for page_number in page_numbers:
-            checkbox = self.page_checkboxes.get(page_number - 1)
-            if checkbox:
-                checkbox.select()
+            selected_var = self.page_selected_vars.get(page_number - 1)
+            if selected_var:
+                selected_var.set(True)
             else:
                 if page_number < 1 or page_number > self.pdf_file.page_count:
                     invalid_page_indexes.append(page_number)
@@ -87,9 +89,9 @@ class SelectPagesToActionWindow:
     def _unselect_callback_1_indexed(self, page_numbers: List[int]):
         invalid_page_indexes = []
         for page_number in page_numbers:
-            checkbox = self.page_checkboxes.get(page_number - 1)
-            if checkbox:
-                checkbox.deselect()
+            selected_var = self.page_selected_vars.get(page_number - 1)
+            if selected_var:
+                selected_var.set(False)
             else:
                 if page_number < 1 or page_number > self.pdf_file.page_count:
                     invalid_page_indexes.append(page_number)
@@ -106,16 +108,14 @@ class SelectPagesToActionWindow:
         label = tk.Label(frame, text=f"page {page_number + 1} • ")
         label.pack(side=tk.LEFT, padx=0)
 
-        checkbox = tk.Checkbutton(frame, text=self.checkbox_text, command=lambda: self._checkbox_callback(page_number))
+        checkbox = tk.Checkbutton(frame, text=self.checkbox_text, variable=self.page_selected_vars[page_number],
+                                  command=lambda: self._checkbox_callback(page_number))
         checkbox.pack(side=tk.LEFT, padx=0)
 
-        self.page_checkboxes[page_number] = checkbox
-
         return frame
 
     def _checkbox_callback(self, page_number):
-        checkbox = self.page_checkboxes[page_number]
-        checked_status = checkbox.getvar(checkbox.cget('variable'))
+        checked_status = self.page_selected_vars[page_number].get()
         logger.debug(f"checkbox callback: {page_number}, status: {checked_status}")
 
     def _close_callback(self):
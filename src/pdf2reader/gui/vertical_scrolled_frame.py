@@ -13,14 +13,22 @@ class VerticalScrolledFrame(tk.Frame):
     * Construct and pack/place/grid normally.
     * This frame only allows vertical scrolling.
     """
-    def __init__(self, parent, *args, **kw):
+    def __init__(self, parent, scroll_callback=None, *args, **kw):
+        """
+        :param scroll_callback: Called with no arguments whenever the visible part of the frame changes
+        """
         tk.Frame.__init__(self, parent, *args, **kw)
 
         # Create a canvas object and a vertical scrollbar for scrolling it.
         vscrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL)
         vscrollbar.pack(fill=tk.Y, side=tk.RIGHT, expand=tk.FALSE)
-        canvas = tk.Canvas(self, bd=0, highlightthickness=0,
-                           yscrollcommand=vscrollbar.set)
+
+        def _yscrollcommand(first, last):
+            vscrollbar.set(first, last)
+            if scroll_callback:
+                scroll_callback()
+        self.canvas = canvas = tk.Canvas(self, bd=0, highlightthickness=0,
+                                         yscrollcommand=_yscrollcommand)
         canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=tk.TRUE)
         self.bind("<MouseWheel>", lambda event: canvas.yview_scroll(int(-1*(event.delta/60)), "units"))
         vscrollbar.config(command=canvas.yview)
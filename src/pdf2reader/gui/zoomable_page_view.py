@@ -0,0 +1,240 @@
+import logging
+import math
+import tkinter as tk
+from collections import OrderedDict
+from tkinter import ttk
+from typing import Callable, List
+
+from PIL import ImageTk
+
+from pdf2reader.gui.crop_selector import CropSelector
+from pdf2reader.gui.render_queue import RenderQueue
+from pdf2reader.pdf_file import PdfFile, PdfPage
+
+logger = logging.getLogger(__name__)
+
+
+class ZoomablePageView(tk.Frame):
+    """
+    Original page view that can be zoomed in far without rendering the whole page at once.
+    The page is rendered in square tiles, only the visible ones are rendered (in background, from the page's cached
+    display list) and at most `max_tiles` of them are kept, so the memory does not grow with the zoom.
+    A crop area can be selected on the zoomed page (start_cropping, get_crop_area), so it can be placed precisely.
+    """
+    TILE_SIZE = 256
+    ZOOM_STEP = 1.25
+    MIN_ZOOM = 0.25
+    MAX_ZOOM = 16.
+
+    def __init__(self, parent: tk.Frame or tk.Toplevel or tk.Tk, page: PdfPage, zoom: float = 1.,
+                 max_tiles: int = 96, crop_area: List[float] = None, *args, **kwargs):
+        """
+        :param crop_area: Crop area shown on the page, [x1, y1, x2, y2] in PDF points from the top left page corner
+        """
+        tk.Frame.__init__(self, parent, *args, **kwargs)
+        self.page = page
+        self.zoom = zoom
+        self.max_tiles = max_tiles
+
+        # Crop selector coordinates are canvas pixels, the crop area is kept in page points to survive zooming
+        self.crop_selected_area = [tk.IntVar(), tk.IntVar(), tk.IntVar(), tk.IntVar()]
+        self.crop_selector = None
+        self._crop_area = list(crop_area) if crop_area else None
+        self._cropping = False
+
+        self._display_list = page.get_display_list()
+        self._page_width, self._page_height = self._display_list.rect.width, self._display_list.rect.height
+        self._tiles: "OrderedDict[tuple[float, int, int], tuple[ImageTk.PhotoImage, int]]" = OrderedDict()
+        self._render_queue = RenderQueue(self, workers=1)
+
+        self._create_canvas()
+        self._set_zoom(zoom)
+
+    def _create_canvas(self):
+        vscrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL)
+        hscrollbar = ttk.Scrollbar(self, orient=tk.HORIZONTAL)
+        self.canvas = tk.Canvas(self, background="gray", highlightthickness=0,
+                                xscrollcommand=lambda *args: self._scrolled(hscrollbar, *args),
+                                yscrollcommand=lambda *args: self._scrolled(vscrollbar, *args))
+        vscrollbar.config(command=self.canvas.yview)
+        hscrollbar.config(command=self.canvas.xview)
+
+        vscrollbar.pack(fill=tk.Y, side=tk.RIGHT, expand=False)
+        hscrollbar.pack(fill=tk.X, side=tk.BOTTOM, expand=False)
+        self.canvas.pack(fill=tk.BOTH, side=tk.LEFT, expand=True)
+
+        self.canvas.bind("<MouseWheel>", self._mouse_wheel)
+        self.canvas.bind("<Control-MouseWheel>", self._mouse_wheel_zoom)
+        # X11 reports the mouse wheel as buttons 4 and 5
+        self.canvas.bind("<Button-4>", lambda event: self.canvas.yview_scroll(-1, "units"))
+        self.canvas.bind("<Button-5>", lambda event: self.canvas.yview_scroll(1, "units"))
+        self.canvas.bind("<Control-Button-4>", lambda event: self.zoom_in())
+        self.canvas.bind("<Control-Button-5>", lambda event: self.zoom_out())
+
+    def _scrolled(self, scrollbar: ttk.Scrollbar, first, last):
+        scrollbar.set(first, last)
+        self._update_visible_tiles()
+
+    def _mouse_wheel(self, event):
+        self.canvas.yview_scroll(int(-1 * (event.delta / 60)), "units")
+
+    def _mouse_wheel_zoom(self, event):
+        if event.delta > 0:
+            self.zoom_in()
+        else:
+            self.zoom_out()
+
+    def zoom_in(self):
+        self._set_zoom(self.zoom * self.ZOOM_STEP)
+
+    def zoom_out(self):
+        self._set_zoom(self.zoom / self.ZOOM_STEP)
+
+    def _set_zoom(self, zoom: float):
+        zoom = min(self.MAX_ZOOM, max(self.MIN_ZOOM, zoom))
+        logger.debug(f"Zooming page view to {zoom}")
+
+        # Keeps the same relative location in view
+        x_fraction, y_fraction = self.canvas.xview()[0], self.canvas.yview()[0]
+        self._crop_area = self.get_crop_area()
+        self.zoom = zoom
+        self._render_queue.clear()
+        self._tiles.clear()
+        self.canvas.delete(tk.ALL)
+        self.canvas.config(scrollregion=(0, 0, self._page_width * zoom, self._page_height * zoom))
+        self.canvas.xview_moveto(x_fraction)
+        self.canvas.yview_moveto(y_fraction)
+        self._create_crop_selector()
+        self._update_visible_tiles()
+
+    def _create_crop_selector(self):
+        # The previous selector's items were deleted with the canvas items, its mouse bindings are replaced
+        if self._crop_area:
+            for var, value in zip(self.crop_selected_area, self._crop_area):
+                var.set(int(round(value * self.zoom)))
+        self.crop_selector = CropSelector(self.canvas, self.crop_selected_area,
+                                          crop_already_exists=self._crop_area is not None,
+                                          max_x=int(self._page_width * self.zoom),
+                                          max_y=int(self._page_height * self.zoom))
+        if self._cropping:
+            self.crop_selector.switch_to_cropping()
+
+    def start_cropping(self):
+        """ Lets the user select the crop area by dragging on the page """
+        self._cropping = True
+        self.crop_selector.switch_to_cropping()
+
+    def stop_cropping(self):
+        self._cropping = False
+        self.crop_selector.switch_to_indicator()
+
+    def get_crop_area(self) -> List[float] or None:
+        """ Selected crop area [x1, y1, x2, y2] in PDF points from the top left page corner, None if there is none """
+        if self.crop_selector is None or not self.crop_selector.crop_created:
+            return self._crop_area
+        return [var.get() / self.zoom for var in self.crop_selected_area]
+
+    def _get_visible_tiles(self):
+        x0, y0 = self.canvas.canvasx(0), self.canvas.canvasy(0)
+        x1, y1 = x0 + self.canvas.winfo_width(), y0 + self.canvas.winfo_height()
+        columns = math.ceil(self._page_width * self.zoom / self.TILE_SIZE)
+        rows = math.ceil(self._page_height * self.zoom / self.TILE_SIZE)
+        for ty in range(max(0, int(y0 // self.TILE_SIZE)), min(rows, int(y1 // self.TILE_SIZE) + 1)):
+            for tx in range(max(0, int(x0 // self.TILE_SIZE)), min(columns, int(x1 // self.TILE_SIZE) + 1)):
+                yield tx, ty
+
+    def _update_visible_tiles(self):
+        for tx, ty in self._get_visible_tiles():
+            key = (self.zoom, tx, ty)
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+            else:
+                self._render_queue.submit(key, 0, lambda key=key: self._render_tile(*key),
+                                          lambda img, key=key: self._show_tile(key, img))
+
+    def _render_tile(self, zoom: float, tx: int, ty: int):
+        area = (tx * self.TILE_SIZE / zoom, ty * self.TILE_SIZE / zoom,
+                min(self._page_width, (tx + 1) * self.TILE_SIZE / zoom),
+                min(self._page_height, (ty + 1) * self.TILE_SIZE / zoom))
+        return PdfPage.render_display_list_area(self._display_list, zoom, area)
+
+    def _show_tile(self, key: tuple[float, int, int], img):
+        zoom, tx, ty = key
+        if zoom != self.zoom or key in self._tiles:
+            return
+        photo_img = ImageTk.PhotoImage(img)
+        item = self.canvas.create_image(tx * self.TILE_SIZE, ty * self.TILE_SIZE, anchor="nw", image=photo_img)
+        self.canvas.tag_lower(item)  # Under the crop area
+        self._tiles[key] = (photo_img, item)
+
+        while len(self._tiles) > self.max_tiles:
+            _, (_, evicted_item) = self._tiles.popitem(last=False)
+            self.canvas.delete(evicted_item)
+
+    def destroy(self):
+        self._render_queue.close()
+        super().destroy()
+
+
+class ZoomablePageWindow:
+    def __init__(self, pdf_file: PdfFile, page_number: int, grab_return_window: tk.Toplevel = None,
+                 crop_area: List[float] = None, crop_callback: Callable[[List[float]], None] = None):
+        """
+        :param grab_return_window: Window that gets the grab back when this one is closed
+        :param crop_area: Crop area shown on the page, [x1, y1, x2, y2] in PDF points from the top left page corner
+        :param crop_callback: If given, the crop area can be edited in the zoomed page. Called with the new crop area
+            (the same coordinates as crop_area) when it is applied, the window is closed before.
+        """
+        self.grab_return_window = grab_return_window
+        self.crop_callback = crop_callback
+
+        self.window = tk.Toplevel()
+        try:
+            self.window.grab_set()  # Fails on some platforms (works on Windows)
+        except:
+            pass
+        self.window.title(f"Page {page_number + 1}")
+        self.window.geometry("800x900")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        self.page_view = ZoomablePageView(self.window, pdf_file.get_page(page_number), crop_area=crop_area)
+
+        controls = tk.Frame(self.window, padx=5, pady=2)
+        tk.Button(controls, text="+", width=3, command=self.page_view.zoom_in).pack(side=tk.RIGHT)
+        tk.Button(controls, text="-", width=3, command=self.page_view.zoom_out).pack(side=tk.RIGHT)
+        tk.Label(controls, text="Zoom (Ctrl + mouse wheel): ").pack(side=tk.RIGHT)
+        if crop_callback:
+            self.crop_button = tk.Button(controls, text="Crop", command=self._crop_button_callback)
+            self.cropping_label = tk.Label(controls, text="Cropping...")
+            self.crop_done_button = tk.Button(controls, text="Apply crop", command=self._crop_done_button_callback)
+            self.crop_button.pack(side=tk.LEFT)
+
+        controls.pack(fill=tk.X, side=tk.TOP, expand=False)
+        self.page_view.pack(fill=tk.BOTH, side=tk.TOP, expand=True)
+
+    def _crop_button_callback(self):
+        self.crop_button.pack_forget()
+        self.crop_done_button.pack(side=tk.LEFT)
+        self.cropping_label.pack(side=tk.LEFT)
+        self.page_view.start_cropping()
+
+    def _crop_done_button_callback(self):
+        self.crop_done_button.pack_forget()
+        self.cropping_label.pack_forget()
+        self.crop_button.pack(side=tk.LEFT)
+        self.page_view.stop_cropping()
+
+        crop_area = self.page_view.get_crop_area()
+        if not crop_area or crop_area[0] == crop_area[2] or crop_area[1] == crop_area[3]:
+            return
+        self.close()
+        self.crop_callback(crop_area)
+
+    def close(self):
+        try:
+            self.window.grab_release()
+            if self.grab_return_window:
+                self.grab_return_window.grab_set()
+        except:
+            pass
+        self.window.destroy()
@@ -6,17 +6,21 @@
 
 from __future__ import annotations
 
+import io
 import logging
+import os
 import sys
 import tempfile
 import threading
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from os import fspath
 from pathlib import Path
-from typing import Callable, Iterator, MutableSet, NamedTuple, NewType, Sequence, List, Tuple
-from zlib import compress
+from typing import Callable, Iterable, Iterator, MutableSet, NamedTuple, NewType, Sequence, List, Tuple
+from zlib import compress, decompress
 
-import img2pdf
+import numpy as np
 import pikepdf
 from pikepdf import (
     Dictionary,
@@ -27,15 +31,18 @@ from pikepdf import (
     PdfError,
     PdfImage,
     Stream,
+    String,
     UnsupportedImageTypeError,
 )
-from PIL import Image
+from PIL import Image, JpegImagePlugin, features
 
-from ocrmypdf._concurrent import Executor, SerialExecutor
-from ocrmypdf._exec import jbig2enc, pngquant
+from ocrmypdf._concurrent import Executor
+from ocrmypdf._exec import jbig2enc
 from ocrmypdf._jobcontext import PdfContext
 from ocrmypdf.exceptions import OutputFileAccessError
-from ocrmypdf.helpers import IMG2PDF_KWARGS, safe_symlink
+from ocrmypdf.helpers import safe_symlink
+
+from pdf2reader.stats import PipelineStats, stage
 
 log = logging.getLogger(__name__)
 
@@ -126,108 +133,192 @@ def extract_image_filter(
 
 
 def extract_image_jbig2(
-        *, pike: Pdf, root: Path, image: Stream, xref: Xref, options
+        *, pike: Pdf, root: Path, image: Stream, xref: Xref, options, lock: threading.Lock
 ) -> XrefExt | None:
     """Extract an image, saving it as a JBIG2 file."""
     del options  # unused arg
 
-    result = extract_image_filter(pike, root, image, xref)
-    if result is None:
+    with lock:
+        result = extract_image_filter(pike, root, image, xref)
+        if result is None:
+            return None
+        pim, filtdp = result
+
+        if (
+                pim.bits_per_component == 1
+                and filtdp[0] != Name.JBIG2Decode
+                and jbig2enc.available()
+        ):
+            # Save any colorspace associated with the image, so that we
+            # will export a pure 1-bit PNG with no palette or ICC profile.
+            # Showing the palette or ICC to jbig2enc will cause it to perform
+            # colorspace transform to 1bpp, which will conflict the palette or
+            # ICC if it exists.
+            colorspace = pim.obj.get(Name.ColorSpace, None)
+            if colorspace is not None or pim.image_mask:
+                try:
+                    # Set to DeviceGray temporarily; we already in 1 bpc.
+                    pim.obj.ColorSpace = Name.DeviceGray
+                    imgname = root / f'{xref:08d}'
+                    with imgname.open('wb') as f:
+                        ext = pim.extract_to(stream=f)
+                    imgname.rename(imgname.with_suffix(ext))
+                except UnsupportedImageTypeError:
+                    return None
+                finally:
+                    # Restore image colorspace after temporarily setting it to DeviceGray
+                    if colorspace is not None:
+                        pim.obj.ColorSpace = colorspace
+                    else:
+                        del pim.obj.ColorSpace
+                return XrefExt(xref, ext)
+    return None
+
+
+def _uses_icc_colorspace(image: Stream) -> bool:
+    """Check if the image colorspace, or the base of its Indexed colorspace, is ICCBased."""
+    colorspace = image.get(Name.ColorSpace)
+    if isinstance(colorspace, pikepdf.Array) and len(colorspace) > 1 and colorspace[0] == Name.Indexed:
+        colorspace = colorspace[1]
+    return isinstance(colorspace, pikepdf.Array) and len(colorspace) > 0 and colorspace[0] == Name.ICCBased
+
+
+class _ImageData(NamedTuple):
+    """Pixels of a gray, RGB or indexed image copied out of the PDF, decoded without the PDF."""
+
+    data: bytes
+    flate: bool  # Data is still Flate compressed
+    mode: str
+    rawmode: str
+    size: tuple[int, int]
+    palette: bytes | None  # RGB palette of indexed images
+
+    def to_pil_image(self) -> Image.Image:
+        data = decompress(self.data) if self.flate else self.data
+        im = Image.frombytes(self.mode, self.size, data, 'raw', self.rawmode)
+        if self.palette is not None:
+            im.putpalette(self.palette, 'RGB')
+        return im
+
+
+def _copy_image_data(image: Stream, pim: PdfImage) -> _ImageData | None:
+    """Copy the data needed to decode the image out of the PDF.
+
+    Flate compressed data (without a predictor) is copied compressed, other
+    filters are decoded by qpdf. Returns None for images that are not 2, 4 or
+    8 bit gray, 8 bit RGB or indexed with a gray or RGB palette.
+    """
+    bits = pim.bits_per_component
+    try:
+        mode = pim.mode
+    except NotImplementedError:
+        return None
+    palette = None
+    if mode == 'P':
+        base, lookup = pim.palette
+        if base == 'L':
+            lookup = bytes(value for value in lookup for _ in range(3))
+        elif base != 'RGB':
+            return None
+        palette = lookup
+    elif mode != 'L' and not (mode == 'RGB' and bits == 8):
+        return None
+    if bits not in (2, 4, 8):
         return None
-    pim, filtdp = result
-
-    if (
-            pim.bits_per_component == 1
-            and filtdp[0] != Name.JBIG2Decode
-            and jbig2enc.available()
-    ):
-        # Save any colorspace associated with the image, so that we
-        # will export a pure 1-bit PNG with no palette or ICC profile.
-        # Showing the palette or ICC to jbig2enc will cause it to perform
-        # colorspace transform to 1bpp, which will conflict the palette or
-        # ICC if it exists.
-        colorspace = pim.obj.get(Name.ColorSpace, None)
-        if colorspace is not None or pim.image_mask:
+
+    filters = pim.filter_decodeparms
+    if not filters:
+        data, flate = image.read_raw_bytes(), False
+    elif len(filters) == 1 and filters[0][0] == Name.FlateDecode and filters[0][1].get(Name.Predictor, 1) == 1:
+        data, flate = image.read_raw_bytes(), True
+    else:
+        data, flate = image.read_bytes(), False
+    rawmode = mode if bits == 8 else f'{mode};{bits}'
+    return _ImageData(data, flate, mode, rawmode, (pim.width, pim.height), palette)
+
+
+def extract_image_generic(
+        *, pike: Pdf, root: Path, image: Stream, xref: Xref, options, lock: threading.Lock
+) -> XrefExt | None:
+    """Generic image extraction.
+
+    Only copying the image data out of the PDF is done under `lock`. Decoding and
+    PNG encoding run unlocked so that several images are processed at once,
+    except for images _copy_image_data does not handle, pikepdf decodes them
+    under the lock.
+    """
+    image_data = None
+    with lock:
+        result = extract_image_filter(pike, root, image, xref)
+        if result is None:
+            return None
+        pim, filtdp = result
+
+        # Don't try to PNG-optimize 1bpp images, since JBIG2 does it better.
+        if pim.bits_per_component == 1:
+            return None
+
+        if filtdp[0] == Name.DCTDecode:  # and options.optimize >= 2:
+            # This is a simple heuristic derived from some training data, that has
+            # about a 70% chance of guessing whether the JPEG is high quality,
+            # and possibly recompressible, or not. The number itself doesn't mean
+            # anything.
+            # bytes_per_pixel = int(raw_jpeg.Length) / (w * h)
+            # jpeg_quality_estimate = 117.0 * (bytes_per_pixel ** 0.213)
+            # if jpeg_quality_estimate < 65:
+            #     return None
             try:
-                # Set to DeviceGray temporarily; we already in 1 bpc.
-                pim.obj.ColorSpace = Name.DeviceGray
                 imgname = root / f'{xref:08d}'
                 with imgname.open('wb') as f:
                     ext = pim.extract_to(stream=f)
                 imgname.rename(imgname.with_suffix(ext))
             except UnsupportedImageTypeError:
                 return None
-            finally:
-                # Restore image colorspace after temporarily setting it to DeviceGray
-                if colorspace is not None:
-                    pim.obj.ColorSpace = colorspace
-                else:
-                    del pim.obj.ColorSpace
             return XrefExt(xref, ext)
-    return None
-
-
-def extract_image_generic(
-        *, pike: Pdf, root: Path, image: Stream, xref: Xref, options
-) -> XrefExt | None:
-    """Generic image extraction."""
-    result = extract_image_filter(pike, root, image, xref)
-    if result is None:
-        return None
-    pim, filtdp = result
-
-    # Don't try to PNG-optimize 1bpp images, since JBIG2 does it better.
-    if pim.bits_per_component == 1:
-        return None
-
-    if filtdp[0] == Name.DCTDecode:  # and options.optimize >= 2:
-        # This is a simple heuristic derived from some training data, that has
-        # about a 70% chance of guessing whether the JPEG is high quality,
-        # and possibly recompressible, or not. The number itself doesn't mean
-        # anything.
-        # bytes_per_pixel = int(raw_jpeg.Length) / (w * h)
-        # jpeg_quality_estimate = 117.0 * (bytes_per_pixel ** 0.213)
-        # if jpeg_quality_estimate < 65:
-        #     return None
-        try:
-            imgname = root / f'{xref:08d}'
-            with imgname.open('wb') as f:
-                ext = pim.extract_to(stream=f)
-            imgname.rename(imgname.with_suffix(ext))
-        except UnsupportedImageTypeError:
+        elif any(key in image for key in (Name.SMask, Name.Mask)) or _uses_icc_colorspace(image):
+            # Quantization would lose the alpha or the color profile, and color key
+            # masks would refer to palette indices
+            log.debug(f"xref {xref}: skipping image with a mask or ICC colorspace")
             return None
-        return XrefExt(xref, ext)
-    elif (
-            pim.indexed
-            and pim.colorspace in pim.SIMPLE_COLORSPACES
-            # and options.optimize >= 3
-    ):
-        # Try to improve on indexed images - these are far from low hanging
-        # fruit in most cases
-        pim.as_pil_image().save(png_name(root, xref))
-        return XrefExt(xref, '.png')
-    elif not pim.indexed and pim.colorspace in pim.SIMPLE_COLORSPACES:
-        # An optimization opportunity here, not currently taken, is directly
-        # generating a PNG from compressed data
-        try:
-            pim.as_pil_image().save(png_name(root, xref))
-        except NotImplementedError:
-            log.warning("PDF contains an atypical image that cannot be optimized.")
+        elif (
+                pim.indexed
+                and pim.colorspace in pim.SIMPLE_COLORSPACES
+                # and options.optimize >= 3
+        ):
+            # Try to improve on indexed images - these are far from low hanging
+            # fruit in most cases
+            image_data = _copy_image_data(image, pim)
+            if image_data is None:
+                pil_image = pim.as_pil_image()
+        elif not pim.indexed and pim.colorspace in pim.SIMPLE_COLORSPACES:
+            # An optimization opportunity here, not currently taken, is directly
+            # generating a PNG from compressed data
+            image_data = _copy_image_data(image, pim)
+            if image_data is None:
+                try:
+                    pil_image = pim.as_pil_image()
+                except NotImplementedError:
+                    log.warning("PDF contains an atypical image that cannot be optimized.")
+                    return None
+        elif (
+                not pim.indexed
+                and pim.colorspace == Name.ICCBased
+                and pim.bits_per_component == 1
+                and not options.jbig2_lossy
+        ):
+            # We can losslessly optimize 1-bit images to CCITT or JBIG2 without
+            # paying any attention to the ICC profile, provided we're not doing
+            # lossy JBIG2
+            pil_image = pim.as_pil_image()
+        else:
             return None
-        return XrefExt(xref, '.png')
-    elif (
-            not pim.indexed
-            and pim.colorspace == Name.ICCBased
-            and pim.bits_per_component == 1
-            and not options.jbig2_lossy
-    ):
-        # We can losslessly optimize 1-bit images to CCITT or JBIG2 without
-        # paying any attention to the ICC profile, provided we're not doing
-        # lossy JBIG2
-        pim.as_pil_image().save(png_name(root, xref))
-        return XrefExt(xref, '.png')
+        if image_data is None:
+            pil_image.load()  # Make sure all the data is read from the PDF while we hold the lock
 
-    return None
+    if image_data is not None:
+        pil_image = image_data.to_pil_image()
+    pil_image.save(png_name(root, xref))
+    return XrefExt(xref, '.png')
 
 
 def _find_image_xrefs_container(
@@ -289,11 +380,49 @@ def _find_image_xrefs(pdf: Pdf):
     return working_xrefs, pageno_for_xref
 
 
+def find_form_image_xrefs(pdf: Pdf) -> MutableSet[Xref]:
+    """Find XRefs of images drawn from inside Form XObjects (not directly by a page)."""
+    include_xrefs: MutableSet[Xref] = set()
+    exclude_xrefs: MutableSet[Xref] = set()
+    pageno_for_xref: dict[Xref, int] = {}
+
+    for pageno, page in enumerate(pdf.pages):
+        try:
+            xobjs = page.Resources.XObject
+        except AttributeError:
+            continue
+        for image in dict(xobjs).values():
+            if Name.Subtype in image and image.Subtype == Name.Form:
+                _find_image_xrefs_container(
+                    pdf, image, pageno, include_xrefs, exclude_xrefs, pageno_for_xref, depth=1
+                )
+
+    return include_xrefs | exclude_xrefs
+
+
+def _extract_image(args: tuple[Pdf, threading.Lock, Path, Xref, object, Callable[..., XrefExt | None]]
+                   ) -> tuple[Xref, XrefExt | None, bool]:
+    pike, lock, root, xref, options, extract_fn = args
+    with lock:
+        image = pike.get_object((xref, 0))
+    try:
+        result = extract_fn(
+            pike=pike, root=root, image=image, xref=xref, options=options, lock=lock
+        )
+    except Exception:  # pylint: disable=broad-except
+        log.exception(
+            f"xref {xref}: While extracting this image, an error occurred"
+        )
+        return xref, None, True
+    return xref, result, False
+
+
 def extract_images(
         pike: Pdf,
         root: Path,
         options,
         extract_fn: Callable[..., XrefExt | None],
+        executor: Executor | None = None,
 ) -> Iterator[tuple[int, XrefExt]]:
     """Extract image using extract_fn.
 
@@ -308,26 +437,47 @@ def extract_images(
     extract_fn must decide if wants to extract the image in this context. If
     it does a tuple should be returned: (xref, ext) where .ext is the file
     extension. extract_fn must also extract the file it finds interesting.
+    Images are extracted on the executor workers, so extract_fn must hold
+    the passed `lock` whenever it touches the PDF.
     """
-    errors = 0
+    executor = executor or DEFAULT_EXECUTOR
     working_xrefs, pageno_for_xref = _find_image_xrefs(pike)
-    for xref in working_xrefs:
-        image = pike.get_object((xref, 0))
-        try:
-            result = extract_fn(
-                pike=pike, root=root, image=image, xref=xref, options=options
-            )
-        except Exception:  # pylint: disable=broad-except
-            log.exception(
-                f"xref {xref}: While extracting this image, an error occurred"
-            )
-            errors += 1
+
+    # pikepdf objects are not thread safe, all access to them is serialized
+    lock = threading.Lock()
+
+    def extract_args() -> Iterator:
+        for xref in working_xrefs:
+            yield pike, lock, root, xref, options, extract_fn
+
+    results = []
+
+    def finish(result, pbar):
+        results.append(result)
+        pbar.update()
+
+    executor(
+        use_threads=True,  # We're sharing the pdf directly, must use threads
+        max_workers=options.jobs,
+        tqdm_kwargs=dict(
+            desc="Extracting images",
+            total=len(working_xrefs),
+            unit='image',
+            disable=not options.progress_bar,
+        ),
+        task=_extract_image,
+        task_arguments=extract_args(),
+        task_finished=finish,
+    )
+
+    for xref, result, error in results:
+        if error:
+            continue
+        if result:
+            _, ext = result
+            yield pageno_for_xref[xref], XrefExt(xref, ext), True
         else:
-            if result:
-                _, ext = result
-                yield pageno_for_xref[xref], XrefExt(xref, ext), True
-            else:
-                yield pageno_for_xref[xref], XrefExt(xref, '.unknown'), False
+            yield pageno_for_xref[xref], XrefExt(xref, '.unknown'), False
 
 
 def extract_images_generic(
@@ -513,15 +663,16 @@ def transcode_jpegs(
 
 
 def _find_deflatable_jpeg(
-        *, pike: Pdf, root: Path, image: Stream, xref: Xref, options
+        *, pike: Pdf, root: Path, image: Stream, xref: Xref, options, lock: threading.Lock
 ) -> XrefExt | None:
-    result = extract_image_filter(pike, root, image, xref)
-    if result is None:
-        return None
-    _pim, filtdp = result
+    with lock:
+        result = extract_image_filter(pike, root, image, xref)
+        if result is None:
+            return None
+        _pim, filtdp = result
 
-    if filtdp[0] == Name.DCTDecode and not filtdp[1]:  # and options.optimize >= 1:
-        return XrefExt(xref, '.memory')
+        if filtdp[0] == Name.DCTDecode and not filtdp[1]:  # and options.optimize >= 1:
+            return XrefExt(xref, '.memory')
 
     return None
 
@@ -592,45 +743,240 @@ def remove_images(pike: Pdf, images: Sequence[Xref], options) -> None:
         xobj.write(b'')
 
 
-def _transcode_png(pike: Pdf, filename: Path, xref: Xref) -> bool:
-    output = filename.with_suffix('.png.pdf')
-    with output.open('wb') as f:
-        img2pdf.convert(fspath(filename), outputstream=f, **IMG2PDF_KWARGS)
+JPEG_MCU_SIZE = 16  # Largest JPEG block (MCU) size, with 2x2 chroma subsampling
 
-    with Pdf.open(output) as pdf_image:
-        foreign_image = next(iter(pdf_image.pages[0].images.values()))
-        local_image = pike.copy_foreign(foreign_image)
+TRIMMABLE_FLATE_FILTERS = {Name.FlateDecode, Name.LZWDecode, Name.RunLengthDecode,
+                           Name.ASCIIHexDecode, Name.ASCII85Decode}
 
-        im_obj = pike.get_object(xref, 0)
-        im_obj.write(
-            local_image.read_raw_bytes(),
-            filter=local_image.Filter,
-            decode_parms=local_image.DecodeParms,
-        )
 
-        # Don't copy keys from the new image...
-        del_keys = set(im_obj.keys()) - set(local_image.keys())
-        # ...except for the keep_fields, which are essential to displaying
-        # the image correctly and preserving its metadata. (/Decode arrays
-        # and /SMaskInData are implicitly discarded prior to this point.)
-        keep_fields = {
-            '/ID',
-            '/Intent',
-            '/Interpolate',
-            '/Mask',
-            '/Metadata',
-            '/OC',
-            '/OPI',
-            '/SMask',
-            '/StructParent',
-        }
-        del_keys -= keep_fields
-        for key in local_image.keys():
-            if key != Name.Length and str(key) not in keep_fields:
-                im_obj[key] = local_image[key]
-        for key in del_keys:
-            del im_obj[key]
-    return True
+class ImageBackup(NamedTuple):
+    """Raw data of an image XObject, so it can be put back after a temporary edit."""
+
+    xref: Xref
+    raw_data: bytes
+    filter: Object | None
+    decode_parms: Object | None
+    width: int
+    height: int
+
+
+def backup_image(pike: Pdf, xref: Xref) -> ImageBackup:
+    im_obj = pike.get_object(xref, 0)
+    return ImageBackup(xref, im_obj.read_raw_bytes(), im_obj.get(Name.Filter), im_obj.get(Name.DecodeParms),
+                       int(im_obj.Width), int(im_obj.Height))
+
+
+def restore_image(pike: Pdf, backup: ImageBackup) -> None:
+    im_obj = pike.get_object(backup.xref, 0)
+    im_obj.write(backup.raw_data, filter=backup.filter, decode_parms=backup.decode_parms)
+    im_obj.Width = backup.width
+    im_obj.Height = backup.height
+
+
+def _image_filters(im_obj: Stream) -> list[Name]:
+    filters = im_obj.get(Name.Filter)
+    if filters is None:
+        return []
+    if isinstance(filters, pikepdf.Array):
+        return list(filters)
+    return [filters]
+
+
+def is_image_trimmable(pike: Pdf, xref: Xref) -> bool:
+    """Check if trim_image knows how to crop pixels of this image."""
+    im_obj = pike.get_object(xref, 0)
+    if im_obj.get(Name.Subtype) != Name.Image:
+        return False
+    if any(key in im_obj for key in (Name.SMask, Name.Mask, Name.Decode, Name.ImageMask)):
+        return False  # Masks would have to be trimmed the same way
+    if im_obj.get(Name.BitsPerComponent) != 8:
+        return False
+
+    filters = _image_filters(im_obj)
+    if filters and filters[-1] == Name.DCTDecode:
+        return filters in ([Name.DCTDecode], [Name.FlateDecode, Name.DCTDecode])
+    return all(f in TRIMMABLE_FLATE_FILTERS for f in filters)
+
+
+def trim_image(pike: Pdf, xref: Xref, box: tuple[int, int, int, int]) -> tuple[int, int, int, int] | None:
+    """Crop image XObject pixels to box (left, top, right, bottom).
+
+    JPEGs are re-encoded with their original quantization tables, with the box
+    grown to the JPEG block grid so the kept blocks do not shift. Other images
+    are stored as Flate. Returns the box actually used, or None if the image
+    was left untouched.
+    """
+    if not is_image_trimmable(pike, xref):
+        return None
+
+    im_obj = pike.get_object(xref, 0)
+    left, top, right, bottom = box
+    width, height = int(im_obj.Width), int(im_obj.Height)
+    filters = _image_filters(im_obj)
+
+    if filters and filters[-1] == Name.DCTDecode:
+        jpeg = im_obj.read_raw_bytes()
+        if len(filters) == 2:
+            jpeg = decompress(jpeg)
+        with Image.open(io.BytesIO(jpeg)) as im:
+            if im.mode == 'CMYK':
+                return None  # Adobe inverted CMYK JPEGs do not survive the round trip
+            left, top = left - left % JPEG_MCU_SIZE, top - top % JPEG_MCU_SIZE
+            box = left, top, right, bottom
+            out = io.BytesIO()
+            im.crop(box).save(out, format='JPEG', qtables=im.quantization,
+                              subsampling=JpegImagePlugin.get_sampling(im), optimize=True)
+        data = out.getvalue()
+        if len(filters) == 2:
+            im_obj.write(compress(data, 9), filter=[Name.FlateDecode, Name.DCTDecode])
+        else:
+            im_obj.write(data, filter=Name.DCTDecode)
+    else:
+        try:
+            raw = im_obj.read_bytes()
+        except PdfError:
+            return None
+        if len(raw) % (width * height) != 0:
+            return None
+        pixels = np.frombuffer(raw, dtype=np.uint8).reshape(height, width, -1)
+        im_obj.write(compress(pixels[top:bottom, left:right].tobytes(), 9), filter=Name.FlateDecode)
+
+    im_obj.Width = right - left
+    im_obj.Height = bottom - top
+    log.debug(f"xref {xref}: trimmed image from {width}x{height} to {right - left}x{bottom - top}")
+    return box
+
+
+class QuantizedPng(NamedTuple):
+    """A paletted image ready to be written into an image XObject."""
+
+    data: bytes
+    width: int
+    height: int
+    bits_per_component: int
+    palette: bytes
+
+
+def _png_quality_range(png_quality: int) -> tuple[int, int]:
+    """Min and max quality of a 0-100 PNG quality, as passed to pngquant --quality."""
+    return max(10, png_quality - 10), min(100, png_quality + 10)
+
+
+def _quality_to_mse(quality: int) -> float:
+    """Mean square error per pixel allowed for a 0-100 quality, libimagequant's mapping.
+
+    The error is summed over the RGB channels scaled to 0-1.
+    """
+    if quality >= 100:
+        return 0.
+    extra_low_quality_fudge = max(0., 0.016 / (0.001 + quality) - 0.001)
+    return extra_low_quality_fudge + 2.5 / (210. + quality) ** 1.2 * (100.1 - quality) / 100.
+
+
+def _palette_mse(original: np.ndarray, quantized: Image.Image) -> float:
+    """Mean square error of a quantized image against the original RGB pixels scaled to 0-1."""
+    diff = (np.asarray(quantized.convert('RGB'), dtype=np.float32) - original) / 255
+    return float(np.mean(np.sum(diff * diff, axis=2)))
+
+
+def _pack_palette_indices(indices: np.ndarray, bits: int) -> bytes:
+    """Pack 8-bit palette indices into rows of `bits` bits per pixel."""
+    if bits == 8:
+        return indices.tobytes()
+    pixels_per_byte = 8 // bits
+    height, width = indices.shape
+    padded_width = -(-width // pixels_per_byte) * pixels_per_byte
+    padded = np.zeros((height, padded_width), dtype=np.uint8)
+    padded[:, :width] = indices
+    grouped = padded.reshape(height, padded_width // pixels_per_byte, pixels_per_byte)
+    shifts = np.arange(pixels_per_byte - 1, -1, -1, dtype=np.uint8) * bits
+    return np.bitwise_or.reduce(grouped << shifts, axis=2).astype(np.uint8).tobytes()
+
+
+def _quantize_png(args: tuple[Xref, Path, int, int]) -> tuple[Xref, QuantizedPng | None]:
+    """Quantize an extracted image to a palette in-process.
+
+    Uses Pillow's libimagequant backend (the library behind pngquant) when Pillow
+    was built with it, otherwise falls back to Pillow's own quantizer. Like
+    pngquant --quality min-max, the palette is the smallest one that reaches the
+    max quality, and the image is skipped if even 256 colors stay below the min.
+    """
+    xref, in_png, png_quality, original_size = args
+    min_quality, max_quality = _png_quality_range(png_quality)
+
+    with Image.open(in_png) as im:
+        if im.mode not in ('L', 'RGB', 'P') or 'transparency' in im.info:
+            log.debug(f"xref {xref}, png, has {im.mode} pixels or transparency - skip")
+            return xref, None
+        if im.mode != 'L':
+            im = im.convert('RGB')
+        original = np.asarray(im.convert('RGB'), dtype=np.float32)
+        method = Image.Quantize.LIBIMAGEQUANT if features.check_feature('libimagequant') else None
+
+        def quantize(colors: int) -> tuple[Image.Image, float]:
+            quantized = im.quantize(colors=colors, method=method, dither=Image.Dither.NONE)
+            return quantized, _palette_mse(original, quantized)
+
+        quantized, mse = quantize(256)
+        if mse > _quality_to_mse(min_quality):
+            log.debug(f"xref {xref}, png, cannot reach quality {min_quality} - skip")
+            return xref, None
+        if mse <= _quality_to_mse(max_quality):
+            # Smallest palette that still reaches the max quality, palette sizes 2 to 128
+            low, high = 1, 7
+            while low <= high:
+                exponent = (low + high) // 2
+                candidate, candidate_mse = quantize(2 ** exponent)
+                if candidate_mse <= _quality_to_mse(max_quality):
+                    quantized, high = candidate, exponent - 1
+                else:
+                    low = exponent + 1
+
+    palette = bytes(quantized.getpalette()[:3 * 256])
+    colors = len(palette) // 3
+    bits = 1 if colors <= 2 else 2 if colors <= 4 else 4 if colors <= 16 else 8
+
+    data = compress(_pack_palette_indices(np.asarray(quantized, dtype=np.uint8), bits), 9)
+    if len(data) + len(palette) >= original_size:
+        log.debug(f"xref {xref}, png, made larger - skip")
+        return xref, None
+    return xref, QuantizedPng(data, quantized.width, quantized.height, bits, palette)
+
+
+def _write_quantized_png(pike: Pdf, xref: Xref, quantized: QuantizedPng) -> None:
+    """Replace image XObject data with a paletted Flate stream."""
+    im_obj = pike.get_object(xref, 0)
+    im_obj.write(quantized.data, filter=Name.FlateDecode)
+
+    new_keys = {
+        '/Width': quantized.width,
+        '/Height': quantized.height,
+        '/BitsPerComponent': quantized.bits_per_component,
+        '/ColorSpace': pikepdf.Array([Name.Indexed, Name.DeviceRGB, len(quantized.palette) // 3 - 1,
+                                      String(quantized.palette)]),
+    }
+    # Only keep fields which are essential to displaying the image correctly and
+    # preserving its metadata. (/Decode arrays and /SMaskInData are implicitly
+    # discarded prior to this point.)
+    keep_fields = {
+        '/Type',
+        '/Subtype',
+        '/Filter',
+        '/Length',
+        '/ID',
+        '/Intent',
+        '/Interpolate',
+        '/Mask',
+        '/Metadata',
+        '/OC',
+        '/OPI',
+        '/SMask',
+        '/StructParent',
+    }
+    for key in set(im_obj.keys()) - keep_fields - set(new_keys):
+        del im_obj[key]
+    for key, value in new_keys.items():
+        im_obj[key] = value
 
 
 # TODO black and white for transcode_pngs
@@ -642,44 +988,69 @@ def transcode_pngs(
         options,
         executor,
 ) -> None:
-    """Apply lossy transcoding to PNGs."""
-    modified: MutableSet[Xref] = set()
-    if True:  # options.optimize >= 2:
-        png_quality = (
-            max(10, options.png_quality - 10),
-            min(100, options.png_quality + 10),
-        )
+    """Apply lossy transcoding to PNGs.
 
-        def pngquant_args():
-            for xref in images:
-                log.debug(image_name_fn(root, xref))
-                yield (
-                    image_name_fn(root, xref),
-                    png_name(root, xref),
-                    png_quality[0],
-                    png_quality[1],
-                )
-                modified.add(xref)
+    Quantization runs in worker threads, results are written into the PDF in the
+    calling thread as they finish.
+    """
+
+    def quantize_args():
+        for xref in images:
+            log.debug(image_name_fn(root, xref))
+            yield (
+                xref,
+                image_name_fn(root, xref),
+                options.png_quality,
+                int(pike.get_object(xref, 0).Length),
+            )
+
+    def finish_png(result: tuple[Xref, QuantizedPng | None], pbar):
+        xref, quantized = result
+        if quantized:
+            _write_quantized_png(pike, xref, quantized)
+        pbar.update()
+
+    executor(
+        use_threads=True,  # Pillow releases the GIL while quantizing and compressing
+        max_workers=options.jobs,
+        tqdm_kwargs=dict(
+            desc="PNGs",
+            total=len(images),
+            unit='image',
+            disable=not options.progress_bar,
+        ),
+        task=_quantize_png,
+        task_arguments=quantize_args(),
+        task_finished=finish_png,
+    )
 
-        executor(
-            use_threads=True,
-            max_workers=options.jobs,
-            tqdm_kwargs=dict(
-                desc="PNGs",
-                total=len(images),
-                unit='image',
-                disable=not options.progress_bar,
-            ),
-            task=pngquant.quantize_mp,
-            task_arguments=pngquant_args(),
-        )
 
-    for xref in modified:
-        filename = png_name(root, xref)
-        _transcode_png(pike, filename, xref)
+class ThreadExecutor(Executor):
+    """Runs tasks in a thread pool, calling `task_finished` in the calling thread.
 
+    Workers must not touch the pikepdf objects unless they hold a lock, results
+    are written back to the PDF from `task_finished`.
+    """
 
-DEFAULT_EXECUTOR = SerialExecutor()
+    def _execute(
+            self,
+            *,
+            use_threads: bool,
+            max_workers: int,
+            tqdm_kwargs: dict,
+            worker_initializer: Callable,
+            task: Callable,
+            task_arguments: Iterable,
+            task_finished: Callable,
+    ):  # pylint: disable=unused-argument
+        with self.pbar_class(**tqdm_kwargs) as pbar, \
+                ThreadPoolExecutor(max_workers=max_workers, initializer=worker_initializer) as pool:
+            futures = [pool.submit(task, args) for args in task_arguments]
+            for future in as_completed(futures):
+                task_finished(future.result(), pbar)
+
+
+DEFAULT_EXECUTOR = ThreadExecutor()
 
 executor: Executor = DEFAULT_EXECUTOR,
 
@@ -698,7 +1069,7 @@ class OptimizationOptions:
         self.jbig2_lossy = False
         self.quiet = True
         self.progress_bar = False
-        self.jobs = 1
+        self.jobs = os.cpu_count() or 1
         self.black_and_white = False
 
 
@@ -709,8 +1080,9 @@ def extract_pdf_images(pike_pdf: pikepdf.Pdf, folder: Path or str) -> Tuple[List
 
 
 def optimize_pdf_images(pike_pdf: pikepdf.Pdf, images: Tuple[List[Xref], List[Xref], List[Xref]], tmpdir: Path or str,
-                        options: OptimizationOptions, executor: Executor = DEFAULT_EXECUTOR) -> None:
-    """Optimize images in a PDF file."""
+                        options: OptimizationOptions, executor: Executor = DEFAULT_EXECUTOR,
+                        stats: PipelineStats = None) -> None:
+    """Optimize images in a PDF file. Time of each image class is recorded to `stats` if given."""
 
     if options.should_resize:
         if not options.target_height:
@@ -718,18 +1090,138 @@ def optimize_pdf_images(pike_pdf: pikepdf.Pdf, images: Tuple[List[Xref], List[Xr
         if not options.target_width:
             options.target_width = pike_pdf.pages[0].original_crop_area[2] - pike_pdf.pages[0].original_crop_area[0]
 
-    options.jobs = 1
-
     tmpdir = Path(tmpdir)
     jpegs, pngs, others = images
 
     if options.should_remove_images:
-        remove_images(pike_pdf, jpegs + pngs + others, options)
+        with stage(stats, "remove_images", images=len(jpegs) + len(pngs) + len(others)):
+            remove_images(pike_pdf, jpegs + pngs + others, options)
 
     else:
-        transcode_jpegs(pike_pdf, jpegs, tmpdir, options, executor)
-        deflate_jpegs(pike_pdf, tmpdir, options, executor)
-        transcode_pngs(pike_pdf, pngs, png_name, tmpdir, options, executor)
+        with stage(stats, "optimize_jpeg", images=len(jpegs)):
+            transcode_jpegs(pike_pdf, jpegs, tmpdir, options, executor)
+        with stage(stats, "deflate_jpeg"):
+            deflate_jpegs(pike_pdf, tmpdir, options, executor)
+        with stage(stats, "optimize_png", images=len(pngs)):
+            transcode_pngs(pike_pdf, pngs, png_name, tmpdir, options, executor)
+
+
+class ImageOptimizationEstimate(NamedTuple):
+    """Expected result of optimize_pdf_images, extrapolated from a sample of the images."""
+
+    images_count: int
+    sampled_count: int
+    size_before: int  # Bytes of image streams now
+    size_after: int  # Expected bytes of image streams after optimization
+    seconds: float  # Expected optimization time
+
+
+def _stratified_sample(pike_pdf: Pdf, xrefs: Sequence[Xref], sample_size: int) -> list[Xref]:
+    """Pick images spread evenly over the range of stream sizes."""
+    if len(xrefs) <= sample_size:
+        return list(xrefs)
+    by_size = sorted(xrefs, key=lambda xref: int(pike_pdf.get_object(xref, 0).Length))
+    bucket = len(by_size) / sample_size
+    return [by_size[int(bucket * i + bucket / 2)] for i in range(sample_size)]
+
+
+def estimate_pdf_images_optimization(pike_pdf: pikepdf.Pdf, images: Tuple[List[Xref], List[Xref], List[Xref]],
+                                     tmpdir: Path or str, options: OptimizationOptions,
+                                     executor: Executor = DEFAULT_EXECUTOR,
+                                     sample_size: int = 8) -> ImageOptimizationEstimate:
+    """Estimate output size and time of optimize_pdf_images without changing the PDF.
+
+    Runs the stages of optimize_pdf_images (JPEG recompression and deflate, PNG quantization)
+    on up to `sample_size` images of each kind and scales the size ratio of the sample to all
+    images of that kind. The time is scaled from the work of the sampled images (time spent in
+    the workers and in the calling thread per input byte), spread over the workers the real run
+    would use.
+    """
+    tmpdir = Path(tmpdir)
+    jpegs, pngs, others = images
+
+    def stream_size(xref: Xref) -> int:
+        return int(pike_pdf.get_object(xref, 0).Length)
+
+    size_before = sum(stream_size(xref) for xref in jpegs + pngs + others)
+    if options.should_remove_images:
+        return ImageOptimizationEstimate(len(jpegs + pngs + others), 0, size_before, 0, 0.)
+
+    size_after = sum(stream_size(xref) for xref in others)
+    seconds = 0.
+    sampled_count = 0
+
+    def run_sample(xrefs: Sequence[Xref], task: Callable, task_args: Callable[[Xref], tuple],
+                   result_size: Callable[[tuple], int]):
+        nonlocal size_after, seconds, sampled_count
+        sample = _stratified_sample(pike_pdf, xrefs, sample_size)
+        if not sample:
+            return
+        sample_after = []
+        worker_seconds, finish_seconds = 0., 0.
+
+        def timed_task(args) -> tuple:
+            start = time.perf_counter()
+            result = task(args)
+            return result, time.perf_counter() - start
+
+        def finish(timed_result: tuple, pbar):
+            nonlocal worker_seconds, finish_seconds
+            result, task_seconds = timed_result
+            worker_seconds += task_seconds
+            start = time.perf_counter()
+            sample_after.append(result_size(result))
+            finish_seconds += time.perf_counter() - start
+            pbar.update()
+
+        executor(
+            use_threads=True,
+            max_workers=options.jobs,
+            tqdm_kwargs=dict(desc="Estimating", total=len(sample), unit='image', disable=True),
+            task=timed_task,
+            task_arguments=(task_args(xref) for xref in sample),
+            task_finished=finish,
+        )
+
+        sample_before = sum(stream_size(xref) for xref in sample)
+        all_before = sum(stream_size(xref) for xref in xrefs)
+        scale = all_before / max(sample_before, 1)
+        size_after += int(sum(sample_after) * scale)
+        # Workers run in parallel in the real run, results are written to the PDF one at a time
+        seconds += worker_seconds * scale / max(1, min(options.jobs, len(xrefs))) + finish_seconds * scale
+        sampled_count += len(sample)
+
+    def deflated_size(data: bytes) -> int:
+        """Size after deflate_jpegs, which keeps the deflated JPEG only if it is smaller"""
+        return min(len(data), len(compress(data, 9)))
+
+    def jpeg_result_size(result: tuple[Xref, Path | None]) -> int:
+        xref, opt_jpg = result
+        if opt_jpg is None:
+            try:
+                return deflated_size(pike_pdf.get_object(xref, 0).read_raw_bytes())
+            except PdfError:
+                return stream_size(xref)
+        data = opt_jpg.read_bytes()
+        opt_jpg.unlink()
+        return deflated_size(data)
+
+    def png_result_size(result: tuple[Xref, QuantizedPng | None]) -> int:
+        xref, quantized = result
+        if quantized is None:
+            return stream_size(xref)
+        return len(quantized.data) + len(quantized.palette)
+
+    run_sample(jpegs, _optimize_jpeg,
+               lambda xref: (xref, jpg_name(tmpdir, xref), jpg_name(tmpdir, xref).with_suffix('.estimate.jpg'),
+                             options.jpeg_quality, options.black_and_white, options.target_height,
+                             options.target_width, options.should_resize),
+               jpeg_result_size)
+    run_sample(pngs, _quantize_png,
+               lambda xref: (xref, png_name(tmpdir, xref), options.png_quality, stream_size(xref)),
+               png_result_size)
+
+    return ImageOptimizationEstimate(len(jpegs + pngs + others), sampled_count, size_before, size_after, seconds)
 
 
 def optimize(
@@ -1,9 +1,17 @@
+import hashlib
 import io
 import logging
+import mmap
+import os
+import sys
+import threading
+from array import array
+from decimal import Decimal
 from difflib import SequenceMatcher
+from collections.abc import Sequence
 from enum import Enum
 from tempfile import TemporaryDirectory
-from typing import List
+from typing import Callable, List, Dict, NamedTuple, Tuple
 
 import fitz
 import numpy as np
@@ -11,17 +19,210 @@ import pikepdf
 from PIL import Image
 
 from pdf2reader.data_structures import Box
-from pdf2reader.images_optimization import optimize_pdf_images, OptimizationOptions, extract_pdf_images
+from pdf2reader.profiling import profile_stage
+from pdf2reader.stats import PipelineStats, stage
+from pdf2reader.thumbnail_cache import ThumbnailCache, DiskThumbnailCache, DEFAULT_RASTER_CACHE_SIZE
+from pdf2reader.images_optimization import optimize_pdf_images, OptimizationOptions, extract_pdf_images, \
+    ImageBackup, backup_image, restore_image, trim_image, is_image_trimmable, find_form_image_xrefs, \
+    ImageOptimizationEstimate, estimate_pdf_images_optimization
 
 logger = logging.getLogger(__name__)
 
+# MuPDF is not thread safe, pages rendered from background threads are rendered one at a time
+FITZ_LOCK = threading.RLock()
+
+TEXT_STATE_OPERATORS = {pikepdf.Operator(op) for op in ("Tc", "Tw", "Tz", "TL", "Tr", "Ts")}
+
+# Operators that are kept from sections pruned from the output, so that the graphics state,
+# q/Q and marked content nesting stays the same for the following sections
+# (" and TD also set text state, they are replaced by Tw, Tc and TL, see Section.get_state_content)
+STATE_OPERATORS = TEXT_STATE_OPERATORS | {pikepdf.Operator(op) for op in (
+    "q", "Q", "cm", "w", "J", "j", "M", "d", "ri", "i", "gs",
+    "CS", "cs", "SC", "SCN", "sc", "scn", "G", "g", "RG", "rg", "K", "k",
+    "Tf", "BMC", "BDC", "EMC", "BX", "EX")}
+
+
+def _estimate_text_length(content) -> Tuple[int, int, float] or Tuple[None, None, None]:
+    """ Number of glyphs (upper bound), spaces and sum of absolute TJ adjustments of text operand """
+    if isinstance(content, pikepdf.Array):
+        glyphs, spaces, adjustment = 0, 0, 0.
+        for item in content:
+            if isinstance(item, (int, float, Decimal)):
+                adjustment += abs(float(item))
+            else:
+                item_bytes = bytes(item)
+                glyphs += len(item_bytes)
+                spaces += item_bytes.count(b" ")
+        return glyphs, spaces, adjustment
+    try:
+        content_bytes = bytes(content)
+    except (TypeError, ValueError):
+        return None, None, None
+    return len(content_bytes), content_bytes.count(b" "), 0.
+
+
+def _is_type3_font(page_resources: pikepdf.Dictionary, font_name: pikepdf.Name) -> bool:
+    try:
+        return page_resources.Font[font_name].get("/Subtype") == pikepdf.Name.Type3
+    except (AttributeError, KeyError, TypeError):
+        return False
+
+
+def _get_xobject_bbox(xobject: pikepdf.Object, transform: np.ndarray) -> List[float] or None:
+    """ User space bounding box of an image or form XObject drawn with transform, None if unknown """
+    subtype = xobject.get("/Subtype")
+    if subtype == pikepdf.Name.Image:
+        x0, y0, x1, y1 = 0., 0., 1., 1.
+    elif subtype == pikepdf.Name.Form and "/BBox" in xobject:
+        x0, y0, x1, y1 = [float(x) for x in xobject.BBox]
+        if "/Matrix" in xobject:
+            m = [float(x) for x in xobject.Matrix]
+            transform = np.array([[m[0], m[1], 0], [m[2], m[3], 0], [m[4], m[5], 1]], dtype=np.float64) @ transform
+    else:
+        return None
+    corners = np.array([[x0, y0, 1], [x0, y1, 1], [x1, y0, 1], [x1, y1, 1]], dtype=np.float64) @ transform
+    return [corners[:, 0].min(), corners[:, 1].min(), corners[:, 0].max(), corners[:, 1].max()]
+
+
+# Keys that lead from page content to other pages or to the document structure, they do not change the rendering
+_NOT_HASHED_KEYS = frozenset(("/Parent", "/P", "/Annots", "/Dest", "/Dests", "/A", "/Next", "/First", "/Last",
+                              "/Prev", "/StructParent", "/StructParents", "/Metadata"))
+
+
+def _hash_pdf_object(hasher, obj, seen: set):
+    """
+    Adds obj and the objects it references to hasher, streams by their raw (still encoded) data.
+    References to pages and the keys in _NOT_HASHED_KEYS are not followed, so only obj itself is hashed and not
+    the rest of the document. Walks the objects with a stack, deeply nested objects are fine.
+    """
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, tuple):  # (delimiter,) pushed by a container
+            hasher.update(obj[0])
+            continue
+
+        if isinstance(obj, pikepdf.Object) and obj.is_indirect:
+            if obj.objgen in seen:
+                hasher.update(b"R")
+                continue
+            seen.add(obj.objgen)
+
+        if isinstance(obj, pikepdf.Stream):
+            hasher.update(b"stream")
+            hasher.update(obj.read_raw_bytes())
+            items = obj.items()
+        elif isinstance(obj, pikepdf.Dictionary):
+            if obj.get("/Type") in (pikepdf.Name.Page, pikepdf.Name.Pages):
+                hasher.update(b"page")
+                continue
+            items = obj.items()
+        elif isinstance(obj, pikepdf.Array):
+            hasher.update(b"[")
+            stack.append((b"]",))
+            stack.extend(reversed(list(obj)))
+            continue
+        else:
+            hasher.update(repr(obj).encode())
+            continue
+
+        hasher.update(b"<<")
+        stack.append((b">>",))
+        for key, value in sorted(items, key=lambda item: item[0], reverse=True):
+            if key not in _NOT_HASHED_KEYS:
+                stack.append(value)
+                stack.append((key.encode(),))
+
+
+def _get_inherited_page_attribute(page_obj: pikepdf.Dictionary, key: str):
+    """ Page attribute that can also be set on its parents in the page tree (e.g. /Rotate, /CropBox) """
+    seen = set()
+    node = page_obj
+    while node is not None and node.objgen not in seen:
+        if key in node:
+            return node[key]
+        seen.add(node.objgen)
+        node = node.get("/Parent")
+    return None
+
+
+def _get_page_resources(page_obj: pikepdf.Dictionary) -> pikepdf.Dictionary or None:
+    """ /Resources of the page, also inherited ones. Unlike pikepdf.Page.resources it does not add an empty one """
+    return _get_inherited_page_attribute(page_obj, "/Resources")
+
+
+def _backup_page_resources(page_obj: pikepdf.Dictionary) -> tuple:
+    """
+    The page's own /Resources (None if inherited) and the entries of its resource dictionaries,
+    remove_unreferenced_resources replaces them with trimmed direct copies
+    """
+    resources = page_obj.get("/Resources")
+    if not isinstance(resources, pikepdf.Dictionary):
+        return resources, {}
+    return resources, {key: (value, dict(value.items())) for key, value in resources.items()
+                       if isinstance(value, pikepdf.Dictionary)}
+
+
+def _restore_page_resources(page_obj: pikepdf.Dictionary, backup: tuple):
+    """ Links the original (possibly shared or inherited) resource dictionaries again and adds removed entries """
+    resources, resource_dicts = backup
+    if resources is None:
+        if "/Resources" in page_obj:
+            del page_obj["/Resources"]
+        return
+    page_obj.Resources = resources
+    for key, (resource_dict, entries) in resource_dicts.items():
+        resources[key] = resource_dict
+        for name, value in entries.items():
+            if name not in resource_dict:
+                resource_dict[name] = value
+
+
+class TextRun(NamedTuple):
+    content: object  # Operand of the text showing operator (string or array)
+    location: Tuple[float, float]
+    font: str
+    font_size: float
+
+
+class PageContentStore:
+    """
+    Content stream instructions and drawn text runs of one page. Sections refer to ranges of them
+    instead of keeping their own lists, text runs are stored by columns.
+    """
+    __slots__ = ("instructions", "text_contents", "text_x", "text_y", "text_fonts", "text_font_sizes")
+
+    def __init__(self, instructions: List[pikepdf.ContentStreamInstruction]):
+        self.instructions = instructions
+        self.text_contents = []
+        self.text_x = array("d")
+        self.text_y = array("d")
+        self.text_fonts = []
+        self.text_font_sizes = array("d")
+
+    @property
+    def text_run_count(self) -> int:
+        return len(self.text_contents)
+
+    def add_text_run(self, content, location: List[float], font: str, font_size: float):
+        self.text_contents.append(content)
+        self.text_x.append(location[0])
+        self.text_y.append(location[1])
+        self.text_fonts.append(sys.intern(font))
+        self.text_font_sizes.append(font_size)
+
+    def get_text_run(self, index: int) -> TextRun:
+        return TextRun(self.text_contents[index], (self.text_x[index], self.text_y[index]),
+                       self.text_fonts[index], self.text_font_sizes[index])
+
 
 class Section:
+    __slots__ = ("typ", "location", "page_number", "keep_in_output", "section_group",
+                 "_store", "_start", "_end", "_additional", "_text_start", "_text_end")
+
     # Section information
     typ: "SectionType"
-    content: List[pikepdf.ContentStreamInstruction]
     location: List[float] or None
-    additional: dict or None
     page_number: int or None
 
     # Section output options
@@ -35,15 +236,77 @@ class Section:
 
     def __init__(self, typ: SectionType, content: List[pikepdf.ContentStreamInstruction], page_number: int = None,
                  location: List[float] = None, additional: dict = None, keep_in_output: bool = True):
+        """ Section with its own content, sections of parsed pages are created with `in_store` """
+        store = PageContentStore(list(content))
+        text_range = None
+        if additional and "text" in additional:
+            additional = dict(additional)
+            for run in additional.pop("text"):
+                store.add_text_run(run["content"], run["location"], run["font"], run["font_size"])
+            text_range = (0, store.text_run_count)
+        self._init(typ, store, 0, len(store.instructions), page_number, location, additional, text_range,
+                   keep_in_output)
+
+    @classmethod
+    def in_store(cls, typ: SectionType, store: PageContentStore, start: int, end: int, page_number: int = None,
+                 location: List[float] = None, additional: dict = None, text_range: Tuple[int, int] = None,
+                 keep_in_output: bool = True) -> "Section":
+        """
+        Section of instructions [start, end) and text runs [text_range[0], text_range[1]) of the page store,
+        `additional` does not include the text runs
+        """
+        section = cls.__new__(cls)
+        section._init(typ, store, start, end, page_number, location, additional, text_range, keep_in_output)
+        return section
+
+    def _init(self, typ: SectionType, store: PageContentStore, start: int, end: int, page_number: int or None,
+              location: List[float] or None, additional: dict or None, text_range: Tuple[int, int] or None,
+              keep_in_output: bool):
         self.typ = typ
-        self.content = content
+        self._store = store
+        self._start = start
+        self._end = end
         self.location = location
-        self.additional = additional
+        self._additional = additional
+        self._text_start, self._text_end = text_range if text_range else (None, None)
         self.page_number = page_number
 
         self.keep_in_output = keep_in_output
         self.section_group = None
 
+    @property
+    def content(self) -> List[pikepdf.ContentStreamInstruction]:
+        return self._store.instructions[self._start:self._end]
+
+    @property
+    def content_length(self) -> int:
+        return self._end - self._start
+
+    @property
+    def text_runs(self) -> List[TextRun]:
+        return list(self.iter_text_runs())
+
+    def iter_text_runs(self):
+        if self._text_start is not None:
+            for i in range(self._text_start, self._text_end):
+                yield self._store.get_text_run(i)
+
+    @property
+    def text_run_count(self) -> int:
+        return 0 if self._text_start is None else self._text_end - self._text_start
+
+    @property
+    def additional(self) -> dict or None:
+        """ For text sections {"font", "font_size", "text", "bbox"}, "text" is built from the page text runs """
+        if self._text_start is None:
+            return self._additional
+        additional = dict(self._additional) if self._additional else {}
+        additional["text"] = [run._asdict() for run in self.text_runs]
+        return additional
+
+    def get_additional(self, key: str, default=None):
+        """ Value from additional, without building the text runs """
+        return self._additional.get(key, default) if self._additional else default
 
     def get_bounding_box(self, page_height: float, cap_area: List[int] = None) -> Box or None:
         if self.typ == Section.SectionType.TEXT:
@@ -52,15 +315,15 @@ class Section:
                 return None
             loc = [self.location[0] - 5,
                     page_height - self.location[1],
-                    self.location[0] + self.additional["font_size"] * 1.2 + 5,
-                    page_height - self.location[1] - self.additional["font_size"] * 1.2 + 5]
+                    self.location[0] + self.get_additional("font_size") * 1.2 + 5,
+                    page_height - self.location[1] - self.get_additional("font_size") * 1.2 + 5]
             loc[0] = min(max(loc[0], 0), cap_area[2] - 30)  # x1
             loc[1] = min(max(loc[1], 0), cap_area[3] - 15)  # y1
             loc[2] = max(min(loc[2], cap_area[2]), 15)      # x2
             loc[3] = max(min(loc[3], cap_area[3]), 20)      # y2
             return Box(*loc,
-                       color="lightgreen" if self.keep_in_output else "red",
-                       on_click=lambda *args, **kwargs: None)
+                       color=self.get_mark_color(),
+                       on_click=lambda *args, **kwargs: None, section=self)
 
         elif self.typ == Section.SectionType.OBJECT:
             if self.location is None:
@@ -73,16 +336,52 @@ class Section:
             loc[2] = max(min(loc[2], cap_area[2]), 20)      # x2
             loc[3] = max(min(loc[3], cap_area[3]), 30)      # y2
             return Box(*loc,
-                       color="lightgreen" if self.keep_in_output else "red",
-                       on_click=lambda *args, **kwargs: None)
+                       color=self.get_mark_color(),
+                       on_click=lambda *args, **kwargs: None, section=self)
 
 
+    def get_mark_color(self) -> str:
+        return "lightgreen" if self.keep_in_output else "red"
+
     def get_content_as_string(self):
         return "".join([str(x) for x in self.content])
 
+    def is_outside_area(self, area: List[float]) -> bool:
+        """ True if the section surely does not draw anything inside area [x_min, y_min, x_max, y_max] """
+        if self.typ == Section.SectionType.OTHER or self.get_additional("bbox") is None:
+            return False
+        x0, y0, x1, y1 = self.get_additional("bbox")
+        return x1 < area[0] or x0 > area[2] or y1 < area[1] or y0 > area[3]
+
+    def get_text(self) -> str:
+        """ Text drawn by the section, runs joined without positioning """
+        parts = []
+        for run in self.iter_text_runs():
+            if isinstance(run.content, pikepdf.Array):
+                parts.extend(str(x) for x in run.content if not isinstance(x, (int, float, Decimal)))
+            else:
+                parts.append(str(run.content))
+        return "".join(parts)
+
+    def get_state_content(self) -> List[pikepdf.ContentStreamInstruction]:
+        """ Only the content that changes graphics state, to replace the section when it is not drawn """
+        instructions = []
+        for instruction in self.content:
+            if instruction.operator in STATE_OPERATORS:
+                instructions.append(instruction)
+            elif instruction.operator == pikepdf.Operator('"'):  # Also sets word and character spacing
+                ops = instruction.operands
+                instructions.append(pikepdf.ContentStreamInstruction([ops[0]], pikepdf.Operator("Tw")))
+                instructions.append(pikepdf.ContentStreamInstruction([ops[1]], pikepdf.Operator("Tc")))
+            elif instruction.operator == pikepdf.Operator("TD"):  # Also sets leading
+                instructions.append(pikepdf.ContentStreamInstruction([-instruction.operands[1]],
+                                                                     pikepdf.Operator("TL")))
+        return instructions
+
     def __repr__(self):
-        return (f"Section(type={self.typ}, len={len(self.content)}, page={self.page_number}, "
-                f"keep_in_output={self.keep_in_output}, location={self.location}, additional={self.additional})")
+        return (f"Section(type={self.typ}, len={self.content_length}, page={self.page_number}, "
+                f"keep_in_output={self.keep_in_output}, location={self.location}, additional={self._additional}, "
+                f"text_runs={self.text_run_count})")
 
 
 class SectionGroup:
@@ -93,14 +392,29 @@ class SectionGroup:
 
 
 class PdfPage:
-    def __init__(self, page: pikepdf.Page, page_number: int = -1):
+    def __init__(self, page: pikepdf.Page, page_number: int = -1, fitz_document: fitz.Document = None,
+                 raster_cache: ThumbnailCache = None, stats: PipelineStats = None):
+        """
+        :param fitz_document: The same document opened in fitz, original page is rendered from it if given
+        :param raster_cache: Rendered original page images are kept in it (shared by all pages of the file),
+            otherwise the page is rendered on every request
+        :param stats: Parsing and rendering of the page are recorded to it
+        """
         self._page = page
-        self._parsed_stream = pikepdf.parse_content_stream(self._page)
+        self._page_number = page_number
+        self._fitz_document = fitz_document
+        self._raster_cache = raster_cache
+        self._stats = stats
+        self._content_hash = None
+        self._original_rendered_size = None
 
-        self._original_content = pikepdf.unparse_content_stream(self._parsed_stream)
-        self._original_rendered = self.render_page_as_image(self._page)
+        # Original content streams, edited pages get new ones so these stay unchanged
+        self._original_contents = self._page.obj.get("/Contents")
 
-        self.sections = self._parse_sections(pikepdf.parse_content_stream(self._page), page_number, self._page.resources)
+        with stage(stats, "parse_content", page=page_number):
+            instructions = pikepdf.parse_content_stream(self._page)
+        with stage(stats, "parse_sections", page=page_number):
+            self.sections = self._parse_sections(instructions, page_number, _get_page_resources(self._page.obj))
 
         self.original_crop_area: List[float] = [float(self._page.mediabox[0]), float(self._page.mediabox[1]),
                                                 float(self._page.mediabox[2]), float(self._page.mediabox[3])]
@@ -118,98 +432,164 @@ class PdfPage:
     @staticmethod
     def _parse_sections(parsed_stream: List[pikepdf.ContentStreamInstruction], page_number: int = None, page_resources: pikepdf.Dictionary = None) -> List[Section]:
         sections = []
+        store = PageContentStore(parsed_stream if isinstance(parsed_stream, list) else list(parsed_stream))
 
         current_section_type = Section.SectionType.OTHER
-        current_section_content = []
+        current_section_start = 0  # Index of the first instruction of current section
 
         transform_matrixes = [np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float64)]
         def get_combined_transform_matrix():
-            return np.linalg.multi_dot(transform_matrixes) if len(transform_matrixes) >= 2 else transform_matrixes[0]
+            # Inner (later pushed) matrixes are applied first, points are row vectors
+            return np.linalg.multi_dot(transform_matrixes[::-1]) if len(transform_matrixes) >= 2 else transform_matrixes[0]
         current_text_matrix = np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float64)
         current_font = ("default_font", 11)  # Some random default value  (name, size)
         text_draw_relative_location = [0, 0]
         text_draw_location = None
-        text = []
-
-        for instruction in parsed_stream:
+        text_start = 0  # Index of the first text run of current text section
+
+        # Text state used only for estimating where the text is drawn, saved and restored by q/Q
+        text_states = [{"Tc": 0., "Tw": 0., "Tz": 100., "TL": 0., "Tr": 0, "Ts": 0., "type3": False}]
+        line_advance = 0.  # Estimated text space distance drawn since the start of current line
+        text_bbox = None  # Estimated user space bounding box of current text section, None if not known yet
+        text_bbox_unbounded = False  # Text section draws something we can not estimate the size of
+
+        def get_text_run_matrix():
+            return (np.array([[1, 0, 0], [0, 1, 0],
+                              [text_draw_relative_location[0],
+                               text_draw_relative_location[1],
+                               1.]], dtype=np.float64)
+                    @ current_text_matrix @ get_combined_transform_matrix())
+
+        def add_text_run(content):
+            """ Record drawn text and grow the text section bounding box by its estimated size """
+            nonlocal text_draw_location, line_advance, text_bbox, text_bbox_unbounded
+            loc = get_text_run_matrix()
+            if text_draw_location is None:
+                text_draw_location = [loc[2][0], loc[2][1]]
+
+            # Append text to section text
+            store.add_text_run(content, [loc[2][0], loc[2][1]], current_font[0], current_font[1])
+
+            text_state = text_states[-1]
+            if text_state["type3"] or text_state["Tr"] >= 4:
+                text_bbox_unbounded = True  # Arbitrary glyph sizes or text used as a clipping path
+                return
+            glyphs, spaces, adjustment = _estimate_text_length(content)
+            if glyphs is None:
+                text_bbox_unbounded = True
+                return
+
+            # No font metrics here, so glyphs are expected to be at most 1 em wide and tall
+            font_size = abs(current_font[1])
+            width = (glyphs * (font_size + abs(text_state["Tc"])) + spaces * abs(text_state["Tw"])
+                     + adjustment / 1000 * font_size) * text_state["Tz"] / 100
+            x0, x1 = line_advance - font_size, line_advance + width + font_size
+            y0, y1 = text_state["Ts"] - font_size, text_state["Ts"] + 2 * font_size
+            corners = np.array([[x0, y0, 1], [x0, y1, 1], [x1, y0, 1], [x1, y1, 1]], dtype=np.float64) @ loc
+            run_bbox = [corners[:, 0].min(), corners[:, 1].min(), corners[:, 0].max(), corners[:, 1].max()]
+            text_bbox = run_bbox if text_bbox is None else [min(text_bbox[0], run_bbox[0]), min(text_bbox[1], run_bbox[1]),
+                                                            max(text_bbox[2], run_bbox[2]), max(text_bbox[3], run_bbox[3])]
+            line_advance += width
+
+        def move_to_next_line(tx: float, ty: float):
+            nonlocal line_advance
+            text_draw_relative_location[0] += tx
+            text_draw_relative_location[1] += ty
+            line_advance = 0.
+
+        def get_text_section(end: int):
+            return Section.in_store(Section.SectionType.TEXT, store, current_section_start, end, page_number,
+                                    text_draw_location,
+                                    {"font": current_font[0], "font_size": current_font[1],
+                                     "bbox": None if text_bbox_unbounded else text_bbox},
+                                    (text_start, store.text_run_count))
+
+        for index, instruction in enumerate(store.instructions):
             if instruction.operator == pikepdf.Operator("BT"):  # Begin text section
-                if current_section_content:
-                    sections.append(Section(current_section_type, current_section_content, page_number))
+                if index > current_section_start:
+                    sections.append(Section.in_store(current_section_type, store, current_section_start, index,
+                                                     page_number))
 
                 if current_section_type == Section.SectionType.TEXT:
                     logger.warning("WARNING: text_section already started!")
 
-                current_section_content = [instruction]
+                current_section_start = index
                 current_section_type = Section.SectionType.TEXT
                 current_text_matrix = np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float64)
                 text_draw_relative_location = [0, 0]
                 text_draw_location = None
-                text = []
+                text_start = store.text_run_count
+                line_advance = 0.
+                text_bbox = None
+                text_bbox_unbounded = False
 
             elif instruction.operator == pikepdf.Operator("ET"):  # End text section
-                current_section_content.append(instruction)
-
                 if current_section_type != Section.SectionType.TEXT:
                     logger.warning("WARNING: text_section not started, but now ending!")
 
                 if text_draw_location:
-                    sections.append(Section(Section.SectionType.TEXT, current_section_content, page_number,
-                                            text_draw_location,
-                                            {"font": current_font[0], "font_size": current_font[1], "text": text}))
+                    sections.append(get_text_section(index + 1))
                 text_draw_location = None
-                current_section_content = []
+                current_section_start = index + 1
                 current_section_type = Section.SectionType.OTHER
 
             elif instruction.operator == pikepdf.Operator("Tf"):  # Set font and font size
-                current_section_content.append(instruction)
                 current_font = (str(instruction.operands[0]), float(instruction.operands[1]))
+                text_states[-1]["type3"] = _is_type3_font(page_resources, instruction.operands[0])
 
             elif instruction.operator == pikepdf.Operator("Td"):  # Move text draw position
-                current_section_content.append(instruction)
                 ops = instruction.operands
-                text_draw_relative_location[0] += float(ops[0])
-                text_draw_relative_location[1] += float(ops[1])
+                move_to_next_line(float(ops[0]), float(ops[1]))
+
+            elif instruction.operator == pikepdf.Operator("TD"):  # Move text draw position and set leading
+                ops = instruction.operands
+                text_states[-1]["TL"] = -float(ops[1])
+                move_to_next_line(float(ops[0]), float(ops[1]))
+
+            elif instruction.operator == pikepdf.Operator("T*"):  # Move to next text line
+                move_to_next_line(0, -text_states[-1]["TL"])
 
             elif (instruction.operator == pikepdf.Operator("Tj")
                   or instruction.operator == pikepdf.Operator("TJ")):  # Draw text
                 # For now, we just save the text start position and draw the box there
-                current_section_content.append(instruction)
-                loc = (get_combined_transform_matrix() @ current_text_matrix
-                       @ np.array([[1, 0, 0], [0, 1, 0],
-                                   [text_draw_relative_location[0],
-                                    text_draw_relative_location[1],
-                                    1.]], dtype=np.float64))
-                if text_draw_location is None:
-                    text_draw_location = [loc[2][0], loc[2][1]]
-
-                # Append text to section text
-                text.append({"content": instruction.operands[0], "location": [loc[2][0], loc[2][1]],
-                             "font": current_font[0], "font_size": current_font[1]})
+                add_text_run(instruction.operands[0])
+
+            elif instruction.operator == pikepdf.Operator("'"):  # Move to next text line and draw text
+                move_to_next_line(0, -text_states[-1]["TL"])
+                add_text_run(instruction.operands[0])
+
+            elif instruction.operator == pikepdf.Operator('"'):  # Set spacing, move to next line and draw text
+                ops = instruction.operands
+                text_states[-1]["Tw"], text_states[-1]["Tc"] = float(ops[0]), float(ops[1])
+                move_to_next_line(0, -text_states[-1]["TL"])
+                add_text_run(ops[2])
+
+            elif instruction.operator in TEXT_STATE_OPERATORS:  # Text state parameters (Tc, Tw, Tz, TL, Tr, Ts)
+                text_states[-1][str(instruction.operator)] = float(instruction.operands[0])
 
             elif instruction.operator == pikepdf.Operator("Tm"):
-                current_section_content.append(instruction)
                 ops = instruction.operands
                 current_text_matrix = np.array([[float(ops[0]), float(ops[1]), .0],
                                                 [float(ops[2]), float(ops[3]), .0],
                                                 [float(ops[4]), float(ops[5]), 1.]], dtype=np.float64)
+                move_to_next_line(-text_draw_relative_location[0], -text_draw_relative_location[1])
 
             elif instruction.operator == pikepdf.Operator("cm"):  # Transformation matrix command
-                current_section_content.append(instruction)
                 ops = instruction.operands
-                transform_matrixes[-1] = transform_matrixes[-1] \
-                                                @ np.array([[float(ops[0]), float(ops[1]), .0],
-                                                           [float(ops[2]), float(ops[3]), .0],
-                                                           [float(ops[4]), float(ops[5]), 1.]], dtype=np.float64)
+                transform_matrixes[-1] = np.array([[float(ops[0]), float(ops[1]), .0],
+                                                   [float(ops[2]), float(ops[3]), .0],
+                                                   [float(ops[4]), float(ops[5]), 1.]], dtype=np.float64) \
+                                         @ transform_matrixes[-1]
 
             elif instruction.operator == pikepdf.Operator("Do"):  # Draw image or other object
                 # End current section
                 if text_draw_location:
-                    sections.append(Section(Section.SectionType.TEXT, current_section_content, page_number,
-                                            text_draw_location,
-                                            {"font": current_font[0], "font_size": current_font[1], "text": text}))
+                    sections.append(get_text_section(index))
                     text_draw_location = None
+                    text_start = store.text_run_count
                 else:
-                    sections.append(Section(Section.SectionType.OTHER, current_section_content, page_number))
+                    sections.append(Section.in_store(Section.SectionType.OTHER, store, current_section_start, index,
+                                                     page_number))
 
                 # Insert object section
                 loc = np.eye(3, dtype=np.float64)
@@ -219,43 +599,56 @@ class PdfPage:
 
                 pdf_obj = page_resources.XObject[instruction.operands[0]]
                 pdf_obj_xref = pdf_obj.objgen[0]
-                sections.append(Section(Section.SectionType.OBJECT, [instruction], page_number,
-                                        [loc[2][0], loc[2][1]], additional={"xref": pdf_obj_xref}))
+                # Object space -> user space, [a, b, c, d, e, f] as in the `cm` operator
+                transform = [loc[0][0], loc[0][1], loc[1][0], loc[1][1], loc[2][0], loc[2][1]]
+                sections.append(Section.in_store(Section.SectionType.OBJECT, store, index, index + 1, page_number,
+                                                 [loc[2][0], loc[2][1]],
+                                                 additional={"xref": pdf_obj_xref, "transform": transform,
+                                                             "bbox": _get_xobject_bbox(pdf_obj, loc)}))
 
                 # Keep current_section_type and other variables and start continuation of section
-                current_section_content = []
+                current_section_start = index + 1
 
             elif instruction.operator == pikepdf.Operator("q"):  # Push transformation matrix
-                current_section_content.append(instruction)
                 transform_matrixes.append(np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float64))
+                text_states.append(dict(text_states[-1]))
 
             elif instruction.operator == pikepdf.Operator("Q"):  # Pop transformation matrix
-                current_section_content.append(instruction)
                 transform_matrixes.pop()
+                if len(text_states) > 1:
+                    text_states.pop()
 
             elif (instruction.operator == pikepdf.Operator("BDC")
                   or instruction.operator == pikepdf.Operator("BMC")):  # Marked section start
-                current_section_content.append(instruction)
                 transform_matrixes.append(np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float64))
 
             elif instruction.operator == pikepdf.Operator("EMC"):  # Marked section end
-                current_section_content.append(instruction)
                 transform_matrixes.pop()
 
-            else:
-                current_section_content.append(instruction)
-
-        if current_section_content:
-            sections.append(Section(current_section_type, current_section_content, page_number))
+        if len(store.instructions) > current_section_start:
+            sections.append(Section.in_store(current_section_type, store, current_section_start,
+                                             len(store.instructions), page_number))
 
         return sections
 
     @staticmethod
-    def _join_sections(sections: List[Section]):
+    def _join_sections(sections: List[Section], image_placements: Dict[int, List[float]] = None,
+                       visible_area: List[float] = None):
         instructions = []
         for s in sections:
             if s.keep_in_output:
-                instructions.extend(s.content)
+                if visible_area and s.is_outside_area(visible_area):
+                    instructions.extend(s.get_state_content())
+                elif image_placements and s.typ == Section.SectionType.OBJECT \
+                        and s.get_additional("xref") in image_placements:
+                    # Image was trimmed, place it only on its remaining part of the original image space
+                    instructions.append(pikepdf.ContentStreamInstruction([], pikepdf.Operator("q")))
+                    instructions.append(pikepdf.ContentStreamInstruction(image_placements[s.get_additional("xref")],
+                                                                         pikepdf.Operator("cm")))
+                    instructions.extend(s.content)
+                    instructions.append(pikepdf.ContentStreamInstruction([], pikepdf.Operator("Q")))
+                else:
+                    instructions.extend(s.content)
         return instructions
 
     def get_original_pike_page(self) -> pikepdf.Page:
@@ -263,17 +656,30 @@ class PdfPage:
             del self._page["/Contents"]
 
         self._page.mediabox = self.original_crop_area
-        self._page.contents_add(self._original_content)
+        if self._original_contents is not None:
+            self._page.obj.Contents = self._original_contents
         return self._page
 
-    def get_edited_pike_page(self) -> pikepdf.Page:
+    def get_edited_pike_page(self, image_placements: Dict[int, List[float]] = None,
+                             prune_invisible: bool = False) -> pikepdf.Page:
+        """
+        :param image_placements: Placement matrixes of trimmed images by xref
+        :param prune_invisible: Leave out text and objects that are completely outside of the visible area
+        """
         if "/Contents" in self._page.keys():
             del self._page["/Contents"]
 
         self._page.mediabox = self.crop_area if self.crop_area else self.original_crop_area
-        self._page.contents_add(pikepdf.unparse_content_stream(self._join_sections(self.sections)))
+        instructions = self._join_sections(self.sections, image_placements,
+                                           self.get_visible_area() if prune_invisible else None)
+        self._page.contents_add(pikepdf.unparse_content_stream(instructions))
         return self._page
 
+    def get_visible_area(self) -> List[float]:
+        """ Visible area of the page in user space as [x_min, y_min, x_max, y_max] """
+        area = self.crop_area if self.crop_area else self.original_crop_area
+        return [min(area[0], area[2]), min(area[1], area[3]), max(area[0], area[2]), max(area[1], area[3])]
+
     def get_boxes(self) -> List[Box]:
         boxes = []
         for section in self.sections:
@@ -285,32 +691,178 @@ class PdfPage:
         return boxes
 
     @staticmethod
-    def render_page_as_image(page: pikepdf.Page) -> Image:
-        pdf_stream = io.BytesIO()
-        pdf = pikepdf.Pdf.new()
-        pdf.pages.append(page)
-        pdf.save(pdf_stream)
-
-        ftz = fitz.open(stream=pdf_stream)
-        page = ftz.load_page(0)
-        ix = page.get_pixmap()
-        imgdata = ix.tobytes("ppm")
-
-        img = Image.open(io.BytesIO(imgdata))
-        return img
+    def _pixmap_to_image(pixmap: fitz.Pixmap) -> Image:
+        # Wraps pixmap samples directly, without encoding to an image format and decoding it again
+        return Image.frombuffer("RGB", (pixmap.width, pixmap.height), pixmap.samples, "raw", "RGB", pixmap.stride, 1)
 
-    def get_original_rendered_image(self) -> Image:
-        return self._original_rendered
+    @staticmethod
+    def render_page_as_image(page: pikepdf.Page, scale: float = 1.) -> Image:
+        with FITZ_LOCK:
+            pdf_stream = io.BytesIO()
+            pdf = pikepdf.Pdf.new()
+            pdf.pages.append(page)
+            pdf.save(pdf_stream)
+
+            ftz = fitz.open(stream=pdf_stream)
+            page = ftz.load_page(0)
+            return PdfPage._pixmap_to_image(page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False))
+
+    def _render_original(self, scale: float) -> Image:
+        with stage(self._stats, "render", page=self._page_number, scale=scale):
+            if self._fitz_document is not None:
+                with FITZ_LOCK:
+                    fitz_page = self._fitz_document.load_page(self._page_number)
+                    return self._pixmap_to_image(fitz_page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False))
+            return self.render_page_as_image(self._page, scale)
+
+    def get_display_list(self) -> fitz.DisplayList:
+        """
+        Drawing commands of the original page recorded by MuPDF,
+        rendering from them skips interpreting the page content again (see render_display_list_area)
+        """
+        with FITZ_LOCK:
+            if self._fitz_document is not None:
+                fitz_page = self._fitz_document.load_page(self._page_number)
+            else:
+                pdf_stream = io.BytesIO()
+                pdf = pikepdf.Pdf.new()
+                pdf.pages.append(self._page)
+                pdf.save(pdf_stream)
+                fitz_page = fitz.open(stream=pdf_stream).load_page(0)
+            return fitz_page.get_displaylist()
+
+    @staticmethod
+    def render_display_list_area(display_list: fitz.DisplayList, scale: float,
+                                 area: Tuple[float, float, float, float]) -> Image:
+        """ Renders area (x0, y0, x1, y1 in unscaled fitz page coordinates, top-left origin) with `scale` """
+        with FITZ_LOCK:
+            pixmap = display_list.get_pixmap(matrix=fitz.Matrix(scale, scale), clip=fitz.Rect(*area), alpha=False)
+            return PdfPage._pixmap_to_image(pixmap)
+
+    def get_content_hash(self) -> str:
+        """ Hash of everything the rendering of the original page depends on, the same in each run """
+        if self._content_hash is None:
+            hasher = hashlib.blake2b(digest_size=16)
+            with FITZ_LOCK:  # Also called from render threads
+                seen = set()
+                # Only what the rendering depends on, Contents and MediaBox are changed when the page is edited,
+                # so their original values are used
+                if self._original_contents is not None:
+                    _hash_pdf_object(hasher, self._original_contents, seen)
+                resources = _get_page_resources(self._page.obj)  # Page.resources would add an empty one
+                if resources is not None:
+                    hasher.update(b"resources")
+                    _hash_pdf_object(hasher, resources, seen)
+                hasher.update(repr(self.original_crop_area).encode())
+                for key in ("/CropBox", "/Rotate", "/UserUnit", "/Group"):
+                    value = _get_inherited_page_attribute(self._page.obj, key)
+                    if value is not None:
+                        hasher.update(key.encode())
+                        _hash_pdf_object(hasher, value, seen)
+            self._content_hash = hasher.hexdigest()
+        return self._content_hash
+
+    def get_original_rendered_image(self, scale: float = 1.) -> Image:
+        """ Original page rendered with `scale` pixels per PDF point, from the raster cache if it is still there """
+        if self._raster_cache is None:
+            return self._render_original(scale)
+
+        key = ("original", self._page_number, scale)
+        img = self._raster_cache.get(key)
+        if img is None:
+            img = self._render_original(scale)
+            self._raster_cache.put(key, img)
+        return img
 
-    def get_edited_rendered_image(self):
-        return self.render_page_as_image(self.get_edited_pike_page())
+    def get_original_rendered_size(self) -> Tuple[int, int]:
+        """ Size of get_original_rendered_image() with scale 1, without rendering the page if possible """
+        if self._original_rendered_size is None:
+            if self._fitz_document is not None:
+                with FITZ_LOCK:
+                    rect = self._fitz_document.load_page(self._page_number).rect.round()
+                self._original_rendered_size = (rect.width, rect.height)
+            else:
+                self._original_rendered_size = self.get_original_rendered_image().size
+        return self._original_rendered_size
+
+    def is_original_rendered_size_known(self) -> bool:
+        """ Whether get_original_rendered_size() returns without loading the page """
+        return self._original_rendered_size is not None
+
+    def get_edit_state(self) -> tuple:
+        """ Hashable state of the edits of the page, equal states give the same edited page """
+        return tuple(section.keep_in_output for section in self.sections), \
+            tuple(self.crop_area) if self.crop_area else None
+
+    def get_edited_rendered_image(self, scale: float = 1.) -> Image:
+        """ Page as it would be saved (cropped), rendered from a copy so that the original page stays the same """
+        with stage(self._stats, "render_edited", page=self._page_number, scale=scale), FITZ_LOCK:
+            instructions = self._join_sections(self.sections)
+            pdf = pikepdf.Pdf.new()
+            pdf.pages.append(self._page)
+            page = pdf.pages[0]
+            if "/Contents" in page.keys():
+                del page["/Contents"]
+            page.mediabox = self.crop_area if self.crop_area else self.original_crop_area
+            page.contents_add(pdf.make_stream(pikepdf.unparse_content_stream(instructions)))
+            return self.render_page_as_image(page, scale)
+
+
+class PdfPages(Sequence):
+    """ Pages of a PdfFile, each page is parsed on its first access (from any thread) """
+
+    def __init__(self, pdf_file: "PdfFile"):
+        self._pdf_file = pdf_file
+        self._pages: List[PdfPage or None] = [None] * pdf_file.page_count
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def __getitem__(self, index: int or slice) -> PdfPage or List[PdfPage]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        page = self._pages[index]
+        if page is None:
+            page_number = range(len(self._pages))[index]
+            with FITZ_LOCK:  # pikepdf and fitz are also used by the background loader and render threads
+                page = self._pages[page_number]
+                if page is None:
+                    page = PdfPage(self._pdf_file.pdf.pages[page_number], page_number,
+                                   self._pdf_file._fitz_document, self._pdf_file.raster_cache, self._pdf_file.stats)
+                    self._pages[page_number] = page
+        return page
+
+    def is_parsed(self, page_number: int) -> bool:
+        return self._pages[page_number] is not None
 
 
 class PdfFile:
-    def __init__(self, pdf: pikepdf.Pdf, path: str = None, progressbar: bool = False):
+    def __init__(self, pdf: pikepdf.Pdf, path: str = None, progressbar: bool = False, password: str = None,
+                 disk_thumbnail_cache: DiskThumbnailCache = None, raster_cache_size: int = DEFAULT_RASTER_CACHE_SIZE,
+                 load_in_background: bool = False, input_buffer: memoryview or bytes = None,
+                 stats: PipelineStats = None):
+        """
+        :param input_buffer: Data the pdf was opened from (file mapping or in-memory PDF), fitz renders from it
+            instead of reading the file again
+        :param stats: Timings and counters of the stages are recorded to it (PdfFile.stats), if not given they are
+            written as JSON lines to the file in the PDF2READER_STATS environment variable (if set)
+        :param raster_cache_size: Memory in bytes for rendered original pages, least recently used are rendered
+            again when needed
+        :param load_in_background: Return right away and parse and match pages in a background thread from the
+            first page on. Pages are still parsed on demand when accessed earlier (pages_parsed, get_page), section
+            groups grow while the loading goes on (see is_loaded and wait_until_loaded).
+        """
         self.path = path
         self.pdf = pdf
-
+        self.stats = stats if stats is not None else PipelineStats.from_env()
+        self._input_buffer = input_buffer
+        self._input_file = None  # Set by open()
+        with self.stats.stage("open_fitz"):
+            self._fitz_document = self._open_fitz_document(password)
+
+        self.thumbnail_cache = ThumbnailCache(disk_cache=disk_thumbnail_cache)
+        self.raster_cache = ThumbnailCache(max_bytes=raster_cache_size)
         self.temp_dir = TemporaryDirectory()
 
         # Matching params
@@ -320,70 +872,138 @@ class PdfFile:
         self.max_relative_font_size_diff = 0.1
         self.max_absolute_location_diff = 20
 
+        # Images are trimmed to their visible part only if it is at most this fraction of pixels
+        self.max_trimmed_image_size_ratio = 0.9
+
+
+        self.pages_parsed = PdfPages(self)
+        self.sections_groups = []
+        self._matched_page_count = 0
+        self._compared_sections_count = 0  # Matching counters, added to stats after each page
+        self._sequence_matcher_calls = 0
+        self._images = None
+
+        self._loader_thread = None
+        if load_in_background:
+            self._loader_thread = threading.Thread(target=self._load_pages, daemon=True)
+            self._loader_thread.start()
+            return
 
         if progressbar:
             from .gui.progress_bar_window import ProgressBarWindow
-            self.progress_bar_window = ProgressBarWindow("Loading PDF", f"Loading PDF...", 0, len(self.pdf.pages))
-
-        self.pages_parsed = []
-        for page_number, page in enumerate(self.pdf.pages):
-            self.pages_parsed.append(PdfPage(page, page_number))
-            if progressbar:
-                self.progress_bar_window.update_progress(len(self.pages_parsed))
-                self.progress_bar_window.update_message(
-                    f"Loading PDF... page {len(self.pages_parsed)}/{len(self.pdf.pages)}")
-
-        # if progressbar:
-        #     self.progress_bar_window.update_message("Matching similar sections...")
-        #     self.progress_bar_window.update_mode_infinite(True)
-        self.sections_groups = []
-        self._match_page_sections(progressbar=progressbar)
+            self.progress_bar_window = ProgressBarWindow("Loading PDF", f"Loading PDF...", 0, self.page_count)
+
+        self._load_pages(progressbar=progressbar)
 
         # Extract images for further optimization
         if progressbar:
             self.progress_bar_window.update_message("Preparing images...")
             self.progress_bar_window.update_mode_infinite(True)
-        self.images = extract_pdf_images(self.pdf, self.temp_dir.name)
+        _ = self.images
 
         if progressbar:
             self.progress_bar_window.close()
 
-    def _match_page_sections(self, progressbar: bool = False):
-        if progressbar:
-            self.progress_bar_window.update_message("Matching similar sections...")
-            self.progress_bar_window.update_progress(0)
-        for page_index in range(len(self.pages_parsed)):
-            if progressbar:
-                self.progress_bar_window.update_progress(page_index + 1)
-                self.progress_bar_window.update_message(
-                    f"Matching similar sections... page {page_index + 1}/{len(self.pages_parsed)}")
-            page = self.pages_parsed[page_index]
-            for section in page.sections:
-                # Match only text and object sections
-                if section.typ == Section.SectionType.OTHER:
-                    continue
-
-                # Create new sections group if this section is not part of any group
-                if section.section_group is None:
-                    group = SectionGroup(section)
-                    group.last_matched_page_number = page_index
-                    self.sections_groups.append(group)
-                    section.section_group = group
-
-                # Do the matching
-                for next_page_index in range(max(page_index + 1, section.section_group.last_matched_page_number + 1),
-                                             min(page_index + self.match_ahead_pages + 1, self.page_count)):
-                    section.section_group.last_matched_page_number = max(section.section_group.last_matched_page_number,
-                                                                         next_page_index)
-                    next_page = self.pages_parsed[next_page_index]
-                    similarities = self._get_section_to_sections_similarities(section.section_group.master_section,
-                                                                                 next_page.sections)
-                    if similarities:
-                        most_similar = np.argmax(similarities)
-                        if similarities[most_similar] > self.match_threshold:
-                            next_page_section = next_page.sections[most_similar]
-                            section.section_group.sections.append(next_page_section)
-                            next_page_section.section_group = section.section_group
+    @property
+    def images(self) -> Tuple[List[int], List[int], List[int]]:
+        """ Images of the PDF extracted for optimization, on the first access """
+        if self._images is None:
+            with FITZ_LOCK:
+                if self._images is None:
+                    with self.stats.stage("extract_images"), profile_stage("extract_images"):
+                        self._images = extract_pdf_images(self.pdf, self.temp_dir.name)
+                    for name, xrefs in zip(("jpeg", "png", "other"), self._images):
+                        self.stats.count(f"images_{name}", len(xrefs))
+        return self._images
+
+    def _load_pages(self, progressbar: bool = False):
+        """ Parses pages from the front and matches their sections as soon as the pages they are matched to are parsed """
+        try:
+            with self.stats.stage("load_pages", pages=self.page_count):
+                for page_number in range(self.page_count):
+                    with profile_stage("parse"):
+                        _ = self.pages_parsed[page_number]
+                    with profile_stage("match"):
+                        self._match_parsed_pages(page_number + 1)
+                    if progressbar:
+                        self.progress_bar_window.update_progress(page_number + 1)
+                        self.progress_bar_window.update_message(
+                            f"Loading PDF... page {page_number + 1}/{self.page_count}")
+                with profile_stage("match"):
+                    self._match_parsed_pages(self.page_count)
+        except Exception:
+            if self._loader_thread is None:
+                raise
+            logger.exception("Failed to load PDF pages in background")
+
+    def is_loaded(self) -> bool:
+        """ Whether all pages are parsed and matched """
+        return self._matched_page_count == self.page_count
+
+    def wait_until_loaded(self):
+        if self._loader_thread is not None:
+            self._loader_thread.join()
+
+    def _open_fitz_document(self, password: str = None) -> fitz.Document:
+        """ The same document in fitz for rendering pages """
+        with FITZ_LOCK:
+            if self._input_buffer is not None:
+                # fitz keeps a reference to the buffer and reads from it, without a copy
+                document = fitz.open(stream=self._input_buffer, filetype="pdf")
+            elif self.path:
+                document = fitz.open(self.path)
+            else:
+                pdf_stream = io.BytesIO()
+                self.pdf.save(pdf_stream)
+                document = fitz.open(stream=pdf_stream.getbuffer(), filetype="pdf")
+            if document.needs_pass:
+                document.authenticate(password or "")
+            return document
+
+    def _match_parsed_pages(self, parsed_page_count: int):
+        """ Matches the pages whose following match_ahead_pages pages are among the first `parsed_page_count` """
+        while (self._matched_page_count < self.page_count
+               and (self._matched_page_count + self.match_ahead_pages < parsed_page_count
+                    or parsed_page_count == self.page_count)):
+            self._match_page_sections(self._matched_page_count)
+            self._matched_page_count += 1
+
+    def _match_page_sections(self, page_index: int):
+        page = self.pages_parsed[page_index]
+        with self.stats.stage("match", page=page_index):
+            self._match_sections(page, page_index)
+        self.stats.count("matched_pages")
+        self.stats.count("compared_sections", self._compared_sections_count)
+        self.stats.count("sequence_matcher_calls", self._sequence_matcher_calls)
+        self._compared_sections_count = self._sequence_matcher_calls = 0
+
+    def _match_sections(self, page: PdfPage, page_index: int):
+        for section in page.sections:
+            # Match only text and object sections
+            if section.typ == Section.SectionType.OTHER:
+                continue
+
+            # Create new sections group if this section is not part of any group
+            if section.section_group is None:
+                group = SectionGroup(section)
+                group.last_matched_page_number = page_index
+                self.sections_groups.append(group)
+                section.section_group = group
+
+            # Do the matching
+            for next_page_index in range(max(page_index + 1, section.section_group.last_matched_page_number + 1),
+                                         min(page_index + self.match_ahead_pages + 1, self.page_count)):
+                section.section_group.last_matched_page_number = max(section.section_group.last_matched_page_number,
+                                                                     next_page_index)
+                next_page = self.pages_parsed[next_page_index]
+                similarities = self._get_section_to_sections_similarities(section.section_group.master_section,
+                                                                             next_page.sections)
+                if similarities:
+                    most_similar = np.argmax(similarities)
+                    if similarities[most_similar] > self.match_threshold:
+                        next_page_section = next_page.sections[most_similar]
+                        section.section_group.sections.append(next_page_section)
+                        next_page_section.section_group = section.section_group
 
     def _filter_sections_groups(self):
         logger.debug(
@@ -406,42 +1026,43 @@ class PdfFile:
                     (location_x_diff + location_y_diff) / (2 * self.max_absolute_location_diff))
 
         if section1.typ == Section.SectionType.TEXT == section2.typ:
-            # section.additional["text"] = {"content", "location", "font", "font_size"}[]
-            if len(section1.additional["text"]) != len(section2.additional["text"]):
+            if section1.text_run_count != section2.text_run_count:
                 return 0
 
             texts_similarities = [1]
-            for txt1, txt2 in zip(section1.additional["text"], section2.additional["text"]):
+            for txt1, txt2 in zip(section1.iter_text_runs(), section2.iter_text_runs()):
                 # Non matching fonts -> non matching section
-                if txt1["font"] != txt2["font"]:
+                if txt1.font != txt2.font:
                     return 0
 
                 # Non matching location -> non matching section
-                location_x_diff = abs(txt1["location"][0] - txt2["location"][0])
-                location_y_diff = abs(txt1["location"][1] - txt2["location"][1])
+                location_x_diff = abs(txt1.location[0] - txt2.location[0])
+                location_y_diff = abs(txt1.location[1] - txt2.location[1])
                 if (location_x_diff > self.max_absolute_location_diff
                         or location_y_diff > self.max_absolute_location_diff):
                     return 0
                 location_diff_similarity_modifier = 1 - ((location_x_diff + location_y_diff) / (2 * self.max_absolute_location_diff))
 
                 # Non matching font sizes -> non matching section
-                font_size_norm_diff = (abs(txt1["font_size"] - txt2["font_size"]) / max(txt1["font_size"], txt2["font_size"]))
+                font_size_norm_diff = (abs(txt1.font_size - txt2.font_size) / max(txt1.font_size, txt2.font_size))
                 if font_size_norm_diff > self.max_relative_font_size_diff:
                     return 0
                 font_size_diff_similarity_modifier = 1 - font_size_norm_diff
 
                 # Non matching content types -> non matching section
-                if type(txt1["content"]) is not type(txt2["content"]):
+                if type(txt1.content) is not type(txt2.content):
                     return 0
 
                 # Non matching content -> non matching section
-                cnt1, cnt2 = txt1["content"], txt2["content"]
+                cnt1, cnt2 = txt1.content, txt2.content
                 similar = 0
                 if isinstance(cnt1, str) and isinstance(cnt2, str):
+                    self._sequence_matcher_calls += 1
                     similar = SequenceMatcher(None, cnt1, cnt2).quick_ratio()
                 elif isinstance(cnt1, pikepdf.Array) and isinstance(cnt2, pikepdf.Array):
                     array1 = [str(x) for x in cnt1 if not isinstance(x, int) and not isinstance(x, float)]
                     array2 = [str(x) for x in cnt2 if not isinstance(x, int) and not isinstance(x, float)]
+                    self._sequence_matcher_calls += 1
                     similar = SequenceMatcher(None, "".join(array1), "".join(array2)).quick_ratio()
                 else:
                     logger.warning(f"WARNING: Unknown text content type: '{type(cnt1)}' or '{type(cnt2)}'")
@@ -454,11 +1075,11 @@ class PdfFile:
 
         if section1.typ == Section.SectionType.OBJECT == section2.typ:
             # Can not compare local object easily
-            if not section1.additional["xref"] or not section2.additional["xref"]:
+            if not section1.get_additional("xref") or not section2.get_additional("xref"):
                 return 0
 
             # Check if it is the same object by xref
-            if section1.additional["xref"] != section2.additional["xref"]:
+            if section1.get_additional("xref") != section2.get_additional("xref"):
                 return 0
 
             return global_location_diff_similarity_modifier
@@ -471,6 +1092,7 @@ class PdfFile:
             if section2.section_group is not None:
                 similarities.append(-1)
             else:
+                self._compared_sections_count += 1
                 similarities.append(self._get_section_similarity(section1, section2))
         return similarities
 
@@ -478,9 +1100,11 @@ class PdfFile:
         self.temp_dir.cleanup()
 
     @staticmethod
-    def open(path: str, progressbar: bool = False, password: str = None, ask_password: bool = False) -> "PdfFile":
+    def _open_pike_pdf(open_fn: Callable[[str], pikepdf.Pdf], password: str = None,
+                       ask_password: bool = False) -> Tuple[pikepdf.Pdf, str]:
+        """ Opens the pdf with `open_fn(password)`, asking for the password if needed. Returns the pdf and password. """
         try:
-            pdf = pikepdf.open(path, password=password or "")
+            return open_fn(password or ""), password
         except pikepdf.PasswordError as e:
             if ask_password:
                 import tkinter as tk
@@ -491,13 +1115,47 @@ class PdfFile:
                 r.destroy()
                 if passwd == password:
                     raise e
-                pdf = pikepdf.open(path, password=passwd or "")  # Can also raise PasswordError
+                return open_fn(passwd or ""), passwd  # Can also raise PasswordError
             else:
                 raise e
 
-        pdf_file = PdfFile(pdf, path, progressbar=progressbar)
+    @staticmethod
+    def open(path: str, progressbar: bool = False, password: str = None, ask_password: bool = False,
+             disk_thumbnail_cache: DiskThumbnailCache = None, load_in_background: bool = False) -> "PdfFile":
+        """
+        The file is memory mapped once, pikepdf and fitz both read from the mapping,
+        so it is neither read into memory nor duplicated
+        """
+        input_file = open(path, "rb")
+        try:
+            input_buffer = memoryview(mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ))
+
+            def open_fn(passwd: str) -> pikepdf.Pdf:
+                input_file.seek(0)
+                return pikepdf.open(input_file, password=passwd, access_mode=pikepdf.AccessMode.mmap)
+
+            pdf, password = PdfFile._open_pike_pdf(open_fn, password, ask_password)
+        except BaseException:
+            input_file.close()
+            raise
+
+        pdf_file = PdfFile(pdf, path, progressbar=progressbar, password=password,
+                           disk_thumbnail_cache=disk_thumbnail_cache, load_in_background=load_in_background,
+                           input_buffer=input_buffer)
+        pdf_file._input_file = input_file  # pikepdf reads from it until the PdfFile is gone
         return pdf_file
 
+    @staticmethod
+    def open_buffer(data: bytes, progressbar: bool = False, password: str = None, ask_password: bool = False,
+                    disk_thumbnail_cache: DiskThumbnailCache = None, load_in_background: bool = False) -> "PdfFile":
+        """ Opens a PDF from memory, e.g. received by a service. `data` is used directly, it must not change. """
+        data = data if isinstance(data, bytes) else bytes(data)  # BytesIO would copy other buffers anyway
+
+        pdf, password = PdfFile._open_pike_pdf(lambda passwd: pikepdf.open(io.BytesIO(data), password=passwd),
+                                               password, ask_password)
+        return PdfFile(pdf, progressbar=progressbar, password=password, disk_thumbnail_cache=disk_thumbnail_cache,
+                       load_in_background=load_in_background, input_buffer=data)
+
     @property
     def page_count(self) -> int:
         return len(self.pdf.pages)
@@ -511,23 +1169,82 @@ class PdfFile:
     def get_boxes(self, page_number: int) -> List[Box]:
         return [box for box in self.pages_parsed[page_number].get_boxes() if box is not None]
 
-    def save(self, path: str, progressbar: bool = False):
+    def _get_image_visible_boxes(self) -> Dict[int, Tuple[float, float, float, float] or None]:
+        visible_boxes = {}
+        for page in self.pages_parsed:
+            add_image_visible_boxes(visible_boxes, page)
+        return visible_boxes
+
+    def _trim_images_to_visible_area(self) -> Tuple[Dict[int, List[float]], List[ImageBackup]]:
+        return trim_images_to_visible_boxes(self.pdf, self._get_image_visible_boxes(),
+                                            self.max_trimmed_image_size_ratio)
+
+    def save(self, path: str, progressbar: bool = False, trim_images: bool = True, prune_invisible: bool = True):
+        self.wait_until_loaded()
+        # Saving edits the pikepdf objects (trimming, edited pages, resources), render threads read the same document
+        with FITZ_LOCK, profile_stage("save"):
+            self._save(path, progressbar, trim_images, prune_invisible)
+
+    def _save(self, path: str, progressbar: bool, trim_images: bool, prune_invisible: bool):
+        if self.path and os.path.exists(path) and os.path.samefile(self.path, path):
+            # The opened file is memory mapped and read while saving
+            raise ValueError("Can not save over the opened PDF file, save it under a different name")
         if progressbar:
             from .gui.progress_bar_window import ProgressBarWindow
             progress_bar_window = ProgressBarWindow("Saving PDF", f"Saving PDF...", 0, len(self.pages_parsed))
 
-        for i, page in enumerate(self.pages_parsed):
-            page.get_edited_pike_page()  # Just so that page data is updated before saving
+        # Trimming is undone after saving, so that crops can still be changed afterwards
+        with self.stats.stage("trim_images"):
+            image_placements, image_backups = self._trim_images_to_visible_area() if trim_images else ({}, [])
+
+        with self.stats.stage("edit_pages", pages=self.page_count):
+            for i, page in enumerate(self.pages_parsed):
+                page.get_edited_pike_page(image_placements, prune_invisible)  # Just so that page data is updated before saving
 
-            if progressbar:
-                progress_bar_window.update_progress(i + 1)
-                progress_bar_window.update_message(f"Saving PDF... page {i + 1}/{len(self.pages_parsed)}")
+                if progressbar:
+                    progress_bar_window.update_progress(i + 1)
+                    progress_bar_window.update_message(f"Saving PDF... page {i + 1}/{len(self.pages_parsed)}")
 
         if progressbar:
             progress_bar_window.close()
 
-        self.pdf.remove_unreferenced_resources()
-        self.pdf.save(path)
+        # Removing unreferenced resources edits pages in place, keep them for content that may come back later
+        resources_backups = [_backup_page_resources(page.obj) for page in self.pdf.pages]
+        try:
+            with self.stats.stage("write", path=path):
+                self.pdf.remove_unreferenced_resources()
+                self.pdf.save(path)
+        finally:
+            for backup in image_backups:
+                restore_image(self.pdf, backup)
+            for page, resources_backup in zip(self.pdf.pages, resources_backups):
+                _restore_page_resources(page.obj, resources_backup)
+        self.stats.write_summary()
+
+    @staticmethod
+    def _get_optimization_options(images_quality: int, should_resize_images: bool,
+                                  should_remove_images: bool) -> OptimizationOptions:
+        return OptimizationOptions(
+            jpg_quality=images_quality,
+            png_quality=images_quality,
+            should_resize=should_resize_images,
+            should_remove_images=should_remove_images
+        )
+
+    def estimate_images_optimization(self, images_quality: int = 30, should_resize_images: bool = True,
+                                     should_remove_images: bool = False,
+                                     sample_size: int = 8) -> ImageOptimizationEstimate:
+        """ Quick estimate of what optimize_images would do, from a sample of images. Does not change the PDF. """
+        self.wait_until_loaded()  # The background loader reads the same pikepdf document
+        options = self._get_optimization_options(images_quality, should_resize_images, should_remove_images)
+        images = self.images
+        # The same lock as optimize_images and the render threads, they use the same pikepdf document
+        with FITZ_LOCK, self.stats.stage("estimate_optimization", sample_size=sample_size), \
+                profile_stage("estimate_optimization"):
+            estimate = estimate_pdf_images_optimization(self.pdf, images, self.temp_dir.name, options,
+                                                        sample_size=sample_size)
+        logger.debug(f"Images optimization estimate: {estimate}")
+        return estimate
 
     def optimize_images(self, images_quality: int = 30, should_resize_images: bool = True,
                         should_remove_images: bool = False, progressbar: bool = False):
@@ -536,15 +1253,82 @@ class PdfFile:
             progress_bar_window = ProgressBarWindow("Optimizing images", f"Optimizing images...",
                                                     0, len(self.pages_parsed), infinite_mode=True)
 
+        self.wait_until_loaded()  # The background loader reads the same pikepdf document, qpdf is not thread safe
         logger.info(f"Optimizing images with params quality={images_quality}, resize={should_resize_images}, "
                     f"remove={should_remove_images}")
-        options = OptimizationOptions(
-            jpg_quality=images_quality,
-            png_quality=images_quality,
-            should_resize=should_resize_images,
-            should_remove_images=should_remove_images
-        )
-        optimize_pdf_images(self.pdf, self.images, self.temp_dir.name, options)
+        options = self._get_optimization_options(images_quality, should_resize_images, should_remove_images)
+        images = self.images
+        # Render threads also read the document (edited pages)
+        with FITZ_LOCK, profile_stage("optimize_images"):
+            optimize_pdf_images(self.pdf, images, self.temp_dir.name, options, stats=self.stats)
 
         if progressbar:
             progress_bar_window.close()
+
+
+def add_image_visible_boxes(visible_boxes: Dict[int, Tuple[float, float, float, float] or None], page: PdfPage):
+    """
+    Adds images drawn directly by the page to `visible_boxes`. For every image it holds the union of its image space
+    ([0, 1] x [0, 1]) parts that are inside the visible area of some page as (u0, v0, u1, v1), or None if never visible.
+    """
+    x_min, y_min, x_max, y_max = page.get_visible_area()
+    for section in page.sections:
+        if section.typ != Section.SectionType.OBJECT or section.get_additional("transform") is None:
+            continue
+        a, b, c, d, e, f = section.get_additional("transform")
+        transform = np.array([[a, b, 0], [c, d, 0], [e, f, 1]], dtype=np.float64)
+        if abs(np.linalg.det(transform)) < 1e-9:
+            continue
+        corners = np.array([[x_min, y_min, 1], [x_min, y_max, 1], [x_max, y_min, 1], [x_max, y_max, 1]],
+                           dtype=np.float64) @ np.linalg.inv(transform)
+        u0, v0 = max(corners[:, 0].min(), 0), max(corners[:, 1].min(), 0)
+        u1, v1 = min(corners[:, 0].max(), 1), min(corners[:, 1].max(), 1)
+
+        xref = section.get_additional("xref")
+        box = (u0, v0, u1, v1) if u0 < u1 and v0 < v1 else None
+        if xref not in visible_boxes or visible_boxes[xref] is None:
+            visible_boxes[xref] = box
+        elif box is not None:
+            old = visible_boxes[xref]
+            visible_boxes[xref] = (min(old[0], u0), min(old[1], v0), max(old[2], u1), max(old[3], v1))
+
+
+def trim_images_to_visible_boxes(pdf: pikepdf.Pdf, visible_boxes: Dict[int, Tuple[float, float, float, float] or None],
+                                 max_trimmed_image_size_ratio: float = 0.9) \
+        -> Tuple[Dict[int, List[float]], List[ImageBackup]]:
+    """
+    Crop pixels of images that are never visible because of page crops (or page edges), see add_image_visible_boxes.
+    Images are trimmed only if at most `max_trimmed_image_size_ratio` of their pixels remain.
+    Returns placement matrixes for the trimmed images and backups to restore the original images.
+    """
+    image_placements = {}
+    backups = []
+    form_image_xrefs = find_form_image_xrefs(pdf)
+
+    for xref, visible_box in visible_boxes.items():
+        if xref in form_image_xrefs or not is_image_trimmable(pdf, xref):
+            continue  # Drawn somewhere we do not track or can not be trimmed
+
+        image = pdf.get_object(xref, 0)
+        width, height = int(image.Width), int(image.Height)
+        if visible_box is None:
+            left, top, right, bottom = 0, 0, 1, 1
+        else:
+            u0, v0, u1, v1 = visible_box
+            # One pixel margin for interpolation at the edges, image rows go from the top
+            left, right = max(int(np.floor(u0 * width)) - 1, 0), min(int(np.ceil(u1 * width)) + 1, width)
+            top, bottom = max(int(np.floor((1 - v1) * height)) - 1, 0), min(int(np.ceil((1 - v0) * height)) + 1, height)
+
+        if (right - left) * (bottom - top) > max_trimmed_image_size_ratio * width * height:
+            continue  # Not worth the re-encoding
+
+        backup = backup_image(pdf, xref)
+        trimmed_box = trim_image(pdf, xref, (left, top, right, bottom))
+        if trimmed_box:
+            left, top, right, bottom = trimmed_box
+            backups.append(backup)
+            image_placements[xref] = [(right - left) / width, 0, 0, (bottom - top) / height,
+                                      left / width, 1 - bottom / height]
+
+    logger.debug(f"Trimmed {len(backups)} images to visible area")
+    return image_placements, backups
@@ -0,0 +1,166 @@
+import atexit
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR_ENV = "PDF2READER_PROFILE"
+PROFILE_MEMORY_ENV = "PDF2READER_PROFILE_MEMORY"
+
+# Since Python 3.12 cProfile uses sys.monitoring, which is shared by the whole process: only one profiler can be
+# enabled at a time and it records the calls of all threads
+PROCESS_WIDE_CPROFILE = sys.version_info >= (3, 12)
+
+
+class StageProfiler:
+    """
+    Profiles the pipeline stages (see profile_stage) and writes for each stage to `directory`:
+    - <stage>.pstats: cProfile statistics of all runs of the stage (pstats / snakeviz)
+    - <stage>.collapsed: sampled call stacks in the collapsed format ("frame;frame;frame count"),
+      for flame graph tools (flamegraph.pl, speedscope, inferno)
+    - <stage>.tracemalloc and <stage>-memory.txt: with `trace_memory`, snapshot of the allocations after the stage
+      and its top allocating lines
+
+    Only the outermost stage of a thread is profiled, stages inside it are a part of its profile.
+    Before Python 3.12 each thread has its own cProfile profiler, so stages in other threads can run at the same time.
+    From 3.12 on there can be only one in the process: a stage is run under cProfile only if no other stage is,
+    its profile then also contains the calls of other threads during the stage. Stages that can not be run under
+    cProfile (or when another profiling tool is active) are recorded only in the sampled stacks.
+    Files are written when the process exits, or by `dump`.
+    """
+    SAMPLE_INTERVAL = 0.005  # Seconds between stack samples
+    SNAPSHOT_INTERVAL = 1.  # Minimal seconds between memory snapshots of a stage, per-page stages run often
+    MAX_STACK_DEPTH = 128
+
+    def __init__(self, directory: str or Path, trace_memory: bool = False):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.trace_memory = trace_memory
+
+        self._profiles: Dict[str, cProfile.Profile] = {}
+        self._stacks: Dict[str, Counter] = defaultdict(Counter)
+        self._snapshots: Dict[str, tuple[float, tracemalloc.Snapshot]] = {}
+        self._active_stages: Dict[int, str] = {}  # Thread id -> profiled stage running in it
+        self._cprofile_thread = None  # Thread whose stage has the enabled cProfile profiler, from 3.12
+        self._lock = threading.Lock()
+
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+        threading.Thread(target=self._sample_stacks, daemon=True).start()
+        atexit.register(self.dump)
+
+    @contextmanager
+    def stage(self, name: str):
+        thread_id = threading.get_ident()
+        with self._lock:
+            nested = thread_id in self._active_stages
+        if nested:
+            yield
+            return
+
+        profile = None
+        try:
+            with self._lock:
+                if not PROCESS_WIDE_CPROFILE:
+                    profile = self._profiles.setdefault(name, cProfile.Profile())
+                elif self._cprofile_thread is None:
+                    profile = self._profiles.setdefault(name, cProfile.Profile())
+                    self._cprofile_thread = thread_id
+            if profile is not None:
+                try:
+                    profile.enable()
+                except ValueError:  # Another profiler is active, e.g. in a debugger
+                    logger.debug(f"Can not profile stage {name} with cProfile, only sampling it", exc_info=True)
+                    profile = None
+                    with self._lock:
+                        self._cprofile_thread = None
+            with self._lock:
+                self._active_stages[thread_id] = name
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            with self._lock:
+                self._active_stages.pop(thread_id, None)
+                if self._cprofile_thread == thread_id:
+                    self._cprofile_thread = None
+            if self.trace_memory:
+                self._take_snapshot(name)
+
+    def _take_snapshot(self, name: str):
+        previous = self._snapshots.get(name)
+        if previous is None or time.monotonic() - previous[0] >= self.SNAPSHOT_INTERVAL:
+            self._snapshots[name] = (time.monotonic(), tracemalloc.take_snapshot())
+
+    def _sample_stacks(self):
+        while True:
+            time.sleep(self.SAMPLE_INTERVAL)
+            with self._lock:
+                active_stages = dict(self._active_stages)
+            if not active_stages:
+                continue
+            frames = sys._current_frames()
+            for thread_id, name in active_stages.items():
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None and len(stack) < self.MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if stack:
+                    self._stacks[name][";".join(reversed(stack))] += 1
+
+    def dump(self):
+        with self._lock:
+            profiles = dict(self._profiles)
+            stacks = {name: Counter(counter) for name, counter in self._stacks.items()}
+            snapshots = dict(self._snapshots)
+
+        for name, profile in profiles.items():
+            try:
+                profile.create_stats()
+                if profile.stats:  # Empty when the stage was only sampled
+                    profile.dump_stats(self.directory / f"{name}.pstats")
+            except (TypeError, ValueError):  # Nothing was recorded yet
+                pass
+        for name, counter in stacks.items():
+            with open(self.directory / f"{name}.collapsed", "w") as f:
+                for stack, count in counter.most_common():
+                    f.write(f"{stack} {count}\n")
+        for name, (_, snapshot) in snapshots.items():
+            snapshot.dump(str(self.directory / f"{name}.tracemalloc"))
+            with open(self.directory / f"{name}-memory.txt", "w") as f:
+                for stat in snapshot.statistics("lineno")[:30]:
+                    f.write(f"{stat}\n")
+        logger.info(f"Wrote profiles of {len(profiles)} stages to {self.directory}")
+
+
+_profiler: StageProfiler or None = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler() -> StageProfiler or None:
+    """ The profiler set by the PDF2READER_PROFILE (directory) and PDF2READER_PROFILE_MEMORY variables, if any """
+    global _profiler
+    if _profiler is None and os.environ.get(PROFILE_DIR_ENV):
+        with _profiler_lock:
+            if _profiler is None:
+                _profiler = StageProfiler(os.environ[PROFILE_DIR_ENV],
+                                          trace_memory=os.environ.get(PROFILE_MEMORY_ENV, "") not in ("", "0"))
+                logger.info(f"Profiling stages to {_profiler.directory}")
+    return _profiler
+
+
+def profile_stage(name: str):
+    """ Runs the with block as the stage `name` of the profiler, if profiling is enabled """
+    profiler = get_profiler()
+    return profiler.stage(name) if profiler is not None else nullcontext()
@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+STATS_PATH_ENV = "PDF2READER_STATS"
+
+
+class PipelineStats:
+    """
+    Timings and counters of the PdfFile stages (parsing, matching, image extraction and optimization,
+    rendering, saving). Thread safe, stages also run in background loader and render threads.
+
+    If `jsonl_path` is given, every finished stage is also appended to it as one JSON line
+    {"stage", "seconds", "time", ...fields}, the counters are written by `write_summary`.
+    """
+
+    def __init__(self, jsonl_path: str or Path = None):
+        self.jsonl_path = Path(jsonl_path) if jsonl_path else None
+        self.seconds: Dict[str, float] = defaultdict(float)  # Total time by stage
+        self.calls: Dict[str, int] = defaultdict(int)  # Number of times the stage ran
+        self.counters: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self._jsonl_file = None
+
+    @staticmethod
+    def from_env() -> "PipelineStats":
+        """ Stats written to the JSON lines file from the PDF2READER_STATS environment variable, if set """
+        return PipelineStats(os.environ.get(STATS_PATH_ENV) or None)
+
+    @contextmanager
+    def stage(self, name: str, **fields):
+        """ Times the code in the with block as the stage `name`, `fields` are added to its JSON line """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start, **fields)
+
+    def add_time(self, name: str, seconds: float, **fields):
+        with self._lock:
+            self.seconds[name] += seconds
+            self.calls[name] += 1
+            if self.jsonl_path:
+                self._write_line({"stage": name, "seconds": round(seconds, 6), "time": time.time(), **fields})
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] += n
+
+    def _write_line(self, record: dict):
+        try:
+            if self._jsonl_file is None:
+                self._jsonl_file = open(self.jsonl_path, "a", buffering=1)
+            self._jsonl_file.write(json.dumps(record, default=str) + "\n")
+        except OSError:
+            logger.warning(f"Failed to write stats to {self.jsonl_path}", exc_info=True)
+            self.jsonl_path = None
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "stages": {name: {"seconds": round(self.seconds[name], 6), "calls": self.calls[name]}
+                           for name in self.seconds},
+                "counters": dict(self.counters),
+            }
+
+    def write_summary(self):
+        """ Appends the totals of all stages and the counters as one {"summary": ...} JSON line """
+        summary = self.as_dict()
+        with self._lock:
+            if self.jsonl_path:
+                self._write_line({"summary": summary, "time": time.time()})
+        logger.info(f"Stats: {summary}")
+
+    def close(self):
+        with self._lock:
+            if self._jsonl_file is not None:
+                self._jsonl_file.close()
+                self._jsonl_file = None
+
+    def __repr__(self):
+        return f"PipelineStats({self.as_dict()})"
+
+
+def stage(stats: PipelineStats or None, name: str, **fields):
+    """ stats.stage(name), or nothing when there are no stats """
+    return stats.stage(name, **fields) if stats is not None else nullcontext()
@@ -0,0 +1,152 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Hashable
+
+from PIL import Image, features
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THUMBNAIL_CACHE_SIZE = 128 * 1024 * 1024
+DEFAULT_DISK_THUMBNAIL_CACHE_SIZE = 256 * 1024 * 1024
+DEFAULT_RASTER_CACHE_SIZE = 256 * 1024 * 1024
+
+
+def get_image_size_in_bytes(img: Image) -> int:
+    return img.width * img.height * len(img.getbands())
+
+
+def get_default_disk_cache_dir() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "pdf2reader" / "thumbnails"
+
+
+class DiskThumbnailCache:
+    """
+    Compressed page thumbnails kept between runs, keyed by the hash of the page content (PdfPage.get_content_hash)
+    and the thumbnail size. Least recently used files are deleted when the directory grows above `max_bytes`.
+    """
+
+    def __init__(self, directory: str or Path = None, max_bytes: int = DEFAULT_DISK_THUMBNAIL_CACHE_SIZE):
+        self.directory = Path(directory) if directory else get_default_disk_cache_dir()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._extension, self._save_kwargs = (".webp", {"format": "WEBP", "quality": 85}) if features.check("webp") \
+            else (".png", {"format": "PNG", "optimize": True})
+        self._lock = threading.Lock()
+        self.bytes_used = sum(path.stat().st_size for path in self._get_files())
+
+    def _get_files(self):
+        return self.directory.glob("*" + self._extension)
+
+    def get_path(self, content_hash: str, width: int, height: int, disabled: bool) -> Path:
+        return self.directory / f"{content_hash}-{width}x{height}{'-disabled' if disabled else ''}{self._extension}"
+
+    def get(self, path: Path) -> Image or None:
+        try:
+            with Image.open(path) as img:
+                img.load()
+            os.utime(path)  # Modification time marks the last use
+            return img
+        except FileNotFoundError:
+            return None
+        except OSError:
+            logger.warning(f"Failed to read cached thumbnail {path}", exc_info=True)
+            return None
+
+    def put(self, path: Path, img: Image):
+        tmp_path = path.with_name(f"{path.stem}.{threading.get_ident()}.tmp")
+        try:
+            img.save(tmp_path, **self._save_kwargs)
+            size = tmp_path.stat().st_size
+            with self._lock:
+                if path.exists():
+                    self.bytes_used -= path.stat().st_size
+                os.replace(tmp_path, path)
+                self.bytes_used += size
+                if self.bytes_used > self.max_bytes:
+                    self._evict()
+        except OSError:
+            logger.warning(f"Failed to write cached thumbnail {path}", exc_info=True)
+            tmp_path.unlink(missing_ok=True)
+
+    def _evict(self):
+        """ Deletes least recently used thumbnails down to 90 % of max_bytes, so it does not run on every put """
+        files = []
+        for path in self._get_files():
+            try:
+                stat = path.stat()
+                files.append((stat.st_mtime, stat.st_size, path))
+            except FileNotFoundError:
+                pass
+        files.sort()
+        self.bytes_used = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if self.bytes_used <= self.max_bytes * 0.9:
+                break
+            path.unlink(missing_ok=True)
+            self.bytes_used -= size
+
+    def clear(self):
+        with self._lock:
+            for path in self._get_files():
+                path.unlink(missing_ok=True)
+            self.bytes_used = 0
+
+
+class ThumbnailCache:
+    """
+    Rendered page thumbnails shared by all views of a PdfFile, least recently used are evicted above `max_bytes`.
+    Also used by PdfFile for full size page renders (PdfFile.raster_cache).
+    Thread safe, thumbnails are put from background render threads.
+    Backed by `disk_cache` if given, for thumbnails that are not in memory.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_THUMBNAIL_CACHE_SIZE, disk_cache: DiskThumbnailCache = None):
+        self.max_bytes = max_bytes
+        self.disk_cache = disk_cache
+        self.bytes_used = 0
+        self._images: "OrderedDict[Hashable, Image]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(page_number: int, width: int, height: int, disabled: bool) -> tuple:
+        return page_number, width, height, disabled
+
+    def get(self, key: Hashable) -> Image or None:
+        with self._lock:
+            img = self._images.get(key)
+            if img is not None:
+                self._images.move_to_end(key)
+            return img
+
+    def put(self, key: Hashable, img: Image):
+        size = get_image_size_in_bytes(img)
+        with self._lock:
+            if key in self._images:
+                self.bytes_used -= get_image_size_in_bytes(self._images.pop(key))
+            if size > self.max_bytes:
+                return
+            self._images[key] = img
+            self.bytes_used += size
+            while self.bytes_used > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self.bytes_used -= get_image_size_in_bytes(evicted)
+
+    def has_room(self, size: int) -> bool:
+        """ Whether an image of `size` bytes fits without evicting anything """
+        return self.bytes_used + size <= self.max_bytes
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._images
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self.bytes_used = 0